@@ -0,0 +1,89 @@
+"""Benchmark: segment-parallel vs single-process CPU transcoding.
+
+Generates a synthetic clip (``testsrc2`` video plus a sine tone) and encodes it
+with ``libx265`` once through a single ffmpeg process, as the Transcode Worker
+does by default, and once through
+:func:`chunked_transcode.transcode_chunked`. Wall-clock times and the speed-up
+are printed.
+
+Usage::
+
+    python benchmarks/bench_chunked_transcode.py --duration 120 --resolution 1920x1080
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'services', 'transcode_worker'))
+
+from chunked_transcode import default_workers, transcode_chunked  # noqa: E402
+
+VIDEO_ARGS = ['-c:v', 'libx265', '-crf', '28', '-preset', 'medium']
+AUDIO_ARGS = ['-c:a:0', 'aac']
+
+
+def create_test_clip(path, duration, resolution, gop):
+    """Create a synthetic clip with a keyframe every *gop* frames."""
+    cmd = [
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f'testsrc2=duration={duration}:size={resolution}:rate=24',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-g', str(gop),
+        '-c:a', 'aac', '-shortest', path
+    ]
+    subprocess.run(cmd, check=True)
+
+
+def run_single(input_file, output_file):
+    """Encode with one ffmpeg process; returns wall-clock seconds."""
+    start = time.perf_counter()
+    subprocess.run(
+        ['ffmpeg', '-v', 'error', '-y', '-i', input_file, *VIDEO_ARGS, *AUDIO_ARGS, output_file],
+        check=True
+    )
+    return time.perf_counter() - start
+
+
+def run_chunked(input_file, output_file, duration, workers, segment_seconds):
+    """Encode segment-parallel; returns wall-clock seconds."""
+    start = time.perf_counter()
+    ok = transcode_chunked(
+        input_file, output_file, VIDEO_ARGS, AUDIO_ARGS, duration,
+        workers=workers, segment_seconds=segment_seconds
+    )
+    if not ok:
+        raise RuntimeError("chunked transcode failed")
+    return time.perf_counter() - start
+
+
+def main():
+    """Run both encoders on the same clip and print the comparison."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--duration', type=int, default=60, help='clip length in seconds')
+    parser.add_argument('--resolution', default='1280x720')
+    parser.add_argument('--segment-seconds', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=default_workers())
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        clip = os.path.join(temp_dir, 'clip.mkv')
+        create_test_clip(clip, args.duration, args.resolution, gop=48)
+
+        single = run_single(clip, os.path.join(temp_dir, 'single.mkv'))
+        chunked = run_chunked(clip, os.path.join(temp_dir, 'chunked.mkv'), args.duration,
+                              args.workers, args.segment_seconds)
+
+        print(f"clip: {args.duration}s {args.resolution}, cores: {os.cpu_count()}, "
+              f"workers: {args.workers}, segment: {args.segment_seconds}s")
+        print(f"single-process: {single:8.2f}s")
+        print(f"chunked:        {chunked:8.2f}s")
+        print(f"speed-up:       {single / chunked:8.2f}x")
+
+
+if __name__ == '__main__':
+    main()
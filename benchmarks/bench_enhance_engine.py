@@ -0,0 +1,91 @@
+"""Benchmark: frame-batch enhance engine throughput on the CPU.
+
+Generates a synthetic clip and runs it through
+:func:`frame_pipeline.run_frame_pipeline` with the CPU build of Real-ESRGAN
+(``realesrgan-ncnn``), the same engine the Enhance Worker uses on a GPU. Each
+combination of batch size and VRAM budget (which sets ``-t`` / ``-j`` via
+:func:`frame_pipeline.upscale_tuning`) is timed and reported in frames/s. ``--dedup`` adds duplicate-frame skipping
+with the given dHash threshold and reports the share of frames skipped.
+
+Usage::
+
+    python benchmarks/bench_enhance_engine.py --duration 10 --batch 16 64 --vram 2 4 8
+    python benchmarks/bench_enhance_engine.py --dedup 0
+
+With ``benchmarks/fake_bin`` first on ``PATH`` this measures the pipeline
+overhead alone.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'services', 'enhance_worker'))
+
+from frame_pipeline import run_frame_pipeline, upscale_tuning  # noqa: E402
+
+
+def create_test_clip(path, duration, resolution):
+    """Create a synthetic 24 fps clip with a sine tone."""
+    cmd = [
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f'testsrc2=duration={duration}:size={resolution}:rate=24',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac', '-shortest', path
+    ]
+    subprocess.run(cmd, check=True)
+
+
+def run_engine(clip, output, batch, vram, model, scale, dedup=None):
+    """Enhance *clip* once; returns (frames, upscaled frames, seconds)."""
+    stats = {}
+
+    def _upscale_cmd(in_dir, out_dir):
+        return (['realesrgan-ncnn', '-i', in_dir, '-o', out_dir, '-m', model, '-s', str(scale)]
+                + upscale_tuning(vram, scale, cpu=True))
+
+    encoder = ['ffmpeg', '-v', 'error', '-y', '-f', 'image2pipe', '-c:v', 'png', '-i', '-',
+               '-c:v', 'libx264', '-preset', 'ultrafast', output]
+    start = time.perf_counter()
+    if not run_frame_pipeline(clip, encoder, _upscale_cmd, batch, dedup_threshold=dedup,
+                              stats=stats):
+        raise RuntimeError("enhance engine failed")
+    return stats['frames'], stats['upscaled'], time.perf_counter() - start
+
+
+def main():
+    """Run every batch/VRAM combination and print frames/s."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--duration', type=int, default=5, help='clip length in seconds')
+    parser.add_argument('--resolution', default='720x480')
+    parser.add_argument('--batch', type=int, nargs='+', default=[16, 64])
+    parser.add_argument('--vram', type=float, nargs='+', default=[2, 4, 8])
+    parser.add_argument('--model', default='/models/realesr-animevideov3-x2')
+    parser.add_argument('--scale', type=int, default=2)
+    parser.add_argument('--dedup', type=int, default=None, metavar='THRESHOLD',
+                        help='skip duplicate frames within this dHash distance')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        clip = os.path.join(temp_dir, 'clip.mkv')
+        create_test_clip(clip, args.duration, args.resolution)
+        print(f"clip: {args.duration}s {args.resolution}, cores: {os.cpu_count()}")
+        print(f"{'batch':>6} {'vram':>5} {'tuning':>16} {'frames':>7} {'skipped':>8} "
+              f"{'seconds':>8} {'fps':>7}")
+        for batch in args.batch:
+            for vram in args.vram:
+                frames, upscaled, seconds = run_engine(
+                    clip, os.path.join(temp_dir, 'out.mkv'), batch, vram, args.model,
+                    args.scale, args.dedup)
+                tuning = ' '.join(upscale_tuning(vram, args.scale, cpu=True))
+                skipped = 1 - upscaled / frames if frames else 0
+                print(f"{batch:>6} {vram:>5} {tuning:>16} {frames:>7} {skipped:>8.1%} "
+                      f"{seconds:>8.2f} {frames / seconds:>7.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+"""Pipeline benchmark: real workers, stand-in media binaries, local Redis.
+
+Starts the rip, enhance, transcode, metadata and blackhole workers as local
+processes with ``benchmarks/fake_bin`` first on ``PATH``. The stand-ins for
+makemkvcon, Real-ESRGAN, ffmpeg and ffprobe print realistic ``PRGV:`` and
+``time=`` progress and write sized output files. The harness then injects
+simultaneous disc inserts and reports:
+
+* per-stage latency (queue wait and processing time),
+* end-to-end job latency percentiles,
+* throughput in jobs/hour,
+* peak RSS of the worker processes (including their children),
+* Redis stream growth and memory.
+
+Usage::
+
+    python benchmarks/pipeline_bench.py --drives 1 5 20 --redis-url redis://localhost:6379/15
+
+The selected Redis database is flushed before every scenario, so point
+``--redis-url`` at a database reserved for benchmarking.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List
+
+import psutil
+import redis
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICES = os.path.join(ROOT, 'services')
+FAKE_BIN = os.path.join(ROOT, 'benchmarks', 'fake_bin')
+sys.path.insert(0, SERVICES)
+
+from riparr_common.streams import decode_message  # noqa: E402
+
+STAGES = ['rip', 'enhance', 'transcode', 'metadata', 'blackhole']
+STREAMS = ['drive_events'] + [f'{stage}_events' for stage in STAGES]
+
+WORKERS = {
+    'rip': ('rip_worker/rip_worker.py', 'ENABLE_RIP'),
+    'enhance': ('enhance_worker/enhance_worker.py', 'ENABLE_ENHANCE'),
+    'transcode': ('transcode_worker/transcode_worker.py', 'ENABLE_TRANSCODE'),
+    'metadata': ('metadata_worker/metadata_worker.py', 'ENABLE_METADATA'),
+    'blackhole': ('blackhole_integration/blackhole_integration.py', 'ENABLE_BLACKHOLE'),
+}
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Return the *pct* percentile of *values* (nearest rank)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def worker_env(redis_url: str, data_dir: str) -> Dict[str, str]:
+    """Environment shared by all worker processes."""
+    env = dict(os.environ)
+    env.update({
+        'PATH': FAKE_BIN + os.pathsep + env.get('PATH', ''),
+        'PYTHONPATH': SERVICES,
+        'PYTHONUNBUFFERED': '1',
+        'REDIS_URL': redis_url,
+        'MKV_OUTPUT_DIR': os.path.join(data_dir, 'rips'),
+        'ENHANCED_OUTPUT_DIR': os.path.join(data_dir, 'enhanced'),
+        'TRANSCODED_OUTPUT_DIR': os.path.join(data_dir, 'transcoded'),
+        'METADATA_DIR': os.path.join(data_dir, 'metadata'),
+        'BLACKHOLE_PATH': os.path.join(data_dir, 'plex'),
+        'MODELS_DIR': os.path.join(data_dir, 'models'),
+        'STREAM_BLOCK_MS': '200',
+        # Every simulated drive holds the same fake disc; rip each one, whole
+        'DISC_DEDUP': 'off',
+        'TITLE_SELECTION': 'all',
+    })
+    for _script, flag in WORKERS.values():
+        env[flag] = 'true'
+    return env
+
+
+class RssSampler(threading.Thread):
+    """Sample the summed RSS of the worker processes and their children."""
+
+    def __init__(self, processes: Dict[str, subprocess.Popen], interval: float = 0.25) -> None:
+        super().__init__(daemon=True)
+        self.processes = {name: psutil.Process(p.pid) for name, p in processes.items()}
+        self.interval = interval
+        self.peak_total = 0
+        self.peak_by_worker: Dict[str, int] = {name: 0 for name in processes}
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            total = 0
+            for name, proc in self.processes.items():
+                rss = 0
+                try:
+                    for p in [proc] + proc.children(recursive=True):
+                        rss += p.memory_info().rss
+                except psutil.Error:
+                    pass
+                self.peak_by_worker[name] = max(self.peak_by_worker[name], rss)
+                total += rss
+            self.peak_total = max(self.peak_total, total)
+            self.stopped.wait(self.interval)
+
+
+def collect_events(client: redis.Redis, drives: int, timeout: float) -> List[Dict[str, Any]]:
+    """Read all stage events until *drives* jobs finished or *timeout* passed."""
+    last_ids = {stream: '0' for stream in STREAMS}
+    events: List[Dict[str, Any]] = []
+    finished = set()
+    deadline = time.time() + timeout
+    while time.time() < deadline and len(finished) < drives:
+        response = client.xread(last_ids, block=500)
+        for stream, entries in response or []:
+            for msg_id, fields in entries:
+                last_ids[stream] = msg_id
+                payload = decode_message(fields)
+                event = {
+                    'stream': stream,
+                    'event': payload.get('event'),
+                    'job_id': payload.get('job_id'),
+                    'drive_id': payload.get('drive_id'),
+                    'ts': int(msg_id.split('-')[0]) / 1000.0,
+                }
+                events.append(event)
+                if stream == 'blackhole_events' and event['event'] == 'complete':
+                    finished.add(event['job_id'])
+    return events
+
+
+def analyse(events: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Turn the collected events into latency and throughput figures."""
+    inserts = {e['drive_id']: e['ts'] for e in events
+               if e['stream'] == 'drive_events' and e['event'] == 'insert'}
+    job_drive = {e['job_id']: e['drive_id'] for e in events
+                 if e['stream'] == 'rip_events' and e['event'] == 'start'}
+    marks: Dict[str, Dict[str, float]] = {}
+    for e in events:
+        if e['job_id'] and e['event'] in ('start', 'complete'):
+            stage = e['stream'].replace('_events', '')
+            marks.setdefault(e['job_id'], {}).setdefault(f"{stage}.{e['event']}", e['ts'])
+
+    stages: Dict[str, Dict[str, float]] = {}
+    for index, stage in enumerate(STAGES):
+        work, wait = [], []
+        for job_id, m in marks.items():
+            if f'{stage}.start' in m and f'{stage}.complete' in m:
+                work.append(m[f'{stage}.complete'] - m[f'{stage}.start'])
+            previous = (inserts.get(job_drive.get(job_id)) if index == 0
+                        else m.get(f'{STAGES[index - 1]}.complete'))
+            if previous is not None and f'{stage}.start' in m:
+                wait.append(m[f'{stage}.start'] - previous)
+        stages[stage] = {
+            'jobs': len(work),
+            'work_mean_s': round(statistics.mean(work), 2) if work else 0.0,
+            'work_p95_s': round(percentile(work, 95), 2),
+            'wait_mean_s': round(statistics.mean(wait), 2) if wait else 0.0,
+            'wait_p95_s': round(percentile(wait, 95), 2),
+        }
+
+    e2e = [m['blackhole.complete'] - inserts[job_drive[job_id]]
+           for job_id, m in marks.items()
+           if 'blackhole.complete' in m and job_drive.get(job_id) in inserts]
+    span = (max(m['blackhole.complete'] for m in marks.values() if 'blackhole.complete' in m)
+            - min(inserts.values())) if e2e else 0.0
+    return {
+        'stages': stages,
+        'completed_jobs': len(e2e),
+        'e2e_p50_s': round(percentile(e2e, 50), 2),
+        'e2e_p90_s': round(percentile(e2e, 90), 2),
+        'e2e_p99_s': round(percentile(e2e, 99), 2),
+        'throughput_jobs_per_hour': round(len(e2e) / span * 3600, 1) if span else 0.0,
+    }
+
+
+def run_scenario(redis_url: str, drives: int, timeout: float) -> Dict[str, Any]:
+    """Run one benchmark scenario with *drives* simultaneous disc inserts."""
+    client = redis.from_url(redis_url, decode_responses=True)
+    client.flushdb()
+    with tempfile.TemporaryDirectory(prefix='riparr_bench_') as data_dir:
+        env = worker_env(redis_url, data_dir)
+        processes = {
+            name: subprocess.Popen(
+                [sys.executable, os.path.join(SERVICES, script)], env=env,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            for name, (script, _flag) in WORKERS.items()
+        }
+        sampler = RssSampler(processes)
+        sampler.start()
+        try:
+            time.sleep(1.0)  # let the workers create their consumer groups
+            for i in range(drives):
+                client.xadd('drive_events', {'data': json.dumps({
+                    'event': 'insert', 'drive_id': f'bench_drive_{i}', 'device': f'/dev/sr{i}'
+                })})
+            events = collect_events(client, drives, timeout)
+        finally:
+            sampler.stopped.set()
+            for proc in processes.values():
+                proc.terminate()
+            for proc in processes.values():
+                try:
+                    proc.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+
+        result = analyse(events)
+        result.update({
+            'drives': drives,
+            'peak_rss_mb': round(sampler.peak_total / 2 ** 20, 1),
+            'peak_rss_mb_by_worker': {k: round(v / 2 ** 20, 1)
+                                      for k, v in sampler.peak_by_worker.items()},
+            'stream_lengths': {s: client.xlen(s) for s in STREAMS if client.exists(s)},
+            'stream_memory_kb': {s: round((client.memory_usage(s) or 0) / 1024, 1)
+                                 for s in STREAMS if client.exists(s)},
+        })
+        return result
+
+
+def print_report(result: Dict[str, Any]) -> None:
+    """Print one scenario result as a readable table."""
+    print(f"\n=== {result['drives']} drive(s): {result['completed_jobs']} jobs completed ===")
+    print(f"{'stage':<10} {'jobs':>5} {'wait mean':>10} {'wait p95':>10} "
+          f"{'work mean':>10} {'work p95':>10}")
+    for stage, s in result['stages'].items():
+        print(f"{stage:<10} {s['jobs']:>5} {s['wait_mean_s']:>9.2f}s {s['wait_p95_s']:>9.2f}s "
+              f"{s['work_mean_s']:>9.2f}s {s['work_p95_s']:>9.2f}s")
+    print(f"end-to-end p50/p90/p99: {result['e2e_p50_s']}s / {result['e2e_p90_s']}s / "
+          f"{result['e2e_p99_s']}s")
+    print(f"throughput: {result['throughput_jobs_per_hour']} jobs/hour")
+    print(f"peak RSS: {result['peak_rss_mb']} MB {result['peak_rss_mb_by_worker']}")
+    print(f"stream entries: {result['stream_lengths']}")
+    print(f"stream memory (KB): {result['stream_memory_kb']}")
+
+
+def main() -> None:
+    """Run the requested scenarios and print (or save) the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--drives', type=int, nargs='+', default=[1, 5, 20])
+    parser.add_argument('--redis-url', default='redis://localhost:6379/15')
+    parser.add_argument('--timeout', type=float, default=600.0,
+                        help='seconds to wait for all jobs of a scenario')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+    for drives in args.drives:
+        result = run_scenario(args.redis_url, drives, args.timeout)
+        print_report(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
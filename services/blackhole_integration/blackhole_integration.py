@@ -6,16 +6,22 @@ writes optional `.nfo` side-car metadata, and emits
 `blackhole_events` Redis stream.
 """
 
-import json
+import functools
 import logging
 import os
-import shutil
 import sys
 import time
 from typing import Any, Dict, List
 
 import redis
 
+from riparr_common import metrics
+from riparr_common.executor import JobExecutor
+from riparr_common.publisher import EventPublisher
+from riparr_common.streams import StreamConsumer
+from riparr_common.tracing import Tracer
+from transfer import TransferEngine
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -29,10 +35,14 @@ if not enable:
 # Redis connection
 redis_url = os.getenv('REDIS_URL', 'redis://redis:6379')
 r = redis.from_url(redis_url, decode_responses=True)
+publisher = EventPublisher.from_env(r)
+tracer = Tracer.from_env(r, 'blackhole')
 
 # Config
 blackhole_path = os.getenv('BLACKHOLE_PATH', '/media/plex')
 os.makedirs(blackhole_path, exist_ok=True)
+cleanup = os.getenv('CLEANUP', 'true').lower() == 'true'  # remove sources after delivery
+transfer_engine = TransferEngine.from_env(r)  # journaled, resumable copies
 
 # --------------------------------------------------------------------------- #
 # Helper functions
@@ -64,7 +74,7 @@ def process_metadata_complete(job_id: str, metadata_list: List[Dict[str, Any]])
         job_id: ID of the job being processed.
         metadata_list: A list of per-file metadata dictionaries.
     """
-    moved_files = []
+    pairs = []
     for metadata in metadata_list:
         original_file = metadata['original_file']
         directory = metadata['directory']
@@ -73,21 +83,26 @@ def process_metadata_complete(job_id: str, metadata_list: List[Dict[str, Any]])
         # Create target directory
         target_dir = os.path.join(blackhole_path, directory.lstrip('/'))
         os.makedirs(target_dir, exist_ok=True)
+        pairs.append((original_file, os.path.join(target_dir, file_pattern)))
 
-        # Move file
-        target_file = os.path.join(target_dir, file_pattern)
-        shutil.move(original_file, target_file)
-        moved_files.append(target_file)
+    # Move files concurrently (rename, link, or chunked copy across devices)
+    transfers = transfer_engine.transfer_all(pairs, keep_source=not cleanup)
+    moved_files = [transfer['target'] for transfer in transfers]
+    # Renames and links move no data; copies read and write what they copied
+    copied = sum(t['bytes'] - t.get('resumed_from', 0) for t in transfers if t['method'] == 'copy')
+    metrics.count_bytes('blackhole', read=copied, written=copied)
 
-        # Create side-car .nfo
-        create_sidecar_nfo(metadata, target_dir)
+    # Create side-car .nfo files once the media is in place
+    for metadata, (_source, target_file) in zip(metadata_list, pairs):
+        create_sidecar_nfo(metadata, os.path.dirname(target_file))
 
     # Publish complete
     complete_msg = {
         "job_id": job_id,
-        "moved_files": moved_files
+        "moved_files": moved_files,
+        "transfers": transfers
     }
-    r.xadd('blackhole_events', {'event': 'complete', 'data': json.dumps(complete_msg)})
+    publisher.publish('blackhole_events', 'complete', complete_msg)
     logger.info("Published blackhole.complete for job %s", job_id)
 
 
@@ -102,7 +117,7 @@ def process_metadata_event(data: Dict[str, Any]) -> None:
             "job_id": job_id,
             "metadata": metadata_list
         }
-        r.xadd('blackhole_events', {'event': 'start', 'data': json.dumps(start_msg)})
+        publisher.publish('blackhole_events', 'start', start_msg)
         logger.info("Published blackhole.start for job %s", job_id)
 
         # Process
@@ -111,21 +126,21 @@ def process_metadata_event(data: Dict[str, Any]) -> None:
 
 def main() -> None:
     """Event loop – blocks on Redis ``metadata_events`` stream and processes messages."""
-    last_id = '0'
+    consumer = StreamConsumer.from_env(r, 'metadata_events', 'blackhole')
+    executor = JobExecutor.from_env('blackhole', 'MAX_CONCURRENT_TRANSFERS', 2, r,
+                                   on_error=functools.partial(publisher.fail, 'blackhole_events'))
+    metrics.start_from_env(r, [(consumer.stream, consumer.group)])
     while True:
         try:
-            messages = r.xread({'metadata_events': last_id}, block=1000)
-            for _stream, msgs in messages:  # underscore to mark unused variable
-                for msg_id, msg in msgs:
-                    last_id = msg_id
-                    data = json.loads(msg['data'])
-                    process_metadata_event(data)
+            for msg_id, data in consumer.messages():
+                # Transfers run off the event loop; blocks while the queue is full
+                executor.submit(
+                    consumer.acking(msg_id, tracer.traced('blackhole', process_metadata_event,
+                                                          events=('complete',))),
+                    data, job_id=data.get('job_id'))
         except (redis.ConnectionError, redis.TimeoutError) as err:
             logger.error("Redis connection error: %s", err)
             time.sleep(1)
-        except json.JSONDecodeError as err:
-            logger.error("JSON decode error: %s", err)
-            time.sleep(1)
         except Exception as err:  # pylint: disable=broad-except
             logger.error("Unexpected error in main loop: %s", err)
             time.sleep(1)
@@ -0,0 +1,347 @@
+"""File transfer engine for blackhole delivery.
+
+``shutil.move`` copied multi-GB files single-threaded whenever the transcode
+output and the library were on different mounts. :class:`TransferEngine`
+picks the cheapest way to get a file into place:
+
+* ``rename``: atomic ``os.replace`` when source and target share a device,
+* ``hardlink``: link the source into the library (same device only),
+* ``reflink``: copy-on-write clone via ``FICLONE`` (btrfs, XFS),
+* ``copy``: chunked copy. Without hashing (``verify='none'``) it is a kernel
+  copy with ``copy_file_range``, falling back to ``sendfile`` and then plain
+  reads and writes. Hashing needs the data in user space, so it uses plain
+  reads and writes.
+
+``auto`` renames on the same device and otherwise tries a reflink before
+copying. Copies and links are written to a hidden temporary name next to the
+target and renamed into place once complete, so Plex never sees a partial
+file. Files of a job are transferred concurrently on a bounded pool.
+
+With a :class:`~transfer_journal.TransferJournal`, copies are resumable: the
+durable offset and per-chunk checksums are journaled as the copy proceeds.
+The source is deleted only once the complete copy is in place. Before that,
+the copy's size is compared with the source's. With ``verify='full'``, the
+copy is also re-read and its checksum compared with the source's.
+"""
+
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from transfer_journal import TransferJournal, chunk_hasher, tree_checksum
+
+logger = logging.getLogger(__name__)
+
+MODES = ('auto', 'rename', 'hardlink', 'reflink', 'copy')
+
+# none (default): size check only (zero-copy); stream: also checksum the source while copying
+# (reported, and guards resumes); full: also re-read the target and compare checksums
+VERIFY_MODES = ('none', 'stream', 'full')
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+# errno values meaning "this copy primitive does not work for these files"
+_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                errno.ENOTSUP, errno.EBADF}
+
+Transfer = Dict[str, Any]
+
+
+def temp_path(target: str) -> str:
+    """Return the hidden temporary name *target* is written to before renaming."""
+    directory, name = os.path.split(target)
+    return os.path.join(directory, f".{name}.part")
+
+
+def same_device(source: str, target: str) -> bool:
+    """Return True if *source* can be renamed to *target* without copying."""
+    return os.stat(source).st_dev == os.stat(os.path.dirname(target) or '.').st_dev
+
+
+def _copy_chunk(src_fd: int, dst_fd: int, offset: int, count: int, methods: List[str]) -> int:
+    """Copy up to *count* bytes at *offset*; drops unsupported entries from *methods*."""
+    while methods:
+        method = methods[0]
+        try:
+            if method == 'copy_file_range':
+                return os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+            if method == 'sendfile':
+                os.lseek(dst_fd, offset, os.SEEK_SET)
+                return os.sendfile(dst_fd, src_fd, offset, count)
+            data = os.pread(src_fd, count, offset)
+            return os.pwrite(dst_fd, data, offset)
+        except OSError as err:
+            if method == 'readwrite' or err.errno not in _UNSUPPORTED:
+                raise
+            methods.pop(0)
+    raise OSError(errno.ENOSYS, "no copy method available")
+
+
+def copy_methods() -> List[str]:
+    """Return the copy primitives to try, fastest first."""
+    methods = []
+    if hasattr(os, 'copy_file_range'):
+        methods.append('copy_file_range')
+    if hasattr(os, 'sendfile'):
+        methods.append('sendfile')
+    methods.append('readwrite')
+    return methods
+
+
+class TransferEngine:
+    """Move files into the library using the fastest safe method.
+
+    Args:
+        mode: One of :data:`MODES`.
+        workers: Files transferred concurrently.
+        chunk_size: Bytes per copy call in ``copy`` mode.
+        journal: Makes cross-device copies resumable when given.
+        verify: One of :data:`VERIFY_MODES`.
+    """
+
+    def __init__(
+        self,
+        mode: str = 'auto',
+        workers: int = 2,
+        chunk_size: int = 64 * 2 ** 20,
+        journal: Optional[TransferJournal] = None,
+        verify: str = 'none',
+    ) -> None:
+        if mode not in MODES:
+            raise ValueError(f"Unknown transfer mode {mode!r}, expected one of {MODES}")
+        if verify not in VERIFY_MODES:
+            raise ValueError(f"Unknown verify mode {verify!r}, expected one of {VERIFY_MODES}")
+        self.mode = mode
+        self.chunk_size = chunk_size
+        self.journal = journal
+        self.verify = verify
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers),
+                                        thread_name_prefix='transfer')
+
+    @classmethod
+    def from_env(cls, client: Any = None) -> 'TransferEngine':
+        """Build an engine from ``TRANSFER_*`` env vars; *client* enables the journal."""
+        return cls(
+            mode=os.getenv('TRANSFER_MODE', 'auto'),
+            workers=int(os.getenv('TRANSFER_WORKERS', '2')),
+            chunk_size=int(os.getenv('TRANSFER_CHUNK_MB', '64')) * 2 ** 20,
+            journal=TransferJournal(client) if client is not None else None,
+            verify=os.getenv('TRANSFER_VERIFY', 'none'),
+        )
+
+    def _resume_offset(self, source: str, target: str, st: os.stat_result) -> Tuple[int, List[str]]:
+        """Return the offset and chunk digests a previous attempt left behind.
+
+        An offset equal to the source size with no temporary file left means
+        the previous attempt already renamed the copy into place.
+        """
+        tmp = temp_path(target)
+        entry = self.journal.load(source, target) if self.journal else None
+        if (not entry or entry['state'] != 'copying' or entry['size'] != st.st_size
+                or entry['mtime_ns'] != st.st_mtime_ns or entry['chunk_size'] != self.chunk_size):
+            return 0, []
+        offset, chunks = entry['offset'], entry['chunks']
+        if self.verify != 'none' and len(chunks) * self.chunk_size < offset:
+            return 0, []  # journaled without checksums
+        if not os.path.exists(tmp):
+            placed = (offset == st.st_size and os.path.exists(target)
+                      and os.path.getsize(target) == st.st_size)
+            return (offset, chunks) if placed else (0, [])
+        if os.path.getsize(tmp) < offset:
+            return 0, []
+        if chunks and self.verify != 'none':
+            # The last journaled chunk must still be intact in the partial file
+            last = len(chunks) - 1
+            with open(tmp, 'rb') as fp:
+                fp.seek(last * self.chunk_size)
+                hasher = chunk_hasher()
+                hasher.update(fp.read(offset - last * self.chunk_size))
+            if hasher.hexdigest() != chunks[-1]:
+                logger.warning("Partial copy of %s is damaged, starting over", source)
+                return 0, []
+        return offset, chunks
+
+    def file_checksum(self, path: str) -> str:
+        """Compute the chunked checksum of *path* the same way copies do."""
+        digests = []
+        with open(path, 'rb') as fp:
+            for block in iter(lambda: fp.read(self.chunk_size), b''):
+                hasher = chunk_hasher()
+                hasher.update(block)
+                digests.append(hasher.hexdigest())
+        return tree_checksum(digests)
+
+    def copy(self, source: str, target: str) -> Dict[str, Any]:
+        """Copy *source* to *target* in chunks through a resumable temporary file.
+
+        Returns:
+            Dict with ``checksum`` (``None`` without hashing) and ``resumed_from``.
+        """
+        tmp = temp_path(target)
+        st = os.stat(source)
+        offset, chunks = self._resume_offset(source, target, st)
+        if offset:
+            logger.info("Resuming copy of %s at byte %d", source, offset)
+        elif self.journal:
+            self.journal.begin(source, target, st.st_size, st.st_mtime_ns, self.chunk_size)
+        resumed_from = offset
+        hashing = self.verify != 'none'
+        if offset == st.st_size and not os.path.exists(tmp):
+            # Renamed into place just before the previous attempt stopped
+            return {'checksum': tree_checksum(chunks) if hashing else None,
+                    'resumed_from': resumed_from}
+        methods = ['readwrite'] if hashing else copy_methods()
+
+        with open(source, 'rb') as src, open(tmp, 'r+b' if offset else 'wb') as dst:
+            dst.truncate(offset)
+            while offset < st.st_size:
+                count = min(self.chunk_size, st.st_size - offset)
+                if hashing:
+                    data = os.pread(src.fileno(), count, offset)
+                    hasher = chunk_hasher()
+                    hasher.update(data)
+                    copied = os.pwrite(dst.fileno(), data, offset) if data else 0
+                else:
+                    copied = _copy_chunk(src.fileno(), dst.fileno(), offset, count, methods)
+                # Short reads would misalign the chunk checksums
+                if copied == 0 or (hashing and copied != count):
+                    raise OSError(errno.EIO, f"Short copy of {source} at byte {offset}")
+                offset += copied
+                if self.journal:
+                    os.fdatasync(dst.fileno())
+                    digest = hasher.hexdigest() if hashing else None
+                    self.journal.advance(source, target, offset, digest)
+                if hashing:
+                    chunks.append(hasher.hexdigest())
+            os.fsync(dst.fileno())
+
+        if os.path.getsize(tmp) != st.st_size:
+            raise OSError(errno.EIO, f"Size mismatch copying {source}")
+        checksum = tree_checksum(chunks) if hashing else None
+        if self.verify == 'full' and self.file_checksum(tmp) != checksum:
+            os.unlink(tmp)
+            raise OSError(errno.EIO, f"Checksum mismatch copying {source}")
+        shutil.copystat(source, tmp)
+        os.replace(tmp, target)
+        return {'checksum': checksum, 'resumed_from': resumed_from}
+
+    def reflink(self, source: str, target: str) -> None:
+        """Clone *source* to *target* copy-on-write; raises OSError if unsupported."""
+        tmp = temp_path(target)
+        try:
+            with open(source, 'rb') as src, open(tmp, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        shutil.copystat(source, tmp)
+        os.replace(tmp, target)
+
+    def hardlink(self, source: str, target: str) -> None:
+        """Link *source* at *target*, replacing any existing file atomically."""
+        tmp = temp_path(target)
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        os.link(source, tmp)
+        os.replace(tmp, target)
+
+    def _place(self, source: str, target: str, keep_source: bool) -> Dict[str, Any]:
+        """Put *source* at *target*; returns the method used and copy details."""
+        local = same_device(source, target)
+        if self.mode == 'hardlink' and local:
+            self.hardlink(source, target)
+            return {'method': 'hardlink'}
+        if self.mode in ('auto', 'rename') and local:
+            if keep_source:
+                self.hardlink(source, target)
+                return {'method': 'hardlink'}
+            os.replace(source, target)
+            return {'method': 'rename'}
+        if self.mode in ('auto', 'reflink'):
+            try:
+                self.reflink(source, target)
+                return {'method': 'reflink'}
+            except OSError as err:
+                if self.mode == 'reflink':
+                    logger.info("Reflink of %s not possible (%s), copying", source, err)
+        return {'method': 'copy', **self.copy(source, target)}
+
+    def _already_transferred(self, source: str, target: str) -> Transfer:
+        """Describe a delivery whose source is gone because it already completed.
+
+        Only a target the journal recorded as ``done`` with the same size (and,
+        with ``verify='full'``, the same checksum) counts as delivered; any
+        other file at *target* raises ``FileNotFoundError``.
+        """
+        entry = self.journal.load(source, target) if self.journal else None
+        delivered = (entry is not None and entry['state'] == 'done'
+                     and entry['size'] == os.path.getsize(target))
+        if (delivered and self.verify == 'full' and entry['checksum']
+                and entry['chunk_size'] == self.chunk_size):
+            delivered = self.file_checksum(target) == entry['checksum']
+        if not delivered:
+            raise FileNotFoundError(errno.ENOENT, "Transfer source missing and target not "
+                                    "journaled as delivered", source)
+        logger.warning("%s is gone but %s was delivered; treating it as done", source, target)
+        return {
+            'source': source,
+            'target': target,
+            'method': 'already_transferred',
+            'bytes': os.path.getsize(target),
+            'seconds': 0.0,
+            'mb_per_s': None,
+            'checksum': (entry or {}).get('checksum') or None,
+        }
+
+    def transfer(self, source: str, target: str, keep_source: bool = False) -> Transfer:
+        """Move (or with *keep_source*, copy) *source* to *target*.
+
+        A replayed transfer whose source was already moved returns with
+        method ``already_transferred``. If the source is missing and the
+        target is absent or not journaled as delivered, ``FileNotFoundError``
+        is raised.
+
+        Returns:
+            Dict with ``source``, ``target``, ``method``, ``bytes``,
+            ``seconds``, ``mb_per_s`` and, for copies, ``checksum`` and
+            ``resumed_from``.
+        """
+        if not os.path.exists(source):
+            if os.path.exists(target):
+                return self._already_transferred(source, target)
+            raise FileNotFoundError(errno.ENOENT, "Transfer source missing", source)
+        size = os.path.getsize(source)
+        started = time.monotonic()
+        placed = self._place(source, target, keep_source)
+        if self.journal:
+            self.journal.finish(source, target, size, placed.get('checksum'))
+        # The source goes only once the complete target is in place (size checked,
+        # and with verify='full' its re-read checksum compared)
+        if placed['method'] != 'rename' and not keep_source:
+            os.unlink(source)
+        seconds = time.monotonic() - started
+        copied = size - placed.get('resumed_from', 0)
+        result = {
+            'source': source,
+            'target': target,
+            'bytes': size,
+            'seconds': round(seconds, 3),
+            'mb_per_s': round(copied / 2 ** 20 / seconds, 1) if seconds > 0 else None,
+            **placed,
+        }
+        logger.info("Transferred %s -> %s by %s (%d bytes, %.2fs)",
+                    source, target, placed['method'], size, seconds)
+        return result
+
+    def transfer_all(self, pairs: List[Tuple[str, str]], keep_source: bool = False) -> List[Transfer]:
+        """Transfer ``(source, target)`` *pairs* concurrently, in order of the results."""
+        futures = [self._pool.submit(self.transfer, source, target, keep_source)
+                   for source, target in pairs]
+        return [future.result() for future in futures]
@@ -0,0 +1,102 @@
+"""Redis journal of in-flight cross-device copies.
+
+A copy that dies halfway used to leave nothing behind but a partial file.
+:class:`TransferJournal` records, per ``(source, target)`` pair, the source
+size and mtime it started from, the byte offset that is durably written to
+the temporary file and the checksum of every chunk up to that offset. A
+restarted copy resumes from the offset (if the source is unchanged) and the
+final checksum is the hash of the chunk digests, so nothing is read twice.
+Every finished delivery, copied or not, is recorded as ``done`` with its size
+and kept for ``ttl`` seconds so that a replayed event can recognise a delivery
+whose source is already gone.
+"""
+
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+def tree_checksum(chunk_digests: List[str]) -> str:
+    """Combine per-chunk hex digests into one file checksum."""
+    tree = hashlib.blake2b(digest_size=32)
+    for digest in chunk_digests:
+        tree.update(bytes.fromhex(digest))
+    return tree.hexdigest()
+
+
+def chunk_hasher() -> Any:
+    """Return a new hash object for one chunk."""
+    return hashlib.blake2b(digest_size=32)
+
+
+class TransferJournal:
+    """Per-transfer progress records under ``transfer_journal:*`` keys.
+
+    Args:
+        client: Redis client created with ``decode_responses=True``.
+        ttl: Seconds a finished record is kept.
+    """
+
+    PREFIX = 'transfer_journal:'
+
+    def __init__(self, client: redis.Redis, ttl: int = 7 * 24 * 3600) -> None:
+        self.client = client
+        self.ttl = ttl
+
+    def _key(self, source: str, target: str) -> str:
+        """Key of the record for copying *source* to *target*."""
+        digest = hashlib.sha1(f"{source}|{target}".encode('utf-8')).hexdigest()
+        return self.PREFIX + digest
+
+    def load(self, source: str, target: str) -> Optional[Dict[str, Any]]:
+        """Return the record for *source* -> *target*, or ``None``."""
+        key = self._key(source, target)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hgetall(key)
+        pipe.lrange(key + ':chunks', 0, -1)
+        fields, chunks = pipe.execute()
+        if not fields:
+            return None
+        return {
+            'state': fields.get('state'),
+            'size': int(fields.get('size', 0)),
+            'mtime_ns': int(fields.get('mtime_ns', 0)),
+            'chunk_size': int(fields.get('chunk_size', 0)),
+            'offset': int(fields.get('offset', 0)),
+            'checksum': fields.get('checksum'),
+            'chunks': chunks,
+        }
+
+    def begin(self, source: str, target: str, size: int, mtime_ns: int, chunk_size: int) -> None:
+        """Start a fresh record, discarding any previous one."""
+        key = self._key(source, target)
+        pipe = self.client.pipeline()
+        pipe.delete(key, key + ':chunks')
+        pipe.hset(key, mapping={
+            'state': 'copying', 'source': source, 'target': target, 'size': size,
+            'mtime_ns': mtime_ns, 'chunk_size': chunk_size, 'offset': 0,
+        })
+        pipe.execute()
+
+    def advance(self, source: str, target: str, offset: int, digest: Optional[str]) -> None:
+        """Record that everything before *offset* is durably written."""
+        key = self._key(source, target)
+        pipe = self.client.pipeline()
+        if digest is not None:
+            pipe.rpush(key + ':chunks', digest)
+        pipe.hset(key, 'offset', offset)
+        pipe.execute()
+
+    def finish(self, source: str, target: str, size: int, checksum: Optional[str]) -> None:
+        """Mark the transfer of *size* bytes complete; the record expires after ``ttl``."""
+        key = self._key(source, target)
+        pipe = self.client.pipeline()
+        pipe.hset(key, mapping={'state': 'done', 'source': source, 'target': target,
+                                'size': size, 'checksum': checksum or ''})
+        pipe.expire(key, self.ttl)
+        pipe.delete(key + ':chunks')
+        pipe.execute()
@@ -8,6 +8,7 @@ import json
 import logging
 import os
 import sys
+import time
 import uuid
 from typing import Dict
 
@@ -52,7 +53,9 @@ def device_event(device) -> None:
         msg = {
             "drive_id": drive_ids[dev_path],
             "device": dev_path,
-            "event": "insert"
+            "event": "insert",
+            # Starts the job's trace (see riparr_common/tracing.py)
+            "trace": {"trace_id": uuid.uuid4().hex, "sent_at": time.time()}
         }
         r.xadd('drive_events', {'data': json.dumps(msg)})
         logger.info("Published insert for %s", dev_path)
@@ -4,17 +4,31 @@ Upscales and enhances video files using Real-ESRGAN,
 publishes 'enhance.start', 'enhance.progress', 'enhance.complete' events.
 """
 
-import json
+import contextlib
+import functools
 import logging
 import os
 import subprocess
 import sys
-import threading
 import time
-from typing import Any, Dict, List, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import redis
 
+from frame_pipeline import run_frame_pipeline, upscale_tuning
+from riparr_common.checkpoints import CheckpointStore, remove_partials
+from riparr_common.encoding import audio_encoder_args, video_encoder_args
+from riparr_common.executor import JobExecutor, size_priority
+from riparr_common.gpu_scheduler import GpuScheduler
+from riparr_common.job_control import JobControl
+from riparr_common import metrics
+from riparr_common.probe import (Probe, ProbeCache, audio_streams, estimate_frames, is_hdr,
+                                 video_stream)
+from riparr_common.publisher import EventPublisher
+from riparr_common.streams import StreamConsumer
+from riparr_common.tracing import Tracer
+from title_join import TitleJoin
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -28,6 +42,13 @@ if not enable:
 # Redis connection
 redis_url = os.getenv('REDIS_URL', 'redis://redis:6379')
 r = redis.from_url(redis_url, decode_responses=True)
+probe_cache = ProbeCache.from_env(r)
+publisher = EventPublisher.from_env(r)
+gpu_scheduler = GpuScheduler.from_env(r)
+title_join = TitleJoin(r)
+checkpoints = CheckpointStore.from_env(r, 'enhance')
+tracer = Tracer.from_env(r, 'enhance-worker')
+job_control = JobControl(r, 'enhance_events', publisher)
 
 # Config
 esrgan_profile = os.getenv('ESRGAN_PROFILE', 'amd-4x-med-vram4')
@@ -36,6 +57,28 @@ mkv_output_dir = os.getenv('MKV_OUTPUT_DIR', '/data/rips')
 enhanced_output_dir = os.getenv('ENHANCED_OUTPUT_DIR', '/data/enhanced')
 models_dir = os.getenv('MODELS_DIR', '/models')
 use_cpu_fallback = os.getenv('CPU_FALLBACK', 'false').lower() == 'true'
+# Fused mode pipes upscaled frames straight into the encoder, skipping the
+# intermediate enhanced MKV; transcode settings then apply to this worker.
+fused_pipeline = os.getenv('FUSED_PIPELINE', 'false').lower() == 'true'
+batch_frames = int(os.getenv('ENHANCE_BATCH_FRAMES', '64'))
+transcoded_output_dir = os.getenv('TRANSCODED_OUTPUT_DIR', '/data/transcoded')
+transcode_profile = os.getenv('TRANSCODE_PROFILE', 'high')
+vaapi_profile = os.getenv('VAAPI_PROFILE', 'hevc_vaapi')
+audio_format = os.getenv('AUDIO_FORMAT', 'aac')
+# Lease weight of the VAAPI encode in fused mode
+transcode_vram_gb = float(os.getenv('TRANSCODE_VRAM_GB', '1'))
+# Intermediate encode of the standard (non-fused) enhanced MKV
+enhance_crf = os.getenv('ENHANCE_CRF', '14')
+enhance_preset = os.getenv('ENHANCE_PRESET', 'fast')
+# Override the VRAM-derived Real-ESRGAN tile size / -j threads
+esrgan_tile = os.getenv('ESRGAN_TILE', '')
+esrgan_threads = os.getenv('ESRGAN_THREADS', '')
+# Reuse the upscaled output of the previous frame for near-identical frames
+enhance_dedup = os.getenv('ENHANCE_DEDUP', 'false').lower() == 'true'
+dedup_threshold = int(os.getenv('ENHANCE_DEDUP_THRESHOLD', '0'))
+dedup_hash_size = int(os.getenv('ENHANCE_DEDUP_HASH_SIZE', '16'))
+# Partial outputs younger than this may belong to another replica
+partial_cleanup_age = float(os.getenv('PARTIAL_CLEANUP_AGE', '600'))
 
 def parse_profile(profile_str: str) -> Tuple[str, int, str, int]:
     """Parse ESRGAN profile string into components."""
@@ -58,122 +101,362 @@ MODEL_MAP = {
 }
 model = MODEL_MAP.get(_quality, 'realesr-animevideov3-x4')
 
-def is_hdr_file(file_path: str) -> bool:
-    """Check if a video file is HDR using ffprobe."""
-    # Use ffprobe to check for HDR
-    try:
-        cmd = ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_streams', file_path]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=False)
-        data = json.loads(result.stdout)
-        for stream in data.get('streams', []):
-            if stream.get('codec_type') == 'video':
-                color_primaries = stream.get('color_primaries', '')
-                if 'bt2020' in color_primaries.lower() or 'hdr' in str(stream).lower():
-                    return True
-        return False
-    except (subprocess.SubprocessError, json.JSONDecodeError, KeyError) as e:
-        print(f"Error checking HDR for {file_path}: {e}")
-        return False
-
-def enhance_file(input_file: str, output_file: str, job_id: str) -> bool:
-    """Enhance a video file using Real-ESRGAN."""
+def is_hdr_file(file_path: str, probes: Optional[Dict[str, Probe]] = None) -> bool:
+    """Check if a video file is HDR using (cached) ffprobe data."""
+    return is_hdr(probe_cache.probe(file_path, probes))
+
+def gpu_lease(weight: float):
+    """Lease a GPU slot of *weight* GB, or yield ``None`` to run on the CPU."""
+    if use_cpu_fallback:
+        return contextlib.nullcontext()
+    return gpu_scheduler.lease(weight)
+
+def tuning_args(cpu: bool) -> List[str]:
+    """Return Real-ESRGAN ``-t`` / ``-j`` arguments for the profile's VRAM budget."""
+    args = upscale_tuning(_vram, _scale, cpu)
+    if esrgan_tile:
+        args[1] = esrgan_tile
+    if esrgan_threads:
+        args[3] = esrgan_threads
+    return args
+
+def build_upscale_cmd(input_path: str, output_path: str,
+                      gpu_index: Optional[int] = 0) -> List[str]:
+    """Build the Real-ESRGAN command for a file or a directory of frames.
+
+    *gpu_index* is the leased Vulkan device; ``None`` selects the CPU build.
+    """
     # Determine if GPU or CPU
-    if gpu_vendor == 'amd' and not use_cpu_fallback:
-        binary = 'realesrgan-ncnn-vulkan'
-        model_path = os.path.join(models_dir, model)
-        cmd = [binary, '-i', input_file, '-o', output_file,
-               '-m', model_path, '-s', str(_scale), '-g', '0']
+    model_path = os.path.join(models_dir, model)
+    if gpu_vendor == 'amd' and not use_cpu_fallback and gpu_index is not None:
+        return ['realesrgan-ncnn-vulkan', '-i', input_path, '-o', output_path,
+                '-m', model_path, '-s', str(_scale), '-g', str(gpu_index)] + tuning_args(False)
+    return ['realesrgan-ncnn', '-i', input_path, '-o', output_path,
+            '-m', model_path, '-s', str(_scale)] + tuning_args(True)
+
+def enhance_encoder_cmd(input_file: str, output_file: str, probe: Probe) -> List[str]:
+    """Build the encoder writing upscaled frames to the intermediate enhanced MKV.
+
+    Audio, subtitles, chapters and metadata are remuxed from *input_file*
+    unchanged; the transcode worker encodes them later.
+    """
+    video = video_stream(probe)
+    return [
+        'ffmpeg', '-y',
+        '-f', 'image2pipe', '-framerate', video.get('r_frame_rate', '24000/1001'),
+        '-c:v', 'png', '-i', '-', '-i', input_file,
+        '-map', '0:v:0', '-map', '1:a?', '-map', '1:s?',
+        '-map_metadata', '1', '-map_chapters', '1',
+        '-c:v', 'libx264', '-preset', enhance_preset, '-crf', enhance_crf,
+        '-pix_fmt', 'yuv420p', '-c:a', 'copy', '-c:s', 'copy', output_file
+    ]
+
+def frame_progress(job_id: str, total: int, streams: Tuple[str, ...]) -> Callable[[int], None]:
+    """Return an ``on_frames`` callback publishing progress and frames/s on *streams*."""
+    started = time.monotonic()
+
+    def _on_frames(done: int) -> None:
+        elapsed = time.monotonic() - started
+        fps = round(done / elapsed, 2) if elapsed > 0 else 0.0
+        progress = min(int(done / total * 100), 99) if total else 0
+        for stream in streams:
+            publisher.progress(stream, job_id, progress, frames=done,
+                               total_frames=total, fps=fps)
+
+    return _on_frames
+
+def dedup_options(stats: Dict[str, int]) -> Dict[str, Any]:
+    """Return :func:`run_frame_pipeline` keyword arguments for duplicate-frame skipping."""
+    options: Dict[str, Any] = {'stats': stats}
+    if enhance_dedup:
+        options.update(dedup_threshold=dedup_threshold, hash_size=dedup_hash_size)
+    return options
+
+def skip_report(input_file: str, stats: Dict[str, int]) -> Dict[str, Any]:
+    """Log and return the share of frames that reused an earlier upscale."""
+    frames = stats.get('frames', 0)
+    upscaled = stats.get('upscaled', 0)
+    skip_ratio = round(1 - upscaled / frames, 4) if frames else 0.0
+    logger.info("Dedup for %s: upscaled %d of %d frames (skip ratio %.1f%%)",
+                input_file, upscaled, frames, skip_ratio * 100)
+    return {"frames": frames, "upscaled": upscaled, "skip_ratio": skip_ratio}
+
+def enhance_file(input_file: str, output_file: str, job_id: str,
+                 probe: Optional[Probe] = None,
+                 stats: Optional[Dict[str, int]] = None) -> bool:
+    """Enhance a video file with Real-ESRGAN, streaming frames in bounded batches.
+
+    The GPU and CPU builds of the upscaler run through the same engine.
+    *stats* receives the encoded and upscaled frame counts.
+    """
+    probe = probe or probe_cache.probe(input_file)
+    stats = {} if stats is None else stats
+    print(f"Enhancing {input_file} to {output_file}")
+    started = time.monotonic()
+    with gpu_lease(_vram) as lease:
+        ok = run_frame_pipeline(
+            input_file, enhance_encoder_cmd(input_file, output_file, probe),
+            functools.partial(build_upscale_cmd, gpu_index=lease.device.index if lease else None),
+            batch_frames, frame_progress(job_id, estimate_frames(probe), ('enhance_events',)),
+            scratch_dir=os.path.dirname(output_file),
+            popen=functools.partial(job_control.popen, job_id), **dedup_options(stats)
+        )
+    elapsed = time.monotonic() - started
+    if ok:
+        frames = stats.get('frames', 0)
+        logger.info("Enhanced %s on %s: %d frames in %.1fs (%.2f frames/s)", input_file,
+                    'gpu' if lease else 'cpu', frames, elapsed,
+                    frames / elapsed if elapsed else 0)
     else:
-        binary = 'realesrgan-ncnn'
-        model_path = os.path.join(models_dir, model)
-        cmd = [binary, '-i', input_file, '-o', output_file,
-               '-m', model_path, '-s', str(_scale)]
-
-    try:
-        with subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        ) as process:
-            # Publish progress (simplified, as realesrgan may not have progress)
-            progress_msg = {
-                "job_id": job_id,
-                "percentage": 50  # Mid progress
-            }
-            r.xadd('enhance_events', {'event': 'progress', 'data': json.dumps(progress_msg)})
-            print(f"Enhancing {input_file} to {output_file}")
-
-            process.wait()
-            if process.returncode == 0:
-                return True
-            print(f"Enhance failed for {input_file}")
-            return False
-    except (subprocess.SubprocessError, OSError) as e:
-        print(f"Error enhancing {input_file}: {e}")
-        return False
-
-def process_rip_complete(job_id: str, output_files: List[str]) -> None:
-    """Process completed rip files for enhancement."""
-    enhanced_files = []
-    for mkv_file in output_files:
-        if not mkv_file.endswith('.mkv'):
-            continue
-        if is_hdr_file(mkv_file):
-            print(f"Skipping HDR file: {mkv_file}")
-            enhanced_files.append(mkv_file)  # Pass through
-            continue
-
-        # Create output path
-        rel_path = os.path.relpath(mkv_file, mkv_output_dir)
-        output_file = os.path.join(enhanced_output_dir, rel_path)
-        os.makedirs(os.path.dirname(output_file), exist_ok=True)
-
-        if enhance_file(mkv_file, output_file, job_id):
-            enhanced_files.append(output_file)
-        else:
-            enhanced_files.append(mkv_file)  # Fallback to original
-
-    # Publish complete
-    complete_msg = {
-        "job_id": job_id,
-        "enhanced_files": enhanced_files
+        print(f"Enhance failed for {input_file}")
+    return ok
+
+def fused_encoder_cmd(input_file: str, output_file: str, probe: Probe,
+                      render_node: Optional[str] = None) -> List[str]:
+    """Build the encoder reading upscaled PNG frames from stdin.
+
+    Audio and subtitles are taken from *input_file* with the same settings the
+    transcode worker would apply. Without a *render_node* it encodes on the CPU.
+    """
+    video = video_stream(probe)
+    cpu = render_node is None
+    cmd = ['ffmpeg', '-y']
+    if not cpu:
+        cmd.extend(['-vaapi_device', render_node])
+    cmd.extend([
+        '-f', 'image2pipe', '-framerate', video.get('r_frame_rate', '24000/1001'),
+        '-c:v', 'png', '-i', '-', '-i', input_file,
+        '-map', '0:v:0', '-map', '1:a?', '-map', '1:s?'
+    ])
+    cmd.extend(video_encoder_args(transcode_profile, cpu, vaapi_profile, upload=True))
+    cmd.extend(audio_encoder_args(audio_streams(probe), audio_format, input_index=1))
+    cmd.extend(['-c:s', 'copy', output_file])
+    return cmd
+
+def passthrough_encoder_cmd(input_file: str, output_file: str, probe: Probe,
+                            render_node: Optional[str] = None) -> List[str]:
+    """Build a plain transcode command for files that skip the upscaler (HDR)."""
+    cmd = ['ffmpeg', '-y']
+    if render_node is not None:
+        cmd.extend(['-hwaccel', 'vaapi', '-hwaccel_device', render_node])
+    cmd.extend(['-i', input_file])
+    cmd.extend(video_encoder_args(transcode_profile, render_node is None, vaapi_profile))
+    cmd.extend(audio_encoder_args(audio_streams(probe), audio_format))
+    cmd.append(output_file)
+    return cmd
+
+def enhance_and_transcode_file(input_file: str, output_file: str, job_id: str,
+                               probe: Probe, stats: Optional[Dict[str, int]] = None) -> bool:
+    """Upscale and encode *input_file* in one pass without an intermediate file."""
+    if is_hdr(probe):
+        print(f"Skipping upscale for HDR file: {input_file}")
+        with gpu_lease(transcode_vram_gb) as lease:
+            render_node = lease.device.render_node if lease else None
+            with job_control.popen(
+                job_id, passthrough_encoder_cmd(input_file, output_file, probe, render_node),
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            ) as process:
+                process.wait()
+        return process.returncode == 0
+
+    on_frames = frame_progress(job_id, estimate_frames(probe),
+                               ('enhance_events', 'transcode_events'))
+
+    # Upscaler and encoder share one device, so one lease covers both
+    with gpu_lease(_vram + transcode_vram_gb) as lease:
+        gpu_index = lease.device.index if lease else None
+        render_node = lease.device.render_node if lease else None
+        return run_frame_pipeline(
+            input_file, fused_encoder_cmd(input_file, output_file, probe, render_node),
+            functools.partial(build_upscale_cmd, gpu_index=gpu_index),
+            batch_frames, on_frames, scratch_dir=os.path.dirname(output_file),
+            popen=functools.partial(job_control.popen, job_id),
+            **dedup_options({} if stats is None else stats)
+        )
+
+def checkpoint_settings() -> Dict[str, Any]:
+    """Return the settings that shape an enhanced (or fused) output file."""
+    settings: Dict[str, Any] = {
+        "profile": esrgan_profile, "model": model, "fused": fused_pipeline,
+        "dedup": [dedup_threshold, dedup_hash_size] if enhance_dedup else None,
     }
-    r.xadd('enhance_events', {'event': 'complete', 'data': json.dumps(complete_msg)})
-    logger.info("Published enhance.complete for job %s", job_id)
+    if fused_pipeline:
+        settings.update(transcode_profile=transcode_profile, vaapi_profile=vaapi_profile,
+                        audio_format=audio_format)
+    else:
+        settings.update(crf=enhance_crf, preset=enhance_preset)
+    return settings
 
-def process_rip_event(data: Dict[str, Any]) -> None:
-    """Handle rip completion events."""
-    if data.get('event') == 'complete':
-        job_id = data['job_id']
-        output_files = data['output_files']
+def enhance_title(job_id: str, mkv_file: str, probes: Optional[Dict[str, Probe]] = None,
+                  reused_from: Optional[str] = None) -> Dict[str, Any]:
+    """Enhance one ripped title (and transcode it too in fused mode).
+
+    A job reusing the rip of job *reused_from* reuses that job's finished
+    output through its checkpoint.
+
+    Returns the file handed downstream, which is the original on failure or
+    for HDR sources, and the dedup report when enabled.
+    """
+    if not fused_pipeline and is_hdr_file(mkv_file, probes):
+        print(f"Skipping HDR file: {mkv_file}")
+        return {"output": mkv_file}  # Pass through
+
+    # Create output path
+    rel_path = os.path.relpath(mkv_file, mkv_output_dir)
+    output_dir = transcoded_output_dir if fused_pipeline else enhanced_output_dir
+    output_file = os.path.join(output_dir, rel_path)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+
+    probe = probe_cache.probe(mkv_file, probes)
+    stats: Dict[str, int] = {}
+    stage = enhance_and_transcode_file if fused_pipeline else enhance_file
 
-        # Publish start
-        start_msg = {
+    def _produce(temp_file: str) -> bool:
+        started = time.monotonic()
+        ok = stage(mkv_file, temp_file, job_id, probe, stats)
+        if ok:
+            metrics.observe_fps('enhance', estimate_frames(probe), time.monotonic() - started)
+        return ok
+
+    # A finished output of an earlier, interrupted run is reused as is
+    ok = checkpoints.produce(reused_from or job_id, mkv_file, output_file,
+                             checkpoint_settings(), _produce)
+    # A cancelled job stops here instead of falling back to the original
+    job_control.check(job_id)
+    if not ok:
+        return {"output": mkv_file}  # Fallback to original
+    result: Dict[str, Any] = {"output": output_file}
+    if enhance_dedup and stats:
+        result["dedup"] = skip_report(mkv_file, stats)
+    return result
+
+def join_title(job_id: str, mkv_file: str, probes: Optional[Dict[str, Probe]] = None,
+               reused_from: Optional[str] = None) -> Dict[str, Any]:
+    """Enhance *mkv_file* once per job, however many events name it.
+
+    A reused rip's titles are joined with those of the job that ripped them,
+    so a title that job is still enhancing is waited for.
+    """
+    return title_join.run(reused_from or job_id, mkv_file,
+                          functools.partial(enhance_title, job_id, mkv_file, probes,
+                                            reused_from))
+
+def announce_start(job_id: str, mkv_files: List[str]) -> None:
+    """Publish the stage start events on the first event of a job."""
+    if not title_join.begin(job_id):
+        return
+    publisher.publish('enhance_events', 'start', {
+        "job_id": job_id,
+        "input_files": mkv_files
+    })
+    logger.info("Published enhance.start for job %s", job_id)
+    if fused_pipeline:
+        publisher.publish('transcode_events', 'start', {
             "job_id": job_id,
-            "input_files": output_files
+            "input_files": mkv_files
+        })
+        logger.info("Published transcode.start for fused job %s", job_id)
+
+def process_title_complete(job_id: str, output_files: List[str],
+                           probes: Optional[Dict[str, Probe]] = None) -> None:
+    """Enhance a title as soon as the rip worker has closed its file."""
+    if title_join.finished(job_id):
+        logger.info("Ignoring late title of finished job %s", job_id)
+        return
+    mkv_files = [f for f in output_files if f.endswith('.mkv')]
+    with job_control.job(job_id):
+        job_control.check(job_id)
+        announce_start(job_id, mkv_files)
+        for mkv_file in mkv_files:
+            join_title(job_id, mkv_file, probes)
+
+def process_rip_complete(job_id: str, output_files: List[str],
+                         probes: Optional[Dict[str, Probe]] = None,
+                         reused_from: Optional[str] = None) -> None:
+    """Join all titles of a job, enhancing any not done yet, and publish completion.
+
+    *reused_from* names the job whose rip this job reuses; it is passed on
+    so the transcode stage reuses that job's outputs too.
+    """
+    mkv_files = [f for f in output_files if f.endswith('.mkv')]
+    with job_control.job(job_id):
+        job_control.check(job_id)
+        announce_start(job_id, mkv_files)
+        results = [join_title(job_id, mkv_file, probes, reused_from) for mkv_file in mkv_files]
+    files = [result["output"] for result in results]
+    dedup = {result["output"]: result["dedup"] for result in results if "dedup" in result}
+    reuse = {"reused_from": reused_from} if reused_from else {}
+
+    if fused_pipeline:
+        # Downstream consumers see the usual enhance.complete / transcode.complete
+        complete_msg = {
+            "job_id": job_id,
+            "enhanced_files": files,
+            "fused": True,
+            **reuse
         }
-        r.xadd('enhance_events', {'event': 'start', 'data': json.dumps(start_msg)})
-        logger.info("Published enhance.start for job %s", job_id)
+        if enhance_dedup:
+            complete_msg["dedup"] = dedup
+        publisher.publish('enhance_events', 'complete', complete_msg)
+        publisher.publish('transcode_events', 'complete', {
+            "job_id": job_id,
+            "transcoded_files": files,
+            **reuse
+        })
+        logger.info("Published enhance.complete and transcode.complete for fused job %s", job_id)
+    else:
+        # Publish complete; probe data travels along so transcode never re-probes
+        complete_msg = {
+            "job_id": job_id,
+            "enhanced_files": files,
+            "probes": {path: probe_cache.probe(path, probes) for path in files},
+            **reuse
+        }
+        if enhance_dedup:
+            complete_msg["dedup"] = dedup
+        publisher.publish('enhance_events', 'complete', complete_msg)
+        logger.info("Published enhance.complete for job %s", job_id)
+    title_join.finish(job_id)
 
-        threading.Thread(target=process_rip_complete, args=(job_id, output_files)).start()
+def process_rip_event(data: Dict[str, Any]) -> None:
+    """Handle per-title and job completion events of the rip worker."""
+    if data.get('event') == 'title_complete':
+        process_title_complete(data['job_id'], data['output_files'], data.get('probes'))
+    elif data.get('event') == 'complete':
+        process_rip_complete(data['job_id'], data['output_files'], data.get('probes'),
+                             data.get('reused_from'))
 
 def main() -> None:
     """Main event loop for enhance worker."""
-    last_id = '0'
+    consumer = StreamConsumer.from_env(r, 'rip_events', 'enhance-worker')
+    executor = JobExecutor.from_env('enhance-worker', 'MAX_CONCURRENT_ENHANCES', 1, r,
+                                   on_error=functools.partial(publisher.fail, 'enhance_events'))
+    job_control.listen(executor)
+    metrics.start_from_env(r, [(consumer.stream, consumer.group)])
     while True:
         try:
-            messages = r.xread({'rip_events': last_id}, block=1000)
-            for _stream, msgs in messages:
-                for msg_id, msg in msgs:
-                    last_id = msg_id
-                    data = json.loads(msg['data'])
-                    process_rip_event(data)
-        except (redis.ConnectionError, redis.TimeoutError, json.JSONDecodeError) as e:
+            for msg_id, data in consumer.messages():
+                if data.get('event') in ('title_complete', 'complete'):
+                    # Smaller inputs (episodes) are upscaled before feature films
+                    executor.submit(
+                        consumer.acking(msg_id, tracer.traced('enhance', process_rip_event)),
+                        data,
+                        priority=size_priority(data.get('output_files', [])),
+                        job_id=data.get('job_id'),
+                        on_drop=functools.partial(consumer.ack, msg_id)
+                    )
+                else:
+                    consumer.ack(msg_id)
+        except (redis.ConnectionError, redis.TimeoutError) as e:
             print(f"Error reading stream: {e}")
             time.sleep(1)
 
 if __name__ == '__main__':
+    remove_partials(transcoded_output_dir if fused_pipeline else enhanced_output_dir,
+                    partial_cleanup_age)
     logger.info("Enhance Worker started, waiting for rip events...")
+    if os.getenv('WORKER_RUNTIME', 'threads').lower() != 'threads':
+        # Frames are piped between Real-ESRGAN and ffmpeg by threads
+        logger.warning("The enhance worker has no asyncio runtime, using threads")
     main()
     ENDING = "Enhance Worker ended."
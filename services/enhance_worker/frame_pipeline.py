@@ -0,0 +1,402 @@
+"""Frame-batch streaming between ffmpeg and Real-ESRGAN.
+
+``realesrgan-ncnn-vulkan`` only reads image files, so frames are decoded by
+ffmpeg as a PNG stream on stdout, written to a scratch directory in bounded
+batches, upscaled batch by batch and written to an encoder's stdin as another
+PNG stream. Decoding, upscaling and encoding run as three stages connected by
+queues of one batch each: while Real-ESRGAN works on one batch the next is
+already decoded and staged and the previous one is being encoded, so the
+upscaler's start-up and the ffmpeg pipes overlap with GPU work instead of
+adding to it. At most five batches are held at any time (three of them on
+disk), so memory and scratch-disk use stay constant whatever the length of
+the title.
+
+:func:`upscale_tuning` derives Real-ESRGAN's tile size (``-t``) and thread
+counts (``-j load:proc:save``) from the VRAM budget of the job, so small
+cards tile instead of running out of memory and large ones are kept busy.
+
+With a ``dedup_threshold`` a second decoder emits tiny grayscale frames whose
+difference hashes (dHash) are compared with the last upscaled frame. Frames
+within the threshold reuse that frame's upscaled output instead of being
+upscaled again, which skips most of the work on held animation cels and
+static shots. A scene cut changes the hash and starts a new unique frame.
+"""
+
+import contextlib
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Ends a stage queue
+_END = object()
+
+# (minimum VRAM in GB, tile size for x4 models); x2 models use twice the tile
+TILE_SIZES = [(12, 512), (8, 400), (6, 256), (4, 200), (2, 100), (0, 64)]
+
+
+def upscale_tuning(vram_gb: float, scale: int, cpu: bool = False,
+                   cpu_count: Optional[int] = None) -> List[str]:
+    """Return ``-t`` / ``-j`` arguments for a Real-ESRGAN run.
+
+    Args:
+        vram_gb: VRAM budget of the job (the ``vram<N>`` profile hint). On the
+            CPU it bounds the tile size the same way.
+        scale: Upscale factor of the model.
+        cpu: Tune for the CPU build, which runs one processing thread per core.
+        cpu_count: Cores to size loader/saver threads for (default: all).
+    """
+    cores = cpu_count or os.cpu_count() or 1
+    tile = next(size for minimum, size in TILE_SIZES if vram_gb >= minimum)
+    if scale <= 2:
+        tile *= 2
+    io_threads = max(1, min(4, cores // 2))
+    if cpu:
+        proc = max(1, cores - io_threads)
+    else:
+        proc = 2 if vram_gb >= 8 else 1
+    return ['-t', str(tile), '-j', f'{io_threads}:{proc}:{io_threads}']
+
+
+def read_png(stream: BinaryIO) -> Optional[bytes]:
+    """Read exactly one PNG image from *stream*; ``None`` at end of stream."""
+    signature = stream.read(8)
+    if not signature:
+        return None
+    if signature != PNG_SIGNATURE:
+        raise ValueError("Decoder output is not a PNG stream")
+    chunks = [signature]
+    while True:
+        header = stream.read(8)
+        if len(header) < 8:
+            raise ValueError("Truncated PNG in decoder output")
+        length = int.from_bytes(header[:4], 'big')
+        body = stream.read(length + 4)  # chunk data + CRC
+        chunks.append(header)
+        chunks.append(body)
+        if header[4:8] == b'IEND':
+            return b''.join(chunks)
+
+
+def iter_frame_batches(stream: BinaryIO, batch_size: int) -> Iterator[List[bytes]]:
+    """Yield lists of at most *batch_size* PNG frames read from *stream*."""
+    batch: List[bytes] = []
+    while True:
+        frame = read_png(stream)
+        if frame is None:
+            break
+        batch.append(frame)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def hash_decoder_cmd(input_file: str, hash_size: int) -> List[str]:
+    """Return an ffmpeg command writing ``hash_size+1 x hash_size`` gray frames to stdout."""
+    return [
+        'ffmpeg', '-v', 'error', '-i', input_file, '-map', '0:v:0',
+        '-vf', f'scale={hash_size + 1}:{hash_size}:flags=area,format=gray',
+        '-f', 'rawvideo', '-'
+    ]
+
+
+def dhash(gray: bytes, hash_size: int) -> int:
+    """Return the difference hash of one ``hash_size+1 x hash_size`` gray frame."""
+    width = hash_size + 1
+    value = 0
+    for row in range(hash_size):
+        line = gray[row * width:(row + 1) * width]
+        for left, right in zip(line, line[1:]):
+            value = (value << 1) | (left > right)
+    return value
+
+
+def read_hashes(stream: BinaryIO, count: int, hash_size: int) -> List[Optional[int]]:
+    """Read *count* frame hashes; ``None`` for frames the hash stream is missing."""
+    frame_bytes = (hash_size + 1) * hash_size
+    hashes: List[Optional[int]] = []
+    for _ in range(count):
+        gray = stream.read(frame_bytes)
+        hashes.append(dhash(gray, hash_size) if len(gray) == frame_bytes else None)
+    return hashes
+
+
+class FrameDeduper:
+    """Map frames onto the last unique frame whose upscaled output they can reuse.
+
+    Args:
+        threshold: Maximum Hamming distance between hashes of frames treated
+            as duplicates; ``0`` only matches identical hashes.
+    """
+
+    def __init__(self, threshold: int) -> None:
+        self.threshold = threshold
+        self._hash: Optional[int] = None
+        self._output: Optional[bytes] = None
+
+    def plan(self, hashes: List[Optional[int]]) -> Tuple[List[int], List[int]]:
+        """Return the batch indices to upscale and, per frame, the unique frame it uses.
+
+        A source of ``-1`` refers to the last unique frame of an earlier batch.
+        """
+        unique: List[int] = []
+        sources: List[int] = []
+        for i, frame_hash in enumerate(hashes):
+            if (frame_hash is None or self._hash is None
+                    or bin(frame_hash ^ self._hash).count('1') > self.threshold):
+                unique.append(i)
+                self._hash = frame_hash
+            sources.append(len(unique) - 1)
+        return unique, sources
+
+    def assemble(self, sources: List[int], outputs: List[bytes]) -> List[bytes]:
+        """Expand the upscaled unique frames back to one output per input frame."""
+        frames = [self._output if source < 0 else outputs[source] for source in sources]
+        if outputs:
+            self._output = outputs[-1]
+        return frames
+
+
+def decoder_cmd(input_file: str) -> List[str]:
+    """Return an ffmpeg command writing the first video stream as PNGs to stdout."""
+    return [
+        'ffmpeg', '-v', 'error', '-i', input_file, '-map', '0:v:0',
+        '-f', 'image2pipe', '-c:v', 'png', '-'
+    ]
+
+
+def stage_batch(frames: List[bytes], work_dir: str) -> None:
+    """Write *frames* to ``work_dir/in`` and create an empty ``work_dir/out``."""
+    in_dir = os.path.join(work_dir, 'in')
+    out_dir = os.path.join(work_dir, 'out')
+    for path in (in_dir, out_dir):
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+    for i, frame in enumerate(frames):
+        with open(os.path.join(in_dir, f'{i:08d}.png'), 'wb') as fp:
+            fp.write(frame)
+
+
+def upscale_staged(
+    count: int,
+    work_dir: str,
+    upscale_cmd: Callable[[str, str], List[str]],
+    popen: Callable[..., subprocess.Popen] = subprocess.Popen,
+) -> List[bytes]:
+    """Upscale the *count* frames staged in *work_dir* and return the results in order."""
+    in_dir = os.path.join(work_dir, 'in')
+    out_dir = os.path.join(work_dir, 'out')
+    with popen(upscale_cmd(in_dir, out_dir), stdout=subprocess.DEVNULL,
+               stderr=subprocess.PIPE) as process:
+        _, stderr = process.communicate()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, process.args, stderr=stderr)
+
+    upscaled = []
+    for i in range(count):
+        with open(os.path.join(out_dir, f'{i:08d}.png'), 'rb') as fp:
+            upscaled.append(fp.read())
+    return upscaled
+
+
+def upscale_batch(
+    frames: List[bytes],
+    work_dir: str,
+    upscale_cmd: Callable[[str, str], List[str]],
+    popen: Callable[..., subprocess.Popen] = subprocess.Popen,
+) -> List[bytes]:
+    """Upscale *frames* with one upscaler run and return the results in order."""
+    stage_batch(frames, work_dir)
+    return upscale_staged(len(frames), work_dir, upscale_cmd, popen)
+
+
+class _Stage(threading.Thread):
+    """Run *func* on items taken from *source*, putting its results on *sink*.
+
+    The stage ends when *source* is exhausted or *stop* is set; the exception
+    that ended it is kept in :attr:`error` and sets *stop* for every other
+    stage.
+    """
+
+    def __init__(self, func: Callable[[Any], Any], source: Iterable[Any], sink: 'queue.Queue[Any]',
+                 stop: threading.Event) -> None:
+        super().__init__(daemon=True)
+        self.func = func
+        self.source = source
+        self.sink = sink
+        self.stop = stop
+        self.error: Optional[BaseException] = None
+
+    def run(self) -> None:
+        try:
+            for item in self.source:
+                if self.stop.is_set() or not _put(self.sink, self.func(item), self.stop):
+                    break
+        except BaseException as err:  # pylint: disable=broad-except
+            if not self.stop.is_set():  # Later errors only follow from the first
+                self.error = err
+            self.stop.set()
+        finally:
+            _put(self.sink, _END, self.stop)
+
+
+def _put(sink: 'queue.Queue[Any]', item: Any, stop: threading.Event) -> bool:
+    """Put *item* on the bounded *sink* unless *stop* is set first."""
+    while not stop.is_set():
+        try:
+            sink.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _drain(source: 'queue.Queue[Any]', stop: threading.Event) -> Iterator[Any]:
+    """Yield items of *source* up to ``_END`` or until *stop* is set."""
+    while not stop.is_set():
+        try:
+            item = source.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if item is _END:
+            return
+        yield item
+
+
+def run_frame_pipeline(
+    input_file: str,
+    encoder_cmd: List[str],
+    upscale_cmd: Callable[[str, str], List[str]],
+    batch_size: int,
+    on_frames: Optional[Callable[[int], None]] = None,
+    scratch_dir: Optional[str] = None,
+    dedup_threshold: Optional[int] = None,
+    hash_size: int = 16,
+    stats: Optional[Dict[str, int]] = None,
+    popen: Callable[..., subprocess.Popen] = subprocess.Popen,
+) -> bool:
+    """Decode, upscale and encode *input_file* through pipes.
+
+    Args:
+        input_file: Source video.
+        encoder_cmd: ffmpeg command reading a PNG stream from stdin
+            (``-f image2pipe -c:v png -i -``).
+        upscale_cmd: Builds the upscaler command for an input and an output
+            directory.
+        batch_size: Frames per upscaler run; up to five batches are in flight.
+        on_frames: Called with the running count of encoded frames.
+        scratch_dir: Parent directory for the per-batch scratch directory.
+        dedup_threshold: Enable duplicate-frame skipping with this dHash
+            distance; ``None`` upscales every frame.
+        hash_size: Rows (and columns of differences) of the dHash grid.
+        stats: Filled with the ``frames`` encoded and the ``upscaled`` count.
+        popen: Starts the decoder, upscaler and encoder processes, e.g.
+            :meth:`JobControl.popen <riparr_common.job_control.JobControl.popen>`
+            bound to the job.
+
+    Returns:
+        ``True`` if decoder, upscaler and encoder all succeeded.
+    """
+    work_dir = tempfile.mkdtemp(prefix='.frames_', dir=scratch_dir)
+    deduper = FrameDeduper(dedup_threshold) if dedup_threshold is not None else None
+    done = upscaled = 0
+    stop = threading.Event()
+    decoded: 'queue.Queue[Any]' = queue.Queue(maxsize=1)
+    upscaled_batches: 'queue.Queue[Any]' = queue.Queue(maxsize=1)
+    stages: List[_Stage] = []
+    error: Optional[BaseException] = None
+    try:
+        with contextlib.ExitStack() as stack:
+            decoder = stack.enter_context(popen(
+                decoder_cmd(input_file), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            ))
+            encoder = stack.enter_context(popen(
+                encoder_cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            ))
+            hasher = None
+            if deduper is not None:
+                hasher = stack.enter_context(popen(
+                    hash_decoder_cmd(input_file, hash_size), stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL
+                ))
+
+            def _decode(item: Tuple[int, List[bytes]]) -> Tuple[Optional[str], int, Any, int]:
+                index, batch = item
+                sources = None
+                if deduper is not None:
+                    unique, sources = deduper.plan(
+                        read_hashes(hasher.stdout, len(batch), hash_size))
+                    batch = [batch[i] for i in unique]
+                if not batch:
+                    return None, 0, sources, len(sources)
+                batch_dir = os.path.join(work_dir, f'{index:08d}')
+                stage_batch(batch, batch_dir)
+                return batch_dir, len(batch), sources, len(sources or batch)
+
+            def _upscale(item: Tuple[Optional[str], int, Any, int]) -> Tuple[List[bytes], Any, int]:
+                batch_dir, count, sources, frames = item
+                if batch_dir is None:
+                    return [], sources, frames
+                try:
+                    return upscale_staged(count, batch_dir, upscale_cmd, popen), sources, frames
+                finally:
+                    shutil.rmtree(batch_dir, ignore_errors=True)
+
+            stages = [
+                _Stage(_decode, enumerate(iter_frame_batches(decoder.stdout, batch_size)),
+                       decoded, stop),
+                _Stage(_upscale, _drain(decoded, stop), upscaled_batches, stop),
+            ]
+            for stage in stages:
+                stage.start()
+            try:
+                for outputs, sources, frames in _drain(upscaled_batches, stop):
+                    upscaled += len(outputs)
+                    if deduper is not None:
+                        outputs = deduper.assemble(sources, outputs)
+                    for frame in outputs:
+                        encoder.stdin.write(frame)
+                    done += frames
+                    if on_frames is not None:
+                        on_frames(done)
+            except BaseException as err:  # pylint: disable=broad-except
+                error = err
+                stop.set()
+            finally:
+                if stop.is_set():
+                    decoder.kill()  # Unblocks a decode stage waiting for frames
+                for stage in stages:
+                    stage.join()
+                error = error or next((stage.error for stage in stages if stage.error), None)
+                if not encoder.stdin.closed:
+                    try:
+                        encoder.stdin.close()
+                    except BrokenPipeError:
+                        pass
+                if hasher is not None:
+                    hasher.kill()
+            if isinstance(error, (subprocess.CalledProcessError, ValueError, OSError)):
+                print(f"Frame pipeline failed for {input_file}: {error}")
+                decoder.kill()
+                encoder.kill()
+                return False
+            if error is not None:
+                raise error
+            decoder.wait()
+            encoder.wait()
+        return decoder.returncode == 0 and encoder.returncode == 0 and done > 0
+    except OSError as e:
+        print(f"Frame pipeline failed for {input_file}: {e}")
+        return False
+    finally:
+        if stats is not None:
+            stats.update(frames=done, upscaled=upscaled)
+        shutil.rmtree(work_dir, ignore_errors=True)
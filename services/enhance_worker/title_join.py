@@ -0,0 +1,140 @@
+"""Job-level join of titles enhanced while the disc is still being ripped.
+
+The rip worker publishes ``rip.title_complete`` as soon as each title file is
+closed, so the enhance worker starts upscaling title 1 while title 2 is still
+being ripped. ``enhance.complete`` must still describe the whole job, so
+:class:`TitleJoin` records each title's result in an ``enhance_titles:<job>``
+hash and makes sure every title is processed exactly once. That holds
+whether the title is picked up from its ``title_complete`` event or from the
+job's ``rip.complete``, and across enhance replicas: the caller that runs a
+title holds an ``enhance_titles:<job>:claim:<file>`` key (``SET NX``) whose
+TTL is renewed while it runs. Other callers poll for the result and take
+over the claim if the title failed or its owner died. Results survive a
+worker restart, so a redelivered ``rip.complete`` only processes the titles
+that never finished.
+"""
+
+import json
+import logging
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+Result = Dict[str, Any]
+
+# Only the claim's owner (its token) may renew or delete it
+_RENEW = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class TitleJoin:
+    """Exactly-once processing of a job's titles with results kept in Redis.
+
+    Args:
+        client: Redis client created with ``decode_responses=True``.
+        ttl: Seconds a job's records are kept after its last update.
+        claim_ttl: Seconds a title's claim lives without renewal.
+        poll_interval: Seconds between checks while another caller runs a title.
+    """
+
+    PREFIX = 'enhance_titles:'
+
+    def __init__(self, client: redis.Redis, ttl: int = 7 * 24 * 3600,
+                 claim_ttl: int = 60, poll_interval: float = 0.5) -> None:
+        self.client = client
+        self.ttl = ttl
+        self.claim_ttl = claim_ttl
+        self.poll_interval = poll_interval
+        self._renew = client.register_script(_RENEW)
+        self._release = client.register_script(_RELEASE)
+
+    def begin(self, job_id: str) -> bool:
+        """Return True only for the first caller of a job, which announces its start."""
+        key = self.PREFIX + job_id + ':started'
+        return bool(self.client.set(key, 1, nx=True, ex=self.ttl))
+
+    def result(self, job_id: str, input_file: str) -> Optional[Result]:
+        """Return the stored result of one title, or ``None``."""
+        value = self.client.hget(self.PREFIX + job_id, input_file)
+        return json.loads(value) if value else None
+
+    def results(self, job_id: str) -> Dict[str, Result]:
+        """Return the stored results of all finished titles of a job."""
+        return {path: json.loads(value)
+                for path, value in self.client.hgetall(self.PREFIX + job_id).items()}
+
+    def _claim_key(self, job_id: str, input_file: str) -> str:
+        """Key held by the caller running *input_file* of *job_id*."""
+        return f"{self.PREFIX}{job_id}:claim:{input_file}"
+
+    def _keep_claim(self, key: str, token: str, stop: threading.Event) -> None:
+        """Renew the claim *key* until *stop* is set."""
+        while not stop.wait(self.claim_ttl / 3):
+            try:
+                if not self._renew(keys=[key], args=[token, self.claim_ttl]):
+                    logger.warning("Claim %s was lost while running", key)
+                    return
+            except redis.RedisError as err:
+                logger.error("Could not renew claim %s: %s", key, err)
+
+    def run(self, job_id: str, input_file: str, func: Callable[[], Result]) -> Result:
+        """Return the result for *input_file*, calling *func* unless it is done or running.
+
+        While another caller (in this or another replica) holds the title's
+        claim, this one waits for its result; if that caller fails, this one
+        claims the title and runs *func* itself.
+        """
+        key = self._claim_key(job_id, input_file)
+        token = uuid.uuid4().hex
+        while True:
+            result = self.result(job_id, input_file)
+            if result is not None:
+                return result
+            if self.client.set(key, token, nx=True, ex=self.claim_ttl):
+                break
+            time.sleep(self.poll_interval)
+
+        stop = threading.Event()
+        try:
+            # Stored and released between the check and the claim
+            result = self.result(job_id, input_file)
+            if result is not None:
+                return result
+            threading.Thread(target=self._keep_claim, args=(key, token, stop),
+                             daemon=True).start()
+            result = func()
+            pipe = self.client.pipeline()
+            pipe.hset(self.PREFIX + job_id, input_file, json.dumps(result))
+            pipe.expire(self.PREFIX + job_id, self.ttl)
+            pipe.execute()
+            return result
+        finally:
+            stop.set()
+            self._release(keys=[key], args=[token])
+
+    def finish(self, job_id: str) -> None:
+        """Mark a job complete so late ``title_complete`` events are ignored."""
+        pipe = self.client.pipeline()
+        pipe.delete(self.PREFIX + job_id, self.PREFIX + job_id + ':started')
+        pipe.set(self.PREFIX + job_id + ':done', 1, ex=self.ttl)
+        pipe.execute()
+
+    def finished(self, job_id: str) -> bool:
+        """Return True once :meth:`finish` was called for the job."""
+        return bool(self.client.exists(self.PREFIX + job_id + ':done'))
@@ -9,7 +9,8 @@ import json
 import os
 import sys
 import time
-from typing import Any, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
 
 # Third-party
 try:  # Ollama is optional in some environments
@@ -19,6 +20,12 @@ except ImportError:  # pragma: no cover
 
 import redis
 
+from riparr_common import metrics
+from riparr_common.publisher import EventPublisher
+from riparr_common.streams import StreamConsumer
+from riparr_common.tracing import Tracer
+from title_cache import TitleCache
+
 # Service toggle
 ENABLE = os.getenv("ENABLE_METADATA", "false").lower() == "true"
 if not ENABLE:
@@ -28,50 +35,137 @@ if not ENABLE:
 # Redis connection
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379")
 r = redis.from_url(REDIS_URL, decode_responses=True)
+publisher = EventPublisher.from_env(r)
+tracer = Tracer.from_env(r, "metadata-worker")
 
 # Config
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama2")
 METADATA_DIR = os.getenv("METADATA_DIR", "/data/metadata")
 os.makedirs(METADATA_DIR, exist_ok=True)
+# Normalize all uncached titles of a job in one prompt (up to BATCH_SIZE each)
+METADATA_BATCH = os.getenv("METADATA_BATCH", "true").lower() == "true"
+METADATA_BATCH_SIZE = int(os.getenv("METADATA_BATCH_SIZE", "20"))
+OLLAMA_CONCURRENCY = int(os.getenv("OLLAMA_CONCURRENCY", "2"))
+
+title_cache = TitleCache(
+    r,
+    ttl=int(os.getenv("TITLE_CACHE_TTL", str(30 * 24 * 3600))),
+    max_entries=int(os.getenv("TITLE_CACHE_MAX_ENTRIES", "50000")),
+)
+# Bounds the number of Ollama requests in flight
+ollama_pool = ThreadPoolExecutor(max_workers=max(1, OLLAMA_CONCURRENCY))
+ollama_latency = metrics.REGISTRY.histogram(
+    "riparr_ollama_request_seconds", "Duration of Ollama chat requests.", ("outcome",))
+
+
+def fallback_metadata(title: str) -> Dict[str, str]:
+    """Return metadata derived from *title* alone, used when Ollama is unavailable."""
+    return {
+        "normalized_title": title,
+        "directory": "/Movies/",
+        "file_pattern": f"{title}.mkv",
+    }
+
+
+def ask_ollama(prompt: str) -> Optional[Any]:
+    """Send *prompt* to Ollama and return the decoded JSON answer, or ``None``."""
+    started = time.monotonic()
+    outcome = "error"
+    try:
+        response = ollama.chat(
+            model=OLLAMA_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            format="json",
+        )
+        answer = json.loads(response["message"]["content"])
+        outcome = "ok"
+        return answer
+    except (json.JSONDecodeError, KeyError, TypeError) as err:
+        print(f"Ollama error: {err}")
+        return None
+    finally:
+        ollama_latency.observe(time.monotonic() - started, outcome=outcome)
 
 
-def normalize_title(filename: str) -> Dict[str, str]:
-    """Return normalized title metadata for *filename* using Ollama (with graceful fallback)."""
-    title = os.path.splitext(filename)[0]
-
-    if ollama is None:
-        return {
-            "normalized_title": title,
-            "directory": "/Movies/",
-            "file_pattern": f"{title}.mkv",
-        }
-
+def normalize_with_ollama(title: str) -> Optional[Dict[str, str]]:
+    """Normalize a single *title*; ``None`` if Ollama gave no usable answer."""
     prompt = (
         f"Normalize this movie title: '{title}'. "
         "Provide a clean title, year if available, directory structure like "
         "/Movies/Title (Year)/, and file pattern like Title (Year).mkv. "
         "Respond in JSON format with keys: normalized_title, directory, file_pattern."
     )
+    answer = ask_ollama(prompt)
+    return answer if isinstance(answer, dict) else None
 
-    try:
-        response = ollama.chat(model=OLLAMA_MODEL, messages=[{"role": "user", "content": prompt}])
-        return json.loads(response["message"]["content"])
-    except (json.JSONDecodeError, KeyError, TypeError) as err:
-        print(f"Ollama error: {err}")
-        return {
-            "normalized_title": title,
-            "directory": "/Movies/",
-            "file_pattern": f"{title}.mkv",
-        }
+
+def normalize_batch_with_ollama(titles: List[str]) -> Dict[str, Dict[str, str]]:
+    """Normalize several *titles* with one structured prompt.
+
+    Titles missing from the answer are left out of the result.
+    """
+    prompt = (
+        "Normalize each of these movie or episode titles from one disc: "
+        f"{json.dumps(titles)}. For each, provide a clean title, year if available, "
+        "directory structure like /Movies/Title (Year)/, and file pattern like "
+        "Title (Year).mkv. Respond in JSON format as an object with key results: "
+        "a list with one object per input title, each with keys source (the input "
+        "title, unchanged), normalized_title, directory, file_pattern."
+    )
+    answer = ask_ollama(prompt)
+    results = answer.get("results") if isinstance(answer, dict) else None
+    normalized = {}
+    for item in results if isinstance(results, list) else []:
+        if isinstance(item, dict) and item.get("source") in titles:
+            normalized[item.pop("source")] = item
+    return normalized
+
+
+def normalize_titles(filenames: List[str]) -> List[Dict[str, str]]:
+    """Return normalized title metadata for each of *filenames*.
+
+    Cached titles are served from Redis. The rest are normalized in batch
+    prompts (or one prompt per title) with at most ``OLLAMA_CONCURRENCY``
+    requests in flight. Titles Ollama cannot normalize fall back to the
+    file name.
+    """
+    titles = [os.path.splitext(filename)[0] for filename in filenames]
+    if ollama is None:
+        return [fallback_metadata(title) for title in titles]
+
+    results = title_cache.get_many(titles, OLLAMA_MODEL)
+    missing = [title for title in dict.fromkeys(titles) if title not in results]
+
+    fresh: Dict[str, Dict[str, str]] = {}
+    if METADATA_BATCH and len(missing) > 1:
+        chunks = [missing[i:i + METADATA_BATCH_SIZE]
+                  for i in range(0, len(missing), METADATA_BATCH_SIZE)]
+        for batch in ollama_pool.map(normalize_batch_with_ollama, chunks):
+            fresh.update(batch)
+    # Single prompts for titles the batch answer skipped (or with batching off)
+    single = [title for title in missing if title not in fresh]
+    for title, metadata in zip(single, ollama_pool.map(normalize_with_ollama, single)):
+        if metadata is not None:
+            fresh[title] = metadata
+
+    title_cache.set_many(fresh, OLLAMA_MODEL)
+    results.update(fresh)
+    return [dict(results.get(title) or fallback_metadata(title)) for title in titles]
+
+
+def normalize_title(filename: str) -> Dict[str, str]:
+    """Return normalized title metadata for *filename* using Ollama (with graceful fallback)."""
+    return normalize_titles([filename])[0]
 
 
 def process_transcode_complete(job_id: str, transcoded_files: List[str]) -> None:
     """Generate metadata for *transcoded_files* and publish completion event."""
     metadata_list: List[Dict[str, Any]] = []
 
-    for file_path in transcoded_files:
-        filename = os.path.basename(file_path)
-        metadata = normalize_title(filename)
+    filenames = [os.path.basename(file_path) for file_path in transcoded_files]
+    normalized = normalize_titles(filenames)
+
+    for file_path, filename, metadata in zip(transcoded_files, filenames, normalized):
         metadata.update({"original_file": file_path, "job_id": job_id})
         metadata_list.append(metadata)
 
@@ -80,7 +174,7 @@ def process_transcode_complete(job_id: str, transcoded_files: List[str]) -> None
             json.dump(metadata, fp, indent=2)
 
     complete_msg = {"job_id": job_id, "metadata": metadata_list}
-    r.xadd("metadata_events", {"event": "complete", "data": json.dumps(complete_msg)})
+    publisher.publish("metadata_events", "complete", complete_msg)
     print(f"Published metadata.complete for job {job_id}")
 
 
@@ -93,7 +187,7 @@ def process_transcode_event(data: Dict[str, Any]) -> None:
     transcoded_files = data["transcoded_files"]
 
     start_msg = {"job_id": job_id, "input_files": transcoded_files}
-    r.xadd("metadata_events", {"event": "start", "data": json.dumps(start_msg)})
+    publisher.publish("metadata_events", "start", start_msg)
     print(f"Published metadata.start for job {job_id}")
 
     process_transcode_complete(job_id, transcoded_files)
@@ -101,16 +195,12 @@ def process_transcode_event(data: Dict[str, Any]) -> None:
 
 def main() -> None:
     """Event-loop: consume transcode_events Redis stream indefinitely."""
-    last_id = "0"
+    consumer = StreamConsumer.from_env(r, "transcode_events", "metadata-worker")
+    metrics.start_from_env(r, [(consumer.stream, consumer.group)])
     while True:
         try:
-            messages = r.xread({"transcode_events": last_id}, block=1000)
-            for _stream, msgs in messages:
-                for msg_id, msg in msgs:
-                    last_id = msg_id
-                    data = json.loads(msg["data"])
-                    process_transcode_event(data)
-        except (redis.ConnectionError, json.JSONDecodeError) as err:
+            consumer.run(tracer.traced("metadata", process_transcode_event, events=("complete",)))
+        except redis.ConnectionError as err:
             print(f"Stream read error: {err}")
             time.sleep(1)
 
@@ -0,0 +1,96 @@
+"""Persistent cache of Ollama title normalizations.
+
+Keys are built from the source title, normalized (lower case, punctuation and
+underscores collapsed), and the model name, so ``THE_MATRIX`` and
+``The Matrix`` share one entry. Entries expire after ``ttl`` seconds without
+use. When more than ``max_entries`` are stored the least recently used ones
+are evicted, tracked in a sorted set scored by last use.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import time
+from typing import Any, Dict, Iterable
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+Metadata = Dict[str, Any]
+
+
+def source_key(title: str) -> str:
+    """Return *title* normalized for cache lookups."""
+    return re.sub(r'[\W_]+', ' ', title).strip().lower()
+
+
+class TitleCache:
+    """Normalized-title metadata cached in Redis under ``title_norm:*`` keys.
+
+    Args:
+        client: Redis client created with ``decode_responses=True``.
+        ttl: Seconds an entry lives after its last use.
+        max_entries: Entries kept before least recently used ones are evicted.
+    """
+
+    PREFIX = 'title_norm:'
+    INDEX = 'title_norm_index'
+
+    def __init__(self, client: redis.Redis, ttl: int = 30 * 24 * 3600,
+                 max_entries: int = 50000) -> None:
+        self.client = client
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def _key(self, title: str, model: str) -> str:
+        """Cache key for *title* normalized by *model*."""
+        identity = f"{model}|{source_key(title)}"
+        return self.PREFIX + hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+    def get_many(self, titles: Iterable[str], model: str) -> Dict[str, Metadata]:
+        """Return cached metadata for those *titles* that have an entry."""
+        titles = list(dict.fromkeys(titles))
+        if not titles:
+            return {}
+        keys = [self._key(title, model) for title in titles]
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for key in keys:
+                pipe.getex(key, ex=self.ttl)
+            values = pipe.execute()
+            hits = {}
+            now = time.time()
+            pipe = self.client.pipeline(transaction=False)
+            for title, key, value in zip(titles, keys, values):
+                if value:
+                    hits[title] = json.loads(value)
+                    pipe.zadd(self.INDEX, {key: now})
+            if hits:
+                pipe.execute()
+            return hits
+        except (redis.RedisError, json.JSONDecodeError) as err:
+            logger.error("Title cache lookup failed: %s", err)
+            return {}
+
+    def set_many(self, results: Dict[str, Metadata], model: str) -> None:
+        """Store *results* (source title -> metadata) and evict beyond ``max_entries``."""
+        if not results:
+            return
+        now = time.time()
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for title, metadata in results.items():
+                key = self._key(title, model)
+                pipe.set(key, json.dumps(metadata), ex=self.ttl)
+                pipe.zadd(self.INDEX, {key: now})
+            pipe.zcard(self.INDEX)
+            size = pipe.execute()[-1]
+            if size > self.max_entries:
+                evicted = [key for key, _score in
+                           self.client.zpopmin(self.INDEX, size - self.max_entries)]
+                if evicted:
+                    self.client.delete(*evicted)
+        except redis.RedisError as err:
+            logger.error("Title cache store failed: %s", err)
@@ -0,0 +1,164 @@
+"""Event-driven container health tracking for the orchestrator.
+
+The orchestrator used to look up six containers one after another on every
+loop. :class:`HealthMonitor` follows the Docker events API instead and
+updates the status of a single container when that container starts, stops,
+pauses or reports a new health status. A slow concurrent poll still inspects
+all containers through cached handles, so state is reconciled even if an
+event was missed. ``on_change`` is called with the full snapshot only when a
+status has actually changed.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from docker.errors import APIError, DockerException, NotFound
+
+logger = logging.getLogger(__name__)
+
+Snapshot = Dict[str, str]
+
+# Container actions after which the container is inspected again
+STATE_ACTIONS = ['start', 'restart', 'die', 'stop', 'pause', 'unpause']
+
+
+def container_status(container: Any) -> str:
+    """Return the health status of *container*, or its state if it has no healthcheck."""
+    state = container.attrs.get('State', {})
+    if 'Health' in state:
+        return state['Health']['Status']
+    return container.status
+
+
+class HealthMonitor:
+    """Track the status of *services* from Docker events plus a periodic poll.
+
+    Args:
+        client: ``docker.DockerClient``.
+        services: Container names to track.
+        on_change: Called with the whole snapshot whenever a status changes.
+        poll_interval: Seconds between full reconciliation polls.
+        max_workers: Threads used to inspect or control containers concurrently.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        services: Iterable[str],
+        on_change: Callable[[Snapshot], None],
+        poll_interval: float = 60.0,
+        max_workers: Optional[int] = None,
+    ) -> None:
+        self.client = client
+        self.services = list(services)
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or len(self.services) or 1,
+                                        thread_name_prefix='health')
+        self._containers: Dict[str, Any] = {}
+        self._snapshot: Snapshot = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def container(self, service: str) -> Any:
+        """Return the cached handle for *service*, looking it up on first use."""
+        handle = self._containers.get(service)
+        if handle is None:
+            handle = self.client.containers.get(service)
+            self._containers[service] = handle
+        return handle
+
+    def inspect(self, service: str) -> str:
+        """Return the current status of *service* with at most one API call."""
+        try:
+            handle = self._containers.get(service)
+            if handle is not None:
+                try:
+                    handle.reload()
+                    return container_status(handle)
+                except NotFound:
+                    # Recreated under the same name; look it up again
+                    self._containers.pop(service, None)
+            return container_status(self.container(service))
+        except NotFound:
+            return 'not_found'
+        except APIError as err:
+            return f"error: {err}"
+
+    def run_all(self, func: Callable[[str], Any]) -> List[Any]:
+        """Call ``func(service)`` for every service concurrently."""
+        return list(self._pool.map(func, self.services))
+
+    def snapshot(self) -> Snapshot:
+        """Return a copy of the last known statuses."""
+        with self._lock:
+            return dict(self._snapshot)
+
+    def _apply(self, statuses: Snapshot) -> bool:
+        """Merge *statuses* into the snapshot; notify and return True on change."""
+        with self._lock:
+            changed = {s: v for s, v in statuses.items() if self._snapshot.get(s) != v}
+            if not changed:
+                return False
+            self._snapshot.update(changed)
+            self.on_change(dict(self._snapshot))
+            return True
+
+    def poll(self) -> bool:
+        """Inspect all services concurrently; returns True if anything changed."""
+        statuses = self.run_all(self.inspect)
+        return self._apply(dict(zip(self.services, statuses)))
+
+    def handle_event(self, event: Dict[str, Any]) -> bool:
+        """Update the snapshot from one Docker container event."""
+        name = event.get('Actor', {}).get('Attributes', {}).get('name')
+        if name not in self.services:
+            return False
+        action = event.get('Action') or event.get('status') or ''
+        if action.startswith('health_status'):
+            status = action.split(':', 1)[1].strip()
+        elif action == 'destroy':
+            self._containers.pop(name, None)
+            status = 'not_found'
+        elif action in STATE_ACTIONS:
+            status = self.inspect(name)
+        else:
+            return False
+        return self._apply({name: status})
+
+    def watch_events(self) -> None:
+        """Follow Docker container events until :meth:`stop` is called."""
+        filters = {
+            'type': 'container',
+            'container': self.services,
+            'event': STATE_ACTIONS + ['destroy', 'health_status'],
+        }
+        while not self._stop.is_set():
+            try:
+                events = self.client.events(decode=True, filters=filters)
+                # Catch up on anything that happened while not subscribed
+                self.poll()
+                for event in events:
+                    self.handle_event(event)
+            except (DockerException, OSError) as err:
+                logger.error("Docker event stream failed: %s", err)
+            self._stop.wait(5)
+
+    def poll_forever(self) -> None:
+        """Reconcile the snapshot every ``poll_interval`` seconds."""
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll()
+            except (DockerException, OSError) as err:
+                logger.error("Health poll failed: %s", err)
+
+    def start(self) -> None:
+        """Start the event watcher and the reconciliation poller."""
+        for target in (self.watch_events, self.poll_forever):
+            threading.Thread(target=target, daemon=True).start()
+
+    def stop(self) -> None:
+        """Stop the background threads after their current wait."""
+        self._stop.set()
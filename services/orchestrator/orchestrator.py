@@ -13,6 +13,11 @@ import redis
 import docker
 from docker.errors import DockerException
 
+from health_monitor import HealthMonitor
+from riparr_common.job_control import ACTIONS as JOB_ACTIONS
+from riparr_common.job_store import JobStore
+from riparr_common.retention import StreamTrimmer
+
 # Load configuration
 config_path = os.getenv('CONFIG_PATH', '/config/config.yaml')
 try:
@@ -36,6 +41,22 @@ except DockerException as e:
     print(f"Error connecting to Docker: {e}, exiting.")
     sys.exit(1)
 
+# Job index maintained by the workers' publishers
+job_store = JobStore.from_env(r)
+
+# Stream retention
+trimmer = StreamTrimmer.from_config(r, config)
+trim_interval = (config.get('streams') or {}).get('trim_interval', 60)
+
+# Health monitoring and command handling
+orchestrator_config = config.get('orchestrator') or {}
+health_poll_interval = orchestrator_config.get('health_poll_interval', 60)
+stats_interval = orchestrator_config.get('stats_interval', 30)
+command_block_ms = orchestrator_config.get('command_block_ms', 1000)
+
+# Id of the last handled orchestrator_commands entry
+COMMAND_CURSOR_KEY = 'orchestrator:last_command_id'
+
 # Service containers
 pipeline_services = [
     'drive-watcher',
@@ -46,53 +67,48 @@ pipeline_services = [
     'blackhole'
 ]
 
-def check_health():
-    """Check health of all services."""
-    health_status = {}
-    for service in pipeline_services:
+def publish_health(health):
+    """Publish a ``health_check`` event; called only when a status changed."""
+    try:
+        r.xadd(
+            "orchestrator_events",
+            {"event": "health_check", "data": json.dumps(health)},
+        )
+    except redis.RedisError as err:
+        print(f"Error publishing health: {err}")
+
+monitor = HealthMonitor(client, pipeline_services, publish_health,
+                        poll_interval=health_poll_interval)
+
+def get_worker_stats():
+    """Return the executor statistics workers publish to ``worker_stats``."""
+    stats = {}
+    for service, raw in r.hgetall('worker_stats').items():
         try:
-            container = client.containers.get(service)
-            status = (
-                container.attrs["State"]["Health"]["Status"]
-                if "Health" in container.attrs["State"]
-                else container.status
-            )
-            health_status[service] = status
-        except docker.errors.NotFound:
-            health_status[service] = 'not_found'
-        except docker.errors.APIError as err:
-            health_status[service] = f"error: {err}"
-    return health_status
+            stats[service] = json.loads(raw)
+        except json.JSONDecodeError:
+            continue
+    return stats
+
+def control_service(service, action, verb):
+    """Call *action* (``pause``, ``unpause`` or ``stop``) on one service container."""
+    try:
+        getattr(monitor.container(service), action)()
+        print(f"{verb} {service}")
+    except docker.errors.APIError as err:
+        print(f"Error on {action} of {service}: {err}")
 
 def pause_pipeline():
     """Pause all pipeline services."""
-    for service in pipeline_services:
-        try:
-            container = client.containers.get(service)
-            container.pause()
-            print(f"Paused {service}")
-        except docker.errors.APIError as err:
-            print(f"Error pausing {service}: {err}")
+    monitor.run_all(lambda service: control_service(service, 'pause', 'Paused'))
 
 def resume_pipeline():
     """Resume all pipeline services."""
-    for service in pipeline_services:
-        try:
-            container = client.containers.get(service)
-            container.unpause()
-            print(f"Resumed {service}")
-        except docker.errors.APIError as err:
-            print(f"Error resuming {service}: {err}")
+    monitor.run_all(lambda service: control_service(service, 'unpause', 'Resumed'))
 
 def graceful_shutdown():
     """Gracefully shutdown all services."""
-    for service in pipeline_services:
-        try:
-            container = client.containers.get(service)
-            container.stop()
-            print(f"Stopped {service}")
-        except docker.errors.APIError as err:
-            print(f"Error stopping {service}: {err}")
+    monitor.run_all(lambda service: control_service(service, 'stop', 'Stopped'))
 
 def process_command(data):
     """Handle a command received on ``orchestrator_commands`` stream."""
@@ -108,25 +124,75 @@ def process_command(data):
         graceful_shutdown()
         r.xadd("orchestrator_events", {"event": "shutdown_initiated", "data": timestamp})
         sys.exit(0)
+    elif action in JOB_ACTIONS:
+        # Applied by the worker replica running the job
+        print(f"Job command {action} for job {data.get('job_id')}")
+
+def command_cursor():
+    """Return the id after which ``orchestrator_commands`` entries are unhandled.
+
+    Commands sent while the orchestrator was down still run after a restart,
+    but none runs twice. On the first start only new commands count.
+    """
+    last_id = r.get(COMMAND_CURSOR_KEY)
+    if last_id:
+        return last_id
+    latest = r.xrevrange("orchestrator_commands", count=1)
+    return latest[0][0] if latest else '0-0'
+
+def trim_streams():
+    """Apply the retention policy and publish stream length/memory stats."""
+    removed = trimmer.trim_all()
+    r.xadd(
+        "orchestrator_events",
+        {"event": "stream_stats", "data": json.dumps({
+            "removed": removed,
+            "streams": trimmer.stats(),
+            "timestamp": time.time()
+        })},
+    )
+
+def publish_worker_stats():
+    """Publish the executor statistics of all workers and the job counts."""
+    r.xadd(
+        "orchestrator_events",
+        {"event": "worker_stats", "data": json.dumps(get_worker_stats())},
+    )
+    r.xadd(
+        "orchestrator_events",
+        {"event": "job_stats", "data": json.dumps(job_store.counts())},
+    )
 
 def main() -> None:
-    """Main event loop: health checks and command processing."""
+    """Main event loop: command processing plus periodic housekeeping.
+
+    Health is tracked in the background by ``monitor``; this loop only blocks
+    for ``command_block_ms`` so commands are handled as soon as they arrive.
+    """
     print("Orchestrator started.")
-    last_id = '0'
+    monitor.start()
+    last_id = None
+    next_trim = 0.0
+    next_stats = 0.0
     while True:
         try:
-            # Check health every 30 seconds
-            health = check_health()
-            r.xadd(
-                "orchestrator_events",
-                {"event": "health_check", "data": json.dumps(health)},
-            )
+            if last_id is None:
+                last_id = command_cursor()
+            now = time.time()
+            if now >= next_trim:
+                trim_streams()
+                next_trim = now + trim_interval
+            if now >= next_stats:
+                publish_worker_stats()
+                next_stats = now + stats_interval
 
             # Listen for commands
-            messages = r.xread({"orchestrator_commands": last_id}, block=30_000)  # 30 seconds
+            messages = r.xread({"orchestrator_commands": last_id}, block=command_block_ms)
             for _stream, msgs in messages:
                 for msg_id, msg in msgs:
+                    # Recorded first: a shutdown must not run again after the restart
                     last_id = msg_id
+                    r.set(COMMAND_CURSOR_KEY, msg_id)
                     data = json.loads(msg['data'])
                     process_command(data)
         except (redis.RedisError, json.JSONDecodeError, docker.errors.APIError) as err:
@@ -0,0 +1,75 @@
+"""Persistent index of completed rips, keyed by disc fingerprint.
+
+Each entry records the job that ripped the disc, the titles it ripped and the
+files they produced. A disc inserted again (a re-rip, or the same disc fed
+twice by mistake) is looked up here before makemkvcon runs, so the worker can
+reuse the existing rip instead of spending another half hour on it.
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+class DiscIndex:
+    """Completed rips under ``disc_index:<fingerprint>`` hashes.
+
+    Args:
+        client: Redis client created with ``decode_responses=True``.
+        ttl: Seconds an entry is kept; ``0`` keeps entries forever.
+    """
+
+    PREFIX = 'disc_index:'
+
+    def __init__(self, client: redis.Redis, ttl: int = 0) -> None:
+        self.client = client
+        self.ttl = ttl
+
+    def lookup(self, disc_fingerprint: str) -> Optional[Dict[str, Any]]:
+        """Return the completed rip of a disc, or ``None`` if it is unknown."""
+        try:
+            fields = self.client.hgetall(self.PREFIX + disc_fingerprint)
+        except redis.RedisError as err:
+            logger.error("Disc index lookup failed: %s", err)
+            return None
+        if not fields:
+            return None
+        return {
+            'job_id': fields.get('job_id'),
+            'label': fields.get('label', ''),
+            'titles': json.loads(fields.get('titles', '[]')),
+            'output_files': json.loads(fields.get('output_files', '[]')),
+            'completed_at': float(fields.get('completed_at', 0)),
+        }
+
+    def reusable(self, disc_fingerprint: str, titles: List[int]) -> Optional[Dict[str, Any]]:
+        """Return the entry if it ripped exactly *titles* and its files still exist."""
+        entry = self.lookup(disc_fingerprint)
+        if entry is None or sorted(entry['titles']) != sorted(titles):
+            return None
+        if not entry['output_files'] or not all(os.path.isfile(f) for f in entry['output_files']):
+            return None
+        return entry
+
+    def record(self, disc_fingerprint: str, job_id: str, label: str, titles: List[int],
+               output_files: List[str]) -> None:
+        """Store the completed rip of a disc, replacing any earlier one."""
+        key = self.PREFIX + disc_fingerprint
+        try:
+            pipe = self.client.pipeline()
+            pipe.delete(key)
+            pipe.hset(key, mapping={
+                'job_id': job_id, 'label': label, 'titles': json.dumps(sorted(titles)),
+                'output_files': json.dumps(output_files), 'completed_at': time.time(),
+            })
+            if self.ttl:
+                pipe.expire(key, self.ttl)
+            pipe.execute()
+        except redis.RedisError as err:
+            logger.error("Could not record disc %s: %s", disc_fingerprint, err)
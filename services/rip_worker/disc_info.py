@@ -0,0 +1,150 @@
+"""Disc scanning and fingerprinting with ``makemkvcon -r info``.
+
+The robot-mode scan lists every title with its duration, size, chapter count
+and the stream segments it plays. :func:`fingerprint` condenses the volume
+label and title list into a stable identifier, so the same disc is recognised
+when it is inserted again. :func:`duplicate_titles` finds titles that play the
+same segments (Blu-ray playlists and DVD program chains often repeat the main
+feature), so each piece of content is ripped once.
+"""
+
+import csv
+import hashlib
+import logging
+import subprocess
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# makemkv attribute ids (apdefs.h)
+AP_NAME = 2
+AP_CHAPTER_COUNT = 8
+AP_DURATION = 9
+AP_DISK_SIZE_BYTES = 11
+AP_SOURCE_FILE_NAME = 16
+AP_SEGMENTS_MAP = 26
+AP_OUTPUT_FILE_NAME = 27
+AP_VOLUME_NAME = 32
+
+
+class DiscTitle(NamedTuple):
+    """One title of a scanned disc."""
+
+    index: int
+    name: str
+    duration: int
+    size: int
+    chapters: int
+    source: str
+    segments: str
+    output_file: str
+
+
+class DiscInfo(NamedTuple):
+    """Volume label, disc name and titles of a scanned disc."""
+
+    label: str
+    name: str
+    titles: List[DiscTitle]
+
+
+def info_cmd(device: str) -> List[str]:
+    """Return the makemkvcon command scanning *device* in robot mode."""
+    return ['makemkvcon', '-r', '--cache=1', 'info', f'dev:{device}']
+
+
+def parse_duration(value: str) -> int:
+    """Convert ``H:MM:SS`` to seconds."""
+    seconds = 0
+    for part in value.split(':'):
+        seconds = seconds * 60 + int(part or 0)
+    return seconds
+
+
+def _int(value: Optional[str]) -> int:
+    """Parse an integer attribute, treating missing or malformed ones as 0."""
+    try:
+        return int(value or 0)
+    except ValueError:
+        return 0
+
+
+def parse_info(lines: Iterable[str]) -> DiscInfo:
+    """Parse ``CINFO`` / ``TINFO`` lines of a robot-mode scan."""
+    disc: Dict[int, str] = {}
+    titles: Dict[int, Dict[int, str]] = {}
+    for line in lines:
+        kind, _, rest = line.strip().partition(':')
+        if kind not in ('CINFO', 'TINFO') or not rest:
+            continue
+        fields = next(csv.reader([rest]))
+        try:
+            if kind == 'CINFO':
+                disc[int(fields[0])] = fields[2]
+            else:
+                titles.setdefault(int(fields[0]), {})[int(fields[1])] = fields[3]
+        except (IndexError, ValueError):
+            logger.debug("Ignoring malformed scan line: %s", line.strip())
+
+    parsed = []
+    for index, attrs in sorted(titles.items()):
+        try:
+            duration = parse_duration(attrs.get(AP_DURATION, '0'))
+        except ValueError:
+            duration = 0
+        parsed.append(DiscTitle(
+            index=index,
+            name=attrs.get(AP_NAME, ''),
+            duration=duration,
+            size=_int(attrs.get(AP_DISK_SIZE_BYTES)),
+            chapters=_int(attrs.get(AP_CHAPTER_COUNT)),
+            source=attrs.get(AP_SOURCE_FILE_NAME, ''),
+            segments=attrs.get(AP_SEGMENTS_MAP, ''),
+            output_file=attrs.get(AP_OUTPUT_FILE_NAME, ''),
+        ))
+    return DiscInfo(disc.get(AP_VOLUME_NAME, ''), disc.get(AP_NAME, ''), parsed)
+
+
+def scan_disc(device: str, timeout: float = 600.0) -> Optional[DiscInfo]:
+    """Scan *device*; ``None`` if makemkvcon fails or reports no titles."""
+    try:
+        result = subprocess.run(info_cmd(device), capture_output=True, text=True,
+                                timeout=timeout, check=False)
+    except (subprocess.SubprocessError, OSError) as err:
+        logger.error("Disc scan of %s failed: %s", device, err)
+        return None
+    info = parse_info(result.stdout.splitlines())
+    if result.returncode != 0 or not info.titles:
+        logger.error("Disc scan of %s returned %d with %d titles",
+                     device, result.returncode, len(info.titles))
+        return None
+    return info
+
+
+def fingerprint(info: DiscInfo) -> str:
+    """Return a stable identifier for the disc from its label and title list."""
+    digest = hashlib.sha256(f"{info.label}|{info.name}".encode('utf-8'))
+    for title in info.titles:
+        digest.update(f"\n{title.duration}|{title.size}|{title.chapters}|"
+                      f"{title.segments}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def content_key(title: DiscTitle) -> str:
+    """Return the identity of a title's content, independent of its playlist."""
+    if title.segments:
+        return f"{title.segments}|{title.size}"
+    return f"{title.duration}|{title.size}|{title.chapters}"
+
+
+def duplicate_titles(titles: Iterable[DiscTitle]) -> Dict[int, int]:
+    """Map each title that repeats an earlier title's content to that title's index."""
+    first: Dict[str, int] = {}
+    duplicates = {}
+    for title in titles:
+        key = content_key(title)
+        if key in first:
+            duplicates[title.index] = first[key]
+        else:
+            first[key] = title.index
+    return duplicates
@@ -1,17 +1,30 @@
 """Rip Worker service.
 
 Monitors drive events and processes DVD/Blu-ray ripping using MakeMKV.
+With ``WORKER_RUNTIME=asyncio`` rips run as tasks on one event loop.
 """
+import contextlib
+import functools
 import os
+import shutil
 import sys
 import time
-import threading
 import subprocess
-import json
 import uuid
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
 
 import redis
 
+from disc_index import DiscIndex
+from disc_info import DiscInfo, DiscTitle, duplicate_titles, fingerprint, scan_disc
+from riparr_common import aio, metrics, tracing
+from riparr_common.executor import JobExecutor
+from riparr_common.job_control import JobCancelled, JobControl
+from riparr_common.publisher import EventPublisher
+from riparr_common.streams import StreamConsumer
+from riparr_common.tracing import Tracer
+from title_selection import Decision, SelectionRules, decide, select_titles
+
 
 # Check if service is enabled
 enable = os.getenv('ENABLE_RIP', 'false').lower() == 'true'
@@ -22,101 +35,417 @@ if not enable:
 # Redis connection
 redis_url = os.getenv('REDIS_URL', 'redis://redis:6379')
 r = redis.from_url(redis_url, decode_responses=True)
+publisher = EventPublisher.from_env(r)
+tracer = Tracer.from_env(r, 'rip-worker')
+job_control = JobControl(r, 'rip_events', publisher)
 
 
 # Config
 mkv_output_dir = os.getenv('MKV_OUTPUT_DIR', '/data/rips')
-title_selection = os.getenv('TITLE_SELECTION', 'all')  # 'all' or specific title number
+# 'auto' (selection rules), 'all' or a specific title number
+title_selection = os.getenv('TITLE_SELECTION', 'all')
+selection_rules = SelectionRules.from_env()
 subtitle_policy = os.getenv('SUBTITLE_POLICY', 'retain')  # retain or discard
 audio_policy = os.getenv('AUDIO_POLICY', 'retain')  # retain or discard
+# Known discs: 'reuse' the earlier rip, 'skip' the job entirely, or rip again ('off')
+disc_dedup = os.getenv('DISC_DEDUP', 'reuse')
+disc_index = DiscIndex(r, int(os.getenv('DISC_INDEX_TTL', '0')))
 
-def process_drive_insert(drive_id, device):
-    """Process a drive insert event by ripping the disc using MakeMKV."""
-    job_id = str(uuid.uuid4())
-    output_dir = os.path.join(mkv_output_dir, job_id)
+def makemkv_cmd(device: str, title: str, output_dir: str) -> List[str]:
+    """Build the makemkvcon command ripping *title* ('all' or an index)."""
+    cmd = ['makemkvcon', 'mkv', f'dev:{device}', title, output_dir]
+    if subtitle_policy == 'discard':
+        cmd.append('--nosubtitles')
+    if audio_policy == 'discard':
+        cmd.append('--noaudio')
+    return cmd
 
-    # Ensure output dir exists
-    os.makedirs(output_dir, exist_ok=True)
+def parse_prgv(line: str) -> Optional[float]:
+    """Return the fraction done reported by a makemkvcon ``PRGV`` line, else ``None``."""
+    if line.startswith('PRGV:'):
+        parts = line.split(',')
+        if len(parts) >= 3:
+            current = int(parts[0].split(':')[1])
+            total = int(parts[1])
+            if total > 0:
+                return current / total
+    return None
 
-    # Publish rip.start
-    r.xadd('rip_events', {'event': 'start', 'data': json.dumps({
+def run_makemkv(cmd: List[str], on_progress: Callable[[float], None],
+                popen: Callable[..., subprocess.Popen] = subprocess.Popen) -> bool:
+    """Run makemkvcon, reporting the fraction done from its ``PRGV`` lines."""
+    with popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True
+    ) as process:
+
+        # Parse progress from stderr
+        for line in iter(process.stderr.readline, ''):
+            fraction = parse_prgv(line)
+            if fraction is not None:
+                on_progress(fraction)
+
+    return process.returncode == 0
+
+async def run_makemkv_async(cmd: List[str], on_progress: Callable[[float], None],
+                            on_start: Optional[Callable[[Any], None]] = None) -> bool:
+    """Coroutine version of :func:`run_makemkv`; cancelling it stops makemkvcon."""
+    def _on_line(line: str) -> None:
+        fraction = parse_prgv(line)
+        if fraction is not None:
+            on_progress(fraction)
+
+    return await aio.run_process(cmd, _on_line, on_start=on_start) == 0
+
+def list_mkv(output_dir: str) -> List[str]:
+    """Return the MKV files in *output_dir*."""
+    return sorted(
+        os.path.join(output_dir, f)
+        for f in os.listdir(output_dir)
+        if f.endswith('.mkv')
+    )
+
+def title_files(output_dir: str, title: DiscTitle, before: Set[str]) -> List[str]:
+    """Return the files makemkvcon wrote for *title*.
+
+    A redelivered insert rips into the same directory and overwrites the
+    files of the earlier attempt, so the file the scan names for the title
+    counts even when it existed *before*.
+    """
+    files = [f for f in list_mkv(output_dir) if f not in before]
+    named = os.path.join(output_dir, title.output_file) if title.output_file else None
+    if named and named not in files and os.path.exists(named):
+        files.append(named)
+    return sorted(files)
+
+def plan_titles(info: DiscInfo) -> Tuple[List[DiscTitle], List[Decision]]:
+    """Return the titles to rip and the decision taken on every title."""
+    if title_selection == 'auto':
+        titles, decisions = select_titles(info.titles, selection_rules)
+        if titles:
+            return titles, decisions
+        print("No title passed the selection rules, ripping all titles")
+    if title_selection in ('auto', 'all'):
+        reasons = {index: f"same segments as title {original}"
+                   for index, original in duplicate_titles(info.titles).items()}
+    else:
+        reasons = {t.index: "not selected" for t in info.titles
+                   if str(t.index) != title_selection}
+    selected = {t.index: "selected" for t in info.titles if t.index not in reasons}
+    return [t for t in info.titles if t.index in selected], decide(info.titles, selected, reasons)
+
+def title_weights(titles: List[DiscTitle]) -> List[int]:
+    """Return the progress weight of each title: its size when the scan reported sizes."""
+    return [t.size for t in titles] if all(t.size for t in titles) else [1] * len(titles)
+
+def rip_progress(job_id: str, base: int, weight: int, total: int) -> Callable[[float], None]:
+    """Return an ``on_progress`` callback for a title covering *weight* of *total*."""
+    def _on_progress(fraction: float) -> None:
+        publisher.progress('rip_events', job_id, int((base + fraction * weight) / total * 100))
+    return _on_progress
+
+def title_complete_message(job_id: str, title: DiscTitle, files: List[str],
+                           number: int, count: int) -> Dict[str, Any]:
+    """Return the ``rip.title_complete`` payload for a title whose file is closed."""
+    return {
+        "job_id": job_id,
+        "title": title.index,
+        "output_files": files,
+        "titles_done": number,
+        "titles_total": count
+    }
+
+def rip_titles(job_id: str, device: str, output_dir: str, titles: List[DiscTitle],
+               published: Optional[List[str]] = None) -> Optional[List[str]]:
+    """Rip *titles* one at a time; returns the files written or ``None`` on failure.
+
+    ``rip.title_complete`` is published as soon as each title's file is
+    closed, so the enhance worker can start on it during the rest of the rip.
+    The published files are appended to *published* as they go out.
+    """
+    weights = title_weights(titles)
+    done = 0
+    output_files = published if published is not None else []
+    for number, (title, weight) in enumerate(zip(titles, weights), 1):
+        before = set(list_mkv(output_dir))
+        if not run_makemkv(makemkv_cmd(device, str(title.index), output_dir),
+                           rip_progress(job_id, done, weight, sum(weights)),
+                           functools.partial(job_control.popen, job_id)):
+            print(f"MakeMKV failed on title {title.index} for job {job_id}")
+            return None
+        files = title_files(output_dir, title, before)
+        output_files.extend(files)
+        done += weight
+        publisher.publish('rip_events', 'title_complete',
+                          title_complete_message(job_id, title, files, number, len(titles)))
+        print(f"Published rip.title_complete for title {title.index} of job {job_id}")
+    return output_files
+
+async def rip_titles_async(job_id: str, device: str, output_dir: str,
+                           titles: List[DiscTitle],
+                           published: Optional[List[str]] = None) -> Optional[List[str]]:
+    """Coroutine version of :func:`rip_titles`."""
+    weights = title_weights(titles)
+    done = 0
+    output_files = published if published is not None else []
+    for number, (title, weight) in enumerate(zip(titles, weights), 1):
+        job_control.check(job_id)
+        before = set(list_mkv(output_dir))
+        if not await run_makemkv_async(makemkv_cmd(device, str(title.index), output_dir),
+                                       rip_progress(job_id, done, weight, sum(weights)),
+                                       functools.partial(job_control.track, job_id)):
+            print(f"MakeMKV failed on title {title.index} for job {job_id}")
+            return None
+        files = title_files(output_dir, title, before)
+        output_files.extend(files)
+        done += weight
+        await publisher.publish_async('rip_events', 'title_complete',
+                                      title_complete_message(job_id, title, files, number,
+                                                             len(titles)))
+        print(f"Published rip.title_complete for title {title.index} of job {job_id}")
+    return output_files
+
+class RipJob(NamedTuple):
+    """A disc insert that needs MakeMKV to run."""
+
+    job_id: str
+    device: str
+    output_dir: str
+    info: Optional[DiscInfo]
+    titles: List[DiscTitle]
+    start_msg: Dict[str, Any]
+
+    @property
+    def unscanned_title(self) -> str:
+        """MakeMKV title argument used when the disc could not be scanned."""
+        return 'all' if title_selection == 'auto' else title_selection
+
+def rip_job_id(msg_id: str) -> str:
+    """Return the job id of the ``drive_events`` entry *msg_id*, stable across redeliveries."""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f'drive_events/{msg_id}'))
+
+def is_insert(data: Dict[str, Any]) -> bool:
+    """Return True if *data* is a ``drive.insert`` event naming its drive and device."""
+    return data.get('event') == 'insert' and 'drive_id' in data and 'device' in data
+
+def queued_message(job_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the ``rip.queued`` payload announcing the job of insert event *data*."""
+    return {"job_id": job_id, "drive_id": data['drive_id'], "device": data['device']}
+
+def start_rip(job_id: str, drive_id: str, device: str) -> Optional[RipJob]:
+    """Scan the disc and publish ``rip.start``.
+
+    Returns ``None`` when an earlier rip of the disc was reused or the job
+    was skipped as a duplicate, otherwise the job to rip.
+    """
+    output_dir = os.path.join(mkv_output_dir, job_id)
+    tracing.annotate(job_id=job_id)
+
+    info = scan_disc(device)
+    titles, decisions = plan_titles(info) if info is not None else ([], [])
+    if info is not None and not titles:
+        print(f"Title {title_selection} not found in scan of {device}, ripping unscanned")
+        info = None
+    start_msg = {
         "job_id": job_id,
         "drive_id": drive_id,
         "device": device,
         "output_dir": output_dir
-    })})
+    }
+    entry = None
+    if info is not None:
+        start_msg.update({
+            "fingerprint": fingerprint(info),
+            "label": info.label,
+            "titles": [t.index for t in titles],
+            "title_decisions": decisions,
+        })
+        if disc_dedup != 'off':
+            entry = disc_index.reusable(start_msg["fingerprint"], start_msg["titles"])
+        if entry is not None:
+            start_msg["reused_from"] = entry['job_id']
+
+    # Publish rip.start
+    publisher.publish('rip_events', 'start', start_msg)
     print(f"Published rip.start for job {job_id}")
 
-    # Run MakeMKV
-    cmd = ['makemkvcon', 'mkv', f'dev:{device}', title_selection, output_dir]
-    if subtitle_policy == 'discard':
-        cmd.append('--nosubtitles')
-    if audio_policy == 'discard':
-        cmd.append('--noaudio')
+    if entry is None:
+        return RipJob(job_id, device, output_dir, info, titles, start_msg)
+    if disc_dedup == 'skip':
+        publisher.publish('rip_events', 'duplicate', {
+            "job_id": job_id,
+            "fingerprint": start_msg["fingerprint"],
+            "previous_job_id": entry['job_id']
+        })
+        print(f"Skipping job {job_id}: disc already ripped by job {entry['job_id']}")
+        return None
+    publisher.publish('rip_events', 'complete', {
+        "job_id": job_id,
+        "output_files": entry['output_files'],
+        "reused_from": entry['job_id']
+    })
+    print(f"Published rip.complete for job {job_id} reusing job {entry['job_id']}")
+    return None
+
+def finish_rip(job: RipJob, output_files: Optional[List[str]]) -> None:
+    """Record the rip in the disc index and publish ``rip.complete``, or the failure."""
+    # makemkvcon exits with an error when a cancel terminates it
+    job_control.check(job.job_id)
+    if output_files is None:
+        print(f"MakeMKV failed for job {job.job_id}")
+        publisher.fail('rip_events', job.job_id, "MakeMKV failed")
+        return
+    metrics.count_bytes('rip', written=sum(metrics.file_size(f) for f in output_files))
+    if job.info is not None:
+        disc_index.record(job.start_msg["fingerprint"], job.job_id, job.info.label,
+                          job.start_msg["titles"], output_files)
+    publisher.publish('rip_events', 'complete', {
+        "job_id": job.job_id,
+        "output_files": output_files
+    })
+    print(f"Published rip.complete for job {job.job_id}")
+
+def remove_unpublished(output_dir: str, published: List[str]) -> None:
+    """Delete what a cancelled rip left in *output_dir*, except *published* files.
 
-    try:
-        with subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        ) as process:
-
-            # Parse progress from stderr
-            for line in iter(process.stderr.readline, ''):
-                if line.startswith('PRGV:'):
-                    parts = line.split(',')
-                    if len(parts) >= 3:
-                        current = int(parts[0].split(':')[1])
-                        total = int(parts[1])
-                        if total > 0:
-                            percentage = int((current / total) * 100)
-                            progress_msg = {
-                                "job_id": job_id,
-                                "percentage": percentage
-                            }
-                            r.xadd(
-                                'rip_events',
-                                {'event': 'progress', 'data': json.dumps(progress_msg)}
-                            )
-
-        if process.returncode == 0:
-            # Find output files
-            output_files = [
-                os.path.join(output_dir, f)
-                for f in os.listdir(output_dir)
-                if f.endswith('.mkv')
-            ]
-            r.xadd('rip_events', {'event': 'complete', 'data': json.dumps({
-                "job_id": job_id,
-                "output_files": output_files
-            })})
-            print(f"Published rip.complete for job {job_id}")
+    Titles already handed to enhance by ``rip.title_complete`` stay with
+    that stage.
+    """
+    if not published:
+        shutil.rmtree(output_dir, ignore_errors=True)
+        return
+    keep = set(published)
+    for name in os.listdir(output_dir):
+        path = os.path.join(output_dir, name)
+        if path in keep:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
         else:
-            print(f"MakeMKV failed for job {job_id}")
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+
+def process_drive_insert(job_id, drive_id, device):
+    """Process a drive insert event by ripping the disc using MakeMKV."""
+    with job_control.job(job_id):
+        # A rip cancelled while it waited for a slot stops before the scan
+        job_control.check(job_id)
+        job = start_rip(job_id, drive_id, device)
+        if job is None:
+            return
+        published = []
+        try:
+            # Ensure output dir exists
+            os.makedirs(job.output_dir, exist_ok=True)
+            if job.info is None:
+                # No scan: rip the selection in one run, as before
+                ok = run_makemkv(makemkv_cmd(device, job.unscanned_title, job.output_dir),
+                                 rip_progress(job_id, 0, 1, 1),
+                                 functools.partial(job_control.popen, job_id))
+                output_files = list_mkv(job.output_dir) if ok else None
+            else:
+                output_files = rip_titles(job_id, device, job.output_dir, job.titles,
+                                          published)
+            finish_rip(job, output_files)
+
+        except JobCancelled:
+            remove_unpublished(job.output_dir, published)
+            raise
+        except (subprocess.CalledProcessError, subprocess.SubprocessError, OSError) as e:
+            print(f"Error processing job {job_id}: {e}")
+            publisher.fail('rip_events', job_id, e)
+
+def process_drive_event(data):
+    """Rip the disc of a ``drive.insert`` event given its job id by :func:`main`."""
+    process_drive_insert(data['job_id'], data['drive_id'], data['device'])
+
+async def process_drive_event_async(data):
+    """Coroutine version of :func:`process_drive_event`."""
+    await process_drive_insert_async(data['job_id'], data['drive_id'], data['device'])
+
+async def process_drive_insert_async(job_id, drive_id, device):
+    """Coroutine version of :func:`process_drive_insert` for the asyncio runtime."""
+    with job_control.job(job_id):
+        job_control.check(job_id)
+        # The disc scan can take a minute
+        job = await aio.run_blocking(start_rip, job_id, drive_id, device)
+        if job is None:
+            return
+        published = []
+        try:
+            os.makedirs(job.output_dir, exist_ok=True)
+            if job.info is None:
+                ok = await run_makemkv_async(
+                    makemkv_cmd(device, job.unscanned_title, job.output_dir),
+                    rip_progress(job_id, 0, 1, 1),
+                    functools.partial(job_control.track, job_id)
+                )
+                output_files = list_mkv(job.output_dir) if ok else None
+            else:
+                output_files = await rip_titles_async(job_id, device, job.output_dir,
+                                                      job.titles, published)
+            await aio.run_blocking(finish_rip, job, output_files)
+
+        except JobCancelled:
+            remove_unpublished(job.output_dir, published)
+            raise
+        except OSError as e:
+            print(f"Error processing job {job_id}: {e}")
+            await publisher.fail_async('rip_events', job_id, e)
 
-    except (subprocess.CalledProcessError, subprocess.SubprocessError) as e:
-        print(f"Error processing job {job_id}: {e}")
+async def main_async():
+    """Asyncio event loop: every rip is a task, makemkvcon output is read without threads."""
+    client = aio.async_client(redis_url)
+    publisher.async_client = client
+    consumer = aio.AsyncStreamConsumer.from_env(client, 'drive_events', 'rip-worker')
+    async with aio.AsyncJobRunner.from_env('rip-worker', 'MAX_CONCURRENT_RIPS', 5,
+                                           client) as runner:
+        job_control.listen(runner)
+        metrics.start_from_env(r, [(consumer.stream, consumer.group)])
+        async for msg_id, data in consumer.messages():
+            if is_insert(data):
+                job_id = rip_job_id(msg_id)
+                await publisher.publish_async('rip_events', 'queued',
+                                              queued_message(job_id, data))
+                await runner.submit(
+                    consumer.acking(msg_id, tracer.traced_async('rip', process_drive_event_async)),
+                    {**data, 'job_id': job_id}, job_id=job_id,
+                    on_drop=functools.partial(consumer.ack, msg_id)
+                )
+            else:
+                await consumer.ack(msg_id)
 
 def main():
     """Main event loop: listen for drive events and process them."""
-    last_id = '0'
+    consumer = StreamConsumer.from_env(r, 'drive_events', 'rip-worker')
+    executor = JobExecutor.from_env('rip-worker', 'MAX_CONCURRENT_RIPS', 5, r)
+    job_control.listen(executor)
+    metrics.start_from_env(r, [(consumer.stream, consumer.group)])
     while True:
         try:
-            messages = r.xread({'drive_events': last_id}, block=1000)
-            for _, msgs in messages:
-                for msg_id, msg in msgs:
-                    last_id = msg_id
-                    data = json.loads(msg['data'])
-                    if data.get('event') == 'insert':
-                        threading.Thread(
-                            target=process_drive_insert,
-                            args=(data['drive_id'], data['device'])
-                        ).start()
-        except (redis.exceptions.ConnectionError, json.JSONDecodeError) as e:
+            for msg_id, data in consumer.messages():
+                if is_insert(data):
+                    # The job id is known (and cancellable) from the moment it is queued
+                    job_id = rip_job_id(msg_id)
+                    publisher.publish('rip_events', 'queued', queued_message(job_id, data))
+                    # Blocks while the queue is full, pausing stream reads
+                    executor.submit(
+                        consumer.acking(msg_id, tracer.traced('rip', process_drive_event)),
+                        {**data, 'job_id': job_id}, job_id=job_id,
+                        on_drop=functools.partial(consumer.ack, msg_id)
+                    )
+                else:
+                    # Other events and malformed inserts are not retried
+                    consumer.ack(msg_id)
+        except redis.exceptions.ConnectionError as e:
             print(f"Error reading stream: {e}")
             time.sleep(1)
 
 if __name__ == '__main__':
     print("Rip Worker started, waiting for drive events...")
-    main()
+    if aio.worker_runtime() == 'asyncio':
+        aio.run(main_async)
+    else:
+        main()
@@ -0,0 +1,129 @@
+"""Rule-based choice of the titles worth ripping from a scanned disc.
+
+Discs carry far more titles than content: trailers, menu loops, warnings,
+alternate playlists of the feature and "play all" titles that concatenate the
+episodes. Every byte ripped flows through the enhance and transcode stages,
+so :func:`select_titles` drops these before MakeMKV runs:
+
+1. titles playing the same segments as an earlier title,
+2. titles shorter than ``min_seconds``,
+3. titles matching a kept title's duration and size within a tolerance,
+4. on episode discs (``min_episodes`` titles of similar length) the titles
+   that span several episodes, on other discs everything but the longest
+   title, unless extras are kept.
+
+Every title gets a decision with the reason, recorded in ``rip.start``.
+"""
+
+import os
+import statistics
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+from disc_info import DiscTitle, duplicate_titles
+
+Decision = Dict[str, Any]
+
+
+class SelectionRules(NamedTuple):
+    """Thresholds of :func:`select_titles`."""
+
+    min_seconds: int = 600
+    dedup_seconds: int = 2
+    dedup_size_ratio: float = 0.01
+    episode_tolerance: float = 0.15
+    min_episodes: int = 3
+    keep_extras: bool = False
+
+    @classmethod
+    def from_env(cls) -> 'SelectionRules':
+        """Read the rules from ``TITLE_*`` env vars."""
+        return cls(
+            min_seconds=int(os.getenv('TITLE_MIN_SECONDS', '600')),
+            dedup_seconds=int(os.getenv('TITLE_DEDUP_SECONDS', '2')),
+            dedup_size_ratio=float(os.getenv('TITLE_DEDUP_SIZE_RATIO', '0.01')),
+            episode_tolerance=float(os.getenv('TITLE_EPISODE_TOLERANCE', '0.15')),
+            min_episodes=int(os.getenv('TITLE_MIN_EPISODES', '3')),
+            keep_extras=os.getenv('TITLE_KEEP_EXTRAS', 'false').lower() == 'true',
+        )
+
+
+def same_content(a: DiscTitle, b: DiscTitle, rules: SelectionRules) -> bool:
+    """Return True if *a* and *b* have the same duration and size within the rules."""
+    if abs(a.duration - b.duration) > rules.dedup_seconds:
+        return False
+    return abs(a.size - b.size) <= rules.dedup_size_ratio * max(a.size, b.size)
+
+
+def episode_cluster(titles: List[DiscTitle], rules: SelectionRules) -> List[DiscTitle]:
+    """Return the largest group of titles of similar length, if it looks like episodes."""
+    best: List[DiscTitle] = []
+    for anchor in titles:
+        group = [t for t in titles
+                 if abs(t.duration - anchor.duration) <= rules.episode_tolerance * anchor.duration]
+        if len(group) > len(best):
+            best = group
+    return best if len(best) >= rules.min_episodes else []
+
+
+def decide(titles: List[DiscTitle], selected: Dict[int, str],
+           reasons: Dict[int, str]) -> List[Decision]:
+    """Return one decision per title from the *selected* and rejection *reasons* maps."""
+    return [{
+        "title": title.index,
+        "duration": title.duration,
+        "size": title.size,
+        "chapters": title.chapters,
+        "selected": title.index in selected,
+        "reason": selected.get(title.index) or reasons.get(title.index, ''),
+    } for title in titles]
+
+
+def select_titles(titles: List[DiscTitle],
+                  rules: SelectionRules) -> Tuple[List[DiscTitle], List[Decision]]:
+    """Choose the titles to rip.
+
+    Returns:
+        The selected titles in disc order and one decision per title, with
+        ``selected`` and a human-readable ``reason``.
+    """
+    reasons: Dict[int, str] = {}
+    for index, original in duplicate_titles(titles).items():
+        reasons[index] = f"same segments as title {original}"
+
+    kept: List[DiscTitle] = []
+    for title in titles:
+        if title.index in reasons:
+            continue
+        if title.duration < rules.min_seconds:
+            reasons[title.index] = f"shorter than {rules.min_seconds}s"
+            continue
+        match = next((k for k in kept if same_content(title, k, rules)), None)
+        if match is not None:
+            reasons[title.index] = f"same duration and size as title {match.index}"
+            continue
+        kept.append(title)
+
+    selected: Dict[int, str] = {}
+    episodes = episode_cluster(kept, rules)
+    if episodes:
+        median = statistics.median(t.duration for t in episodes)
+        for title in kept:
+            if title in episodes:
+                selected[title.index] = "episode"
+            elif title.duration >= (2 - rules.episode_tolerance) * median:
+                reasons[title.index] = "spans several episodes"
+            elif rules.keep_extras:
+                selected[title.index] = "extra"
+            else:
+                reasons[title.index] = "not an episode"
+    elif kept:
+        main = max(kept, key=lambda t: (t.duration, t.size))
+        for title in kept:
+            if title is main:
+                selected[title.index] = "main feature"
+            elif rules.keep_extras:
+                selected[title.index] = "extra"
+            else:
+                reasons[title.index] = "shorter than the main feature"
+
+    return [t for t in titles if t.index in selected], decide(titles, selected, reasons)
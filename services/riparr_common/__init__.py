@@ -0,0 +1,5 @@
+"""Shared helpers for the Riparr Python workers.
+
+The package is copied next to each worker script inside its container, so
+modules here must only depend on the standard library and ``redis``.
+"""
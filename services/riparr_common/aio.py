@@ -0,0 +1,558 @@
+"""Asyncio runtime for the pipeline workers.
+
+In the default ``threads`` runtime every running job holds a thread that
+blocks on ``process.stderr.readline``, and all of them share one synchronous
+Redis client. With ``WORKER_RUNTIME=asyncio`` the rip and transcode workers
+run their stream loop, job queue and subprocesses on a single event loop:
+
+* :class:`AsyncStreamConsumer` reads the upstream stream through
+  ``redis.asyncio`` on a bounded connection pool (:func:`async_client`),
+* :class:`AsyncJobRunner` runs jobs as tasks with the limits and statistics
+  of :class:`~riparr_common.executor.JobExecutor`,
+* :func:`run_process` starts tools with ``asyncio.create_subprocess_exec`` and
+  parses their progress without blocking a thread.
+
+Cancellation is structured. Cancelling a job's task (:meth:`AsyncJobRunner.cancel`,
+or SIGTERM for the whole worker) terminates its subprocess before the task
+ends. Short blocking calls such as probes and single Redis round trips go to
+the default thread pool with ``asyncio.to_thread``. Calls that hold a thread
+for minutes (disc scans, quality searches, chunked transcodes) go through
+:func:`run_blocking` to a separate bounded pool, so they cannot starve the
+short ones.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import (Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional,
+                    Set, Tuple)
+
+import redis
+import redis.asyncio
+
+from riparr_common import metrics
+from riparr_common.executor import STATS_KEY
+from riparr_common.job_control import JobCancelled
+from riparr_common.streams import Message, StreamConsumer, decode_message
+
+logger = logging.getLogger(__name__)
+
+RUNTIMES = ('threads', 'asyncio')
+
+
+def worker_runtime() -> str:
+    """Return the runtime selected by ``WORKER_RUNTIME`` (``threads`` or ``asyncio``)."""
+    runtime = os.getenv('WORKER_RUNTIME', 'threads').lower()
+    if runtime not in RUNTIMES:
+        raise ValueError(f"Unknown WORKER_RUNTIME: {runtime}")
+    return runtime
+
+
+def async_client(url: str, max_connections: Optional[int] = None) -> 'redis.asyncio.Redis':
+    """Return an asyncio Redis client on a pool of ``REDIS_MAX_CONNECTIONS`` connections."""
+    pool = redis.asyncio.ConnectionPool.from_url(
+        url, decode_responses=True,
+        max_connections=max_connections or int(os.getenv('REDIS_MAX_CONNECTIONS', '16')),
+    )
+    return redis.asyncio.Redis(connection_pool=pool)
+
+
+_blocking_pool: Optional[ThreadPoolExecutor] = None
+_blocking_lock = threading.Lock()
+
+
+def blocking_executor() -> ThreadPoolExecutor:
+    """Return the pool of ``BLOCKING_THREADS`` threads (default 4) for long blocking calls."""
+    global _blocking_pool  # pylint: disable=global-statement
+    with _blocking_lock:
+        if _blocking_pool is None:
+            _blocking_pool = ThreadPoolExecutor(
+                max_workers=max(1, int(os.getenv('BLOCKING_THREADS', '4'))),
+                thread_name_prefix='blocking',
+            )
+        return _blocking_pool
+
+
+async def run_blocking(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run the long blocking call ``func(*args, **kwargs)`` on :func:`blocking_executor`.
+
+    Like ``asyncio.to_thread`` the call sees the caller's context variables
+    (e.g. the current trace span). Calls beyond the pool size wait for a
+    thread instead of taking one from the default pool.
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    return await loop.run_in_executor(blocking_executor(), call)
+
+
+def split_lines(buffer: bytes) -> Tuple[List[str], bytes]:
+    """Split *buffer* into complete lines and the unterminated rest.
+
+    ffmpeg ends its progress lines with ``\\r``, so both ``\\r`` and ``\\n``
+    end a line.
+    """
+    lines = buffer.replace(b'\r', b'\n').split(b'\n')
+    rest = lines.pop()
+    return [line.decode('utf-8', 'replace') for line in lines if line], rest
+
+
+async def terminate(process: asyncio.subprocess.Process, timeout: float = 10.0) -> None:
+    """Stop *process* with SIGTERM, then SIGKILL after *timeout* seconds."""
+    if process.returncode is not None:
+        return
+    with contextlib.suppress(ProcessLookupError):
+        process.terminate()
+    try:
+        await asyncio.wait_for(process.wait(), timeout)
+    except asyncio.TimeoutError:
+        with contextlib.suppress(ProcessLookupError):
+            process.kill()
+        await process.wait()
+
+
+async def run_process(cmd: List[str], on_line: Optional[Callable[[str], None]] = None,
+                      kill_timeout: float = 10.0,
+                      on_start: Optional[Callable[[Any], None]] = None) -> int:
+    """Run *cmd*, passing each stderr line to *on_line*; returns the exit code.
+
+    *on_start* receives the process once it is started, e.g.
+    :meth:`JobControl.track <riparr_common.job_control.JobControl.track>`.
+    Cancelling the awaiting task terminates the process before the
+    cancellation propagates.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        if on_start is not None:
+            on_start(process)
+        rest = b''
+        while True:
+            chunk = await process.stderr.read(65536)
+            if not chunk:
+                break
+            lines, rest = split_lines(rest + chunk)
+            if on_line is not None:
+                for line in lines:
+                    on_line(line)
+        if rest and on_line is not None:
+            on_line(rest.decode('utf-8', 'replace'))
+        return await process.wait()
+    finally:
+        if process.returncode is None:
+            logger.info("Terminating %s", cmd[0])
+            await asyncio.shield(terminate(process, kill_timeout))
+
+
+class AsyncStreamConsumer(StreamConsumer):
+    """:class:`~riparr_common.streams.StreamConsumer` on a ``redis.asyncio`` client.
+
+    Delivery, recovery and claiming work as in the threaded consumer; the
+    Redis calls are coroutines and the heartbeat is a task.
+    """
+
+    async def ensure_group(self) -> None:  # type: ignore[override]
+        """Create the consumer group (and the stream) if it does not exist."""
+        try:
+            await self.client.xgroup_create(self.stream, self.group, id=self.start_id,
+                                            mkstream=True)
+            logger.info("Created consumer group %s on %s", self.group, self.stream)
+        except redis.ResponseError as err:
+            if 'BUSYGROUP' not in str(err):
+                raise
+
+    async def _decode(self, entries: List[Tuple[str, Dict[str, str]]]) -> List[Message]:  # type: ignore[override]
+        """Decode entries, acknowledging any that cannot be parsed."""
+        messages: List[Message] = []
+        for msg_id, fields in entries:
+            try:
+                payload = decode_message(fields) if fields else None
+            except (KeyError, TypeError, json.JSONDecodeError) as err:
+                logger.error("Dropping malformed entry %s on %s: %s", msg_id, self.stream, err)
+                payload = None
+            if payload is None:
+                await self.client.xack(self.stream, self.group, msg_id)
+                continue
+            self._in_flight.add(msg_id)
+            messages.append((msg_id, payload))
+        return messages
+
+    async def read(self) -> List[Message]:  # type: ignore[override]
+        """Fetch the next batch: own pending first, then abandoned, then new."""
+        if self._pending_cursor == '0':
+            await self.ensure_group()
+        if self._pending_cursor is not None:
+            response = await self.client.xreadgroup(
+                self.group, self.consumer, {self.stream: self._pending_cursor}, count=self.count
+            )
+            entries = response[0][1] if response else []
+            self._pending_cursor = entries[-1][0] if entries else None
+            if entries:
+                logger.info("Recovered %d pending entries on %s", len(entries), self.stream)
+                return await self._decode(entries)
+        if time.monotonic() >= self._next_claim:
+            response = await self.client.xautoclaim(
+                self.stream, self.group, self.consumer,
+                min_idle_time=self.claim_idle_ms, start_id=self._claim_cursor, count=self.count
+            )
+            entries = self._advance_claim(response)
+            if entries:
+                logger.info("Claimed %d abandoned entries on %s", len(entries), self.stream)
+                return await self._decode(entries)
+        response = await self.client.xreadgroup(
+            self.group, self.consumer, {self.stream: '>'},
+            count=self.count, block=self.block_ms
+        )
+        return await self._decode(response[0][1] if response else [])
+
+    async def ack(self, msg_id: str) -> None:  # type: ignore[override]
+        """Acknowledge *msg_id* once the work it triggered has finished."""
+        try:
+            await self.client.xack(self.stream, self.group, msg_id)
+        finally:
+            self.release(msg_id)
+
+    async def touch(self) -> None:  # type: ignore[override]
+        """Reset the idle time of in-flight entries so they are not claimed."""
+        if self._in_flight:
+            await self.client.xclaim(
+                self.stream, self.group, self.consumer,
+                min_idle_time=0, message_ids=list(self._in_flight), justid=True
+            )
+
+    async def _beat(self) -> None:
+        """Call :meth:`touch` periodically."""
+        interval = max(self.claim_idle_ms / 3000.0, 1.0)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.touch()
+            except redis.RedisError as err:
+                logger.error("Heartbeat failed on %s: %s", self.stream, err)
+
+    def acking(self, msg_id: str,  # type: ignore[override]
+               func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        """Wrap the coroutine function *func* so that *msg_id* is acknowledged when it ends."""
+        async def _wrapped(*args: Any, **kwargs: Any) -> Any:
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                await self.ack(msg_id)
+        return _wrapped
+
+    async def messages(self) -> AsyncIterator[Message]:  # type: ignore[override]
+        """Yield messages forever, backing off on connection errors and recreating a lost group."""
+        heartbeat = asyncio.ensure_future(self._beat())
+        try:
+            while True:
+                try:
+                    batch = await self.read()
+                except (redis.ConnectionError, redis.TimeoutError) as err:
+                    logger.error("Error reading %s: %s", self.stream, err)
+                    await asyncio.sleep(1)
+                    continue
+                except redis.ResponseError as err:
+                    if not self._reset_group(err):
+                        raise
+                    continue
+                for message in batch:
+                    yield message
+        finally:
+            heartbeat.cancel()
+
+
+class AsyncJobRunner:
+    """Run submitted coroutine jobs as tasks, at most ``max_workers`` at a time.
+
+    The asyncio counterpart of :class:`~riparr_common.executor.JobExecutor`:
+    a bounded priority queue (``submit`` waits while it is full), the same
+    ``worker_stats`` figures, and the ``on_error`` hook (awaited if it is a
+    coroutine function, otherwise run in a thread).
+    Running and queued jobs can be cancelled by job id. Use it as
+    ``async with`` so that leaving the block cancels every job.
+
+    :meth:`release_slot`, :meth:`reclaim_slot` and :meth:`cancel_queued` may
+    be called from other threads, e.g. by
+    :class:`~riparr_common.job_control.JobControl`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_workers: int,
+        queue_size: int,
+        client: Optional['redis.asyncio.Redis'] = None,
+        stats_interval: float = 5.0,
+        on_error: Optional[Callable[[Optional[str], Exception], None]] = None,
+    ) -> None:
+        self.name = name
+        self.max_workers = max_workers
+        self.queue_size = queue_size
+        self.client = client
+        self.stats_interval = stats_interval
+        self.on_error = on_error
+        self._queue: Optional['asyncio.PriorityQueue[Any]'] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._seq = itertools.count()
+        self._tasks: List['asyncio.Task[None]'] = []
+        self._jobs: Dict[str, Set['asyncio.Task[Any]']] = {}
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._cancelled_count = 0
+        self._workers = 0
+        self._released = 0
+        self._waits: Deque[float] = deque(maxlen=100)
+
+    @classmethod
+    def from_env(
+        cls, name: str, limit_var: str, default_limit: int,
+        client: Optional['redis.asyncio.Redis'] = None,
+        on_error: Optional[Callable[[Optional[str], Exception], None]] = None,
+    ) -> 'AsyncJobRunner':
+        """Build a runner whose limit is read from *limit_var*."""
+        return cls(
+            name,
+            max_workers=max(1, int(os.getenv(limit_var, str(default_limit)))),
+            queue_size=max(1, int(os.getenv('JOB_QUEUE_SIZE', '10'))),
+            client=client,
+            stats_interval=float(os.getenv('WORKER_STATS_INTERVAL', '5')),
+            on_error=on_error,
+        )
+
+    async def __aenter__(self) -> 'AsyncJobRunner':
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.PriorityQueue(maxsize=self.queue_size)
+        metrics.REGISTRY.add_collector(f'executor:{self.name}', self._collect_metrics)
+        self._tasks = []
+        for _ in range(self.max_workers):
+            self._add_worker()
+        if self.client is not None:
+            self._tasks.append(asyncio.ensure_future(self._publish_loop()))
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def submit(
+        self,
+        func: Callable[..., Awaitable[Any]],
+        *args: Any,
+        priority: int = 0,
+        job_id: Optional[str] = None,
+        on_drop: Optional[Callable[[], Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Queue ``func(*args, **kwargs)``; waits while the queue is full.
+
+        *on_drop* (a function or coroutine function) is called instead of
+        *func* if the job is cancelled while queued.
+        """
+        item = (priority, next(self._seq), time.monotonic(), job_id, func, args, kwargs,
+                on_drop)
+        await self._queue.put(item)
+        logger.info("Queued job %s for %s (priority %s, depth %d)",
+                    job_id, self.name, priority, self._queue.qsize())
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel the running tasks of *job_id*, or else drop its queued jobs.
+
+        Returns:
+            True if a running task was cancelled or a queued job dropped.
+        """
+        tasks = self._jobs.get(job_id, set())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            return True
+        dropped = self._drop(job_id)
+        if dropped:
+            self._tasks.append(asyncio.ensure_future(self._run_drop_callbacks(dropped)))
+        return bool(dropped)
+
+    def _drop(self, job_id: str) -> List[Any]:
+        """Take the queued jobs of *job_id* out of the queue and return them."""
+        queue = self._queue
+        # The entries of asyncio.PriorityQueue live in its _queue heap
+        if not any(item[3] == job_id for item in queue._queue):  # pylint: disable=protected-access
+            return []
+        items = [queue.get_nowait() for _ in range(queue.qsize())]
+        dropped = [item for item in items if item[3] == job_id]
+        for item in items:
+            if item[3] != job_id:
+                queue.put_nowait(item)
+        for _ in items:
+            queue.task_done()
+        self._cancelled_count += len(dropped)
+        logger.info("Dropped cancelled job %s from %s", job_id, self.name)
+        return dropped
+
+    @staticmethod
+    async def _run_drop_callbacks(items: List[Any]) -> None:
+        """Call the ``on_drop`` callbacks of dropped queue *items*."""
+        for item in items:
+            on_drop = item[-1]
+            if on_drop is None:
+                continue
+            try:
+                result = on_drop()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as err:  # pylint: disable=broad-except
+                logger.error("Drop callback for job %s failed: %s", item[3], err)
+
+    def _add_worker(self) -> None:
+        """Start one more worker task."""
+        self._workers += 1
+        self._tasks.append(asyncio.ensure_future(self._work()))
+
+    def _retire(self) -> bool:
+        """Return True (and count it gone) if this worker exceeds the slot limit."""
+        if self._workers > self.max_workers + self._released:
+            self._workers -= 1
+            return True
+        return False
+
+    def _release(self) -> None:
+        self._released += 1
+        if self._workers < self.max_workers + self._released:
+            self._add_worker()
+
+    def _reclaim(self) -> None:
+        self._released = max(0, self._released - 1)
+
+    def release_slot(self) -> None:
+        """Let another job run in place of one that is paused."""
+        self._loop.call_soon_threadsafe(self._release)
+
+    def reclaim_slot(self) -> None:
+        """Take back a slot released by :meth:`release_slot`."""
+        self._loop.call_soon_threadsafe(self._reclaim)
+
+    def cancel_queued(self, job_id: str) -> bool:
+        """Drop the queued jobs of *job_id*; returns True if any was queued."""
+        async def _cancel() -> bool:
+            dropped = self._drop(job_id)
+            await self._run_drop_callbacks(dropped)
+            return bool(dropped)
+        return asyncio.run_coroutine_threadsafe(_cancel(), self._loop).result()
+
+    async def _work(self) -> None:
+        """Worker task body: run queued jobs until the worker is retired."""
+        while not self._retire():
+            item = await self._queue.get()
+            if self._retire():
+                # Over the limit after a resume: leave the job to another worker
+                self._queue.task_done()
+                await self._queue.put(item)
+                return
+            _priority, _seq, queued_at, job_id, func, args, kwargs, _on_drop = item
+            self._running += 1
+            started = time.monotonic()
+            self._waits.append(started - queued_at)
+            metrics.JOB_WAIT.observe(started - queued_at, worker=self.name)
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            if job_id is not None:
+                self._jobs.setdefault(job_id, set()).add(task)
+            try:
+                # wait() does not raise when only the job was cancelled
+                await asyncio.wait({task})
+            except asyncio.CancelledError:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                raise
+            finally:
+                self._running -= 1
+                if job_id is not None:
+                    self._jobs[job_id].discard(task)
+                    if not self._jobs[job_id]:
+                        del self._jobs[job_id]
+                self._queue.task_done()
+            await self._finished(job_id, task, time.monotonic() - started)
+
+    async def _finished(self, job_id: Optional[str], task: 'asyncio.Task[Any]',
+                        seconds: float) -> None:
+        """Count the outcome of a job that ran *seconds* and report its failure."""
+        if task.cancelled() or isinstance(task.exception(), JobCancelled):
+            self._cancelled_count += 1
+            metrics.JOB_DURATION.observe(seconds, worker=self.name, outcome='cancelled')
+            logger.info("Job %s cancelled in %s", job_id, self.name)
+            return
+        err = task.exception()
+        if err is None:
+            self._completed += 1
+            metrics.JOB_DURATION.observe(seconds, worker=self.name, outcome='completed')
+            return
+        metrics.JOB_DURATION.observe(seconds, worker=self.name, outcome='failed')
+        logger.error("Job %s failed in %s: %s", job_id, self.name, err)
+        self._failed += 1
+        if self.on_error is not None and job_id is not None:
+            try:
+                if inspect.iscoroutinefunction(self.on_error):
+                    await self.on_error(job_id, err)
+                else:
+                    await asyncio.to_thread(self.on_error, job_id, err)
+            except Exception as hook_err:  # pylint: disable=broad-except
+                logger.error("Failure hook for job %s failed: %s", job_id, hook_err)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return a snapshot of queue depth, running jobs and wait times."""
+        waits = list(self._waits)
+        return {
+            "max_workers": self.max_workers,
+            "running": self._running,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "completed": self._completed,
+            "failed": self._failed,
+            "cancelled": self._cancelled_count,
+            "paused": self._released,
+            "avg_wait_s": round(sum(waits) / len(waits), 3) if waits else 0.0,
+            "max_wait_s": round(max(waits), 3) if waits else 0.0,
+            "timestamp": time.time(),
+        }
+
+    def _collect_metrics(self) -> None:
+        """Set the running and queued job gauges."""
+        metrics.JOBS_RUNNING.set(self._running, worker=self.name)
+        metrics.JOBS_QUEUED.set(self._queue.qsize(), worker=self.name)
+
+    async def _publish_loop(self) -> None:
+        """Periodically write :meth:`stats` to the ``worker_stats`` hash."""
+        while True:
+            try:
+                await self.client.hset(STATS_KEY, self.name, json.dumps(self.stats()))
+            except redis.RedisError as err:
+                logger.error("Could not publish stats for %s: %s", self.name, err)
+            await asyncio.sleep(self.stats_interval)
+
+
+def run(main: Callable[[], Awaitable[None]]) -> None:
+    """Run the coroutine function *main* until it returns or SIGTERM/SIGINT arrive.
+
+    A signal cancels *main*, which cancels every job and terminates their
+    subprocesses before the process exits.
+    """
+    async def _supervise() -> None:
+        task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, task.cancel)
+        await main()
+
+    try:
+        asyncio.run(_supervise())
+    except asyncio.CancelledError:
+        logger.info("Worker stopped")
@@ -0,0 +1,223 @@
+"""Per-file output checkpoints that make stage restarts cheap.
+
+The enhance and transcode stages loop over a job's files, and one Real-ESRGAN
+pass can take hours. A worker that crashed halfway through a job used to redo
+every file when the event was redelivered. :class:`CheckpointStore` records
+each finished output under a key built from the job id, the path and a
+fingerprint of the input file and a digest of the stage settings that shape
+the output. A restarted stage skips files whose output is still on disk
+unchanged, and any change to the input or settings produces a new key.
+
+Outputs are written to a ``.partial.<name>`` file next to the final path and
+renamed over it only once complete, so a final path is never half written.
+:func:`remove_partials` deletes partial files and scratch directories left
+behind by a crash when a worker starts.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import redis
+
+from riparr_common import metrics
+
+logger = logging.getLogger(__name__)
+
+PARTIAL_PREFIX = '.partial.'
+# Scratch directories of the frame pipeline and the chunked transcoder
+SCRATCH_PREFIXES = ('.frames_', '.chunks_')
+# Bytes hashed from each end of an input file
+SAMPLE_BYTES = 1 << 20
+
+
+def settings_digest(settings: Dict[str, Any]) -> str:
+    """Return a stable digest of the stage settings that shape an output."""
+    encoded = json.dumps(settings, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+
+def input_fingerprint(file_path: str, sample_bytes: int = SAMPLE_BYTES) -> str:
+    """Return a content fingerprint of *file_path* from its size and both ends.
+
+    Reading two samples keeps this cheap for 50 GB rips while still telling
+    apart a re-rip that was written to the same path.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as handle:
+        size = os.fstat(handle.fileno()).st_size
+        digest.update(str(size).encode('ascii'))
+        digest.update(handle.read(sample_bytes))
+        if size > sample_bytes:
+            handle.seek(max(size - sample_bytes, sample_bytes))
+            digest.update(handle.read(sample_bytes))
+    return digest.hexdigest()
+
+
+def partial_path(output_file: str) -> str:
+    """Return the temporary path *output_file* is written to.
+
+    The extension is kept so that ffmpeg still picks the right muxer.
+    """
+    directory, name = os.path.split(output_file)
+    return os.path.join(directory, PARTIAL_PREFIX + name)
+
+
+def is_partial(name: str) -> bool:
+    """Return True for the name of a partial output or scratch directory."""
+    return name.startswith(PARTIAL_PREFIX) or name.startswith(SCRATCH_PREFIXES)
+
+
+def remove_partials(root: str, min_age: float = 600, now: Optional[float] = None) -> List[str]:
+    """Delete partial outputs and scratch directories below *root*.
+
+    Entries modified within *min_age* seconds are kept, since another
+    replica sharing the volume may still be writing them.
+
+    Returns:
+        The removed paths.
+    """
+    now = time.time() if now is None else now
+    removed = []
+    for directory, dirs, files in os.walk(root):
+        for name in list(dirs):
+            if is_partial(name):
+                dirs.remove(name)
+                path = os.path.join(directory, name)
+                if _older_than(path, now - min_age):
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed.append(path)
+        for name in files:
+            path = os.path.join(directory, name)
+            if name.startswith(PARTIAL_PREFIX) and _older_than(path, now - min_age):
+                try:
+                    os.remove(path)
+                    removed.append(path)
+                except OSError as err:
+                    logger.error("Could not remove partial file %s: %s", path, err)
+    for path in removed:
+        logger.info("Removed partial output %s", path)
+    return removed
+
+
+def _older_than(path: str, cutoff: float) -> bool:
+    """Return True if *path* was last modified before *cutoff*."""
+    try:
+        return os.stat(path).st_mtime < cutoff
+    except OSError:
+        return False
+
+
+class CheckpointStore:
+    """Finished outputs of one stage under ``checkpoint:<stage>:<digest>`` keys.
+
+    Args:
+        client: Redis client created with ``decode_responses=True``.
+        stage: Pipeline stage the outputs belong to.
+        ttl: Seconds a checkpoint is kept.
+    """
+
+    PREFIX = 'checkpoint:'
+
+    def __init__(self, client: redis.Redis, stage: str, ttl: int = 7 * 24 * 3600) -> None:
+        self.client = client
+        self.stage = stage
+        self.ttl = ttl
+
+    @classmethod
+    def from_env(cls, client: redis.Redis, stage: str) -> 'CheckpointStore':
+        """Build a store with the TTL from ``CHECKPOINT_TTL``."""
+        return cls(client, stage, ttl=int(os.getenv('CHECKPOINT_TTL', str(7 * 24 * 3600))))
+
+    def _key(self, job_id: str, input_file: str, settings: Dict[str, Any]) -> str:
+        """Checkpoint key for *input_file* of *job_id* under *settings*."""
+        identity = (f"{job_id}|{os.path.abspath(input_file)}|{input_fingerprint(input_file)}"
+                    f"|{settings_digest(settings)}")
+        return f"{self.PREFIX}{self.stage}:{hashlib.sha1(identity.encode('utf-8')).hexdigest()}"
+
+    @staticmethod
+    def _identity(output_file: str) -> Tuple[int, int]:
+        """Return the size and mtime recorded for *output_file*."""
+        st = os.stat(output_file)
+        return st.st_size, st.st_mtime_ns
+
+    def lookup(self, job_id: str, input_file: str, settings: Dict[str, Any]) -> Optional[str]:
+        """Return the checkpointed output if it is still on disk unchanged, else ``None``."""
+        try:
+            value = self.client.get(self._key(job_id, input_file, settings))
+            if not value:
+                return None
+            entry = json.loads(value)
+            if self._identity(entry['output']) != (entry['size'], entry['mtime_ns']):
+                return None
+        except (OSError, KeyError, json.JSONDecodeError, redis.RedisError) as err:
+            logger.debug("No usable checkpoint for %s: %s", input_file, err)
+            return None
+        return entry['output']
+
+    def save(self, job_id: str, input_file: str, settings: Dict[str, Any],
+             output_file: str) -> None:
+        """Record *output_file* as the finished output for *input_file*."""
+        try:
+            size, mtime_ns = self._identity(output_file)
+            self.client.set(self._key(job_id, input_file, settings), json.dumps({
+                'output': output_file, 'size': size, 'mtime_ns': mtime_ns,
+            }), ex=self.ttl)
+        except (OSError, redis.RedisError) as err:
+            logger.error("Could not checkpoint %s: %s", output_file, err)
+
+    def _count_bytes(self, input_file: str, output_file: str) -> None:
+        """Record the media bytes a produced output read and wrote."""
+        metrics.count_bytes(self.stage, read=metrics.file_size(input_file),
+                            written=metrics.file_size(output_file))
+
+    def produce(self, job_id: str, input_file: str, output_file: str,
+                settings: Dict[str, Any], func: Callable[[str], bool]) -> bool:
+        """Produce *output_file* with ``func(temp_path)`` unless a checkpoint has it.
+
+        *func* writes to a partial path which is renamed to *output_file*
+        only when it returns True.
+
+        Returns:
+            True if *output_file* holds a finished output.
+        """
+        if self.lookup(job_id, input_file, settings) == output_file:
+            logger.info("Checkpoint hit, skipping %s stage for %s", self.stage, input_file)
+            return True
+        temp_file = partial_path(output_file)
+        try:
+            ok = func(temp_file) and os.path.isfile(temp_file)
+            if ok:
+                os.replace(temp_file, output_file)
+        finally:
+            if os.path.lexists(temp_file):
+                os.remove(temp_file)
+        if ok:
+            self._count_bytes(input_file, output_file)
+            self.save(job_id, input_file, settings, output_file)
+        return ok
+
+    async def produce_async(self, job_id: str, input_file: str, output_file: str,
+                            settings: Dict[str, Any],
+                            func: Callable[[str], Awaitable[bool]]) -> bool:
+        """Coroutine version of :meth:`produce` for the asyncio runtime."""
+        if await asyncio.to_thread(self.lookup, job_id, input_file, settings) == output_file:
+            logger.info("Checkpoint hit, skipping %s stage for %s", self.stage, input_file)
+            return True
+        temp_file = partial_path(output_file)
+        try:
+            ok = await func(temp_file) and os.path.isfile(temp_file)
+            if ok:
+                os.replace(temp_file, output_file)
+        finally:
+            if os.path.lexists(temp_file):
+                os.remove(temp_file)
+        if ok:
+            self._count_bytes(input_file, output_file)
+            await asyncio.to_thread(self.save, job_id, input_file, settings, output_file)
+        return ok
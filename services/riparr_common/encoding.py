@@ -0,0 +1,81 @@
+"""FFmpeg encoder arguments shared by the transcode and enhance workers.
+
+The Transcode Worker encodes files it reads from disk, while the Enhance
+Worker's fused pipeline encodes upscaled frames straight from a pipe; both
+must produce identical output for the same ``TRANSCODE_PROFILE``.
+"""
+
+from typing import Any, Dict, List, Optional
+
+# Profile mappings
+PROFILE_SETTINGS = {
+    'high': {'global_quality': 28, 'qp': 22},
+    'medium': {'global_quality': 25, 'qp': 20},
+    'low': {'global_quality': 22, 'qp': 18}
+}
+
+VAAPI_DEVICE = '/dev/dri/renderD128'
+
+
+def profile_settings(profile: str) -> Dict[str, int]:
+    """Return quality settings for *profile*, defaulting to ``high``."""
+    return PROFILE_SETTINGS.get(profile, PROFILE_SETTINGS['high'])
+
+
+def video_encoder_args(
+    profile: str, cpu_fallback: bool, vaapi_profile: str = 'hevc_vaapi', upload: bool = False,
+    quality: Optional[int] = None
+) -> List[str]:
+    """Return the video encoder arguments for *profile*.
+
+    Args:
+        profile: ``TRANSCODE_PROFILE`` name.
+        cpu_fallback: Use ``libx265`` instead of VAAPI.
+        vaapi_profile: VAAPI encoder name.
+        upload: Frames come from software (e.g. a pipe) and must be uploaded
+            to the GPU before VAAPI encoding.
+        quality: Replaces the profile's ``global_quality`` (the CRF on the
+            CPU); ``qp`` moves by the same amount.
+    """
+    settings = profile_settings(profile)
+    if quality is not None:
+        settings = {'global_quality': quality,
+                    'qp': settings['qp'] + quality - settings['global_quality']}
+    if cpu_fallback:
+        return ['-c:v', 'libx265', '-crf', str(settings['global_quality'])]  # Approximate CRF
+    args = []
+    if upload:
+        args.extend(['-vf', 'format=nv12,hwupload'])
+    args.extend([
+        '-c:v', vaapi_profile, '-global_quality', str(settings['global_quality']),
+        '-qp', str(settings['qp'])
+    ])
+    return args
+
+
+def audio_encoder_args(
+    audio_streams: List[Dict[str, Any]], audio_format: str = 'aac', input_index: int = 0
+) -> List[str]:
+    """Return audio encoder arguments (EAC3 surround, AAC/Opus stereo).
+
+    *input_index* is the ffmpeg input the audio streams are read from.
+    """
+    cmd = []
+    audio_filters = []
+    for i, stream in enumerate(audio_streams):
+        channels = stream.get('channels', 2)
+        if channels > 2:
+            # Surround: EAC3
+            cmd.extend([f'-c:a:{i}', 'eac3'])
+            if channels > 6:
+                audio_filters.append(
+                    f'[{input_index}:a:{i}]pan=5.1|c0=c0|c1=c1|c2=c2|c3=c3|c4=c4|c5=c5[a{i}]'
+                )
+        else:
+            # Stereo: AAC or OPUS
+            codec = 'libopus' if audio_format == 'opus' else 'aac'
+            cmd.extend([f'-c:a:{i}', codec])
+
+    if audio_filters:
+        cmd.extend(['-filter_complex', ','.join(audio_filters)])
+    return cmd
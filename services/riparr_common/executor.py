@@ -0,0 +1,266 @@
+"""Bounded, priority-aware job executor for the pipeline workers.
+
+Workers used to start one ``threading.Thread`` per incoming event, so a burst
+of disc inserts launched an unbounded number of makemkvcon / ffmpeg /
+Real-ESRGAN processes at once. :class:`JobExecutor` runs at most
+``max_workers`` jobs concurrently and holds the rest in a bounded priority
+queue. When the queue is full :meth:`JobExecutor.submit` blocks, which stops
+the caller from reading further stream entries (back-pressure); unread
+entries simply stay in Redis.
+
+Queue depth and wait times are written to the ``worker_stats`` Redis hash so
+the orchestrator can report them, and job run and wait times are recorded in
+:mod:`riparr_common.metrics`.
+
+A job paused through :class:`~riparr_common.job_control.JobControl` releases
+its slot: :meth:`JobExecutor.release_slot` starts an extra thread for the
+queue, which retires again once the job is resumed or ends. A job cancelled
+while queued is taken out of the queue and its ``on_drop`` callback runs in
+place of the job, e.g. to acknowledge its stream entry.
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional
+
+import redis
+
+from riparr_common import metrics
+from riparr_common.job_control import JobCancelled
+
+logger = logging.getLogger(__name__)
+
+STATS_KEY = 'worker_stats'
+
+
+def size_priority(files: Iterable[str]) -> int:
+    """Return a priority for a job from the total size of its input *files*.
+
+    Lower values run first, so short episodes are scheduled ahead of feature
+    films. Missing files count as zero bytes.
+    """
+    total = 0
+    for path in files:
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            continue
+    return total
+
+
+def run_drop_callbacks(items: List[Any]) -> None:
+    """Call the ``on_drop`` callbacks of dropped queue *items*."""
+    for item in items:
+        on_drop = item[-1]
+        if on_drop is None:
+            continue
+        try:
+            on_drop()
+        except Exception as err:  # pylint: disable=broad-except
+            logger.error("Drop callback for job %s failed: %s", item[3], err)
+
+
+class JobExecutor:
+    """Run submitted jobs on a fixed pool of threads, lowest priority first.
+
+    Args:
+        name: Service name used as the field in the ``worker_stats`` hash.
+        max_workers: Maximum number of jobs running at the same time.
+        queue_size: Maximum number of queued (not yet running) jobs.
+        client: Redis client used to publish statistics; ``None`` disables it.
+        stats_interval: Seconds between statistics publications.
+        on_error: Called with the job id and exception of a job that raised.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_workers: int,
+        queue_size: int,
+        client: Optional[redis.Redis] = None,
+        stats_interval: float = 5.0,
+        on_error: Optional[Callable[[Optional[str], Exception], None]] = None,
+    ) -> None:
+        self.name = name
+        self.on_error = on_error
+        self.max_workers = max_workers
+        self.client = client
+        self.stats_interval = stats_interval
+        self._queue: 'queue.PriorityQueue[Any]' = queue.PriorityQueue(maxsize=queue_size)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._cancelled = 0
+        self._released = 0
+        self._threads = 0
+        self._thread_ids = itertools.count()
+        self._waits: Deque[float] = deque(maxlen=100)
+        for _ in range(max_workers):
+            self._start_thread()
+        metrics.REGISTRY.add_collector(f'executor:{name}', self._collect_metrics)
+        if client is not None:
+            threading.Thread(target=self._publish_loop, daemon=True).start()
+
+    @classmethod
+    def from_env(
+        cls, name: str, limit_var: str, default_limit: int, client: Optional[redis.Redis] = None,
+        on_error: Optional[Callable[[Optional[str], Exception], None]] = None,
+    ) -> 'JobExecutor':
+        """Build an executor whose limit is read from *limit_var*."""
+        return cls(
+            name,
+            max_workers=max(1, int(os.getenv(limit_var, str(default_limit)))),
+            queue_size=max(1, int(os.getenv('JOB_QUEUE_SIZE', '10'))),
+            client=client,
+            stats_interval=float(os.getenv('WORKER_STATS_INTERVAL', '5')),
+            on_error=on_error,
+        )
+
+    def submit(
+        self,
+        func: Callable[..., Any],
+        *args: Any,
+        priority: int = 0,
+        job_id: Optional[str] = None,
+        on_drop: Optional[Callable[[], Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Queue ``func(*args, **kwargs)``; blocks while the queue is full.
+
+        Jobs with equal *priority* run in submission order. *on_drop* is
+        called instead of *func* if the job is cancelled while queued.
+        """
+        item = (priority, next(self._seq), time.monotonic(), job_id, func, args, kwargs,
+                on_drop)
+        self._queue.put(item)
+        logger.info("Queued job %s for %s (priority %s, depth %d)",
+                    job_id, self.name, priority, self._queue.qsize())
+
+    def _start_thread(self) -> None:
+        """Start one more job thread."""
+        with self._lock:
+            self._threads += 1
+        threading.Thread(target=self._work, name=f'{self.name}-job-{next(self._thread_ids)}',
+                         daemon=True).start()
+
+    def _retire(self) -> bool:
+        """Return True (and count it gone) if this thread exceeds the slot limit."""
+        with self._lock:
+            if self._threads > self.max_workers + self._released:
+                self._threads -= 1
+                return True
+            return False
+
+    def release_slot(self) -> None:
+        """Let another job run in place of one that is paused."""
+        with self._lock:
+            self._released += 1
+            spawn = self._threads < self.max_workers + self._released
+        if spawn:
+            self._start_thread()
+
+    def reclaim_slot(self) -> None:
+        """Take back a slot released by :meth:`release_slot`."""
+        with self._lock:
+            self._released = max(0, self._released - 1)
+
+    def cancel_queued(self, job_id: str) -> bool:
+        """Drop the queued jobs of *job_id*; returns True if any was queued."""
+        with self._queue.mutex:
+            heap = self._queue.queue
+            dropped = [item for item in heap if item[3] == job_id]
+            if dropped:
+                heap[:] = [item for item in heap if item[3] != job_id]
+                heapq.heapify(heap)
+                self._queue.unfinished_tasks -= len(dropped)
+                if not self._queue.unfinished_tasks:
+                    self._queue.all_tasks_done.notify_all()
+                self._queue.not_full.notify(len(dropped))
+        if dropped:
+            with self._lock:
+                self._cancelled += len(dropped)
+            logger.info("Dropped cancelled job %s from %s", job_id, self.name)
+            run_drop_callbacks(dropped)
+        return bool(dropped)
+
+    def _work(self) -> None:
+        """Worker thread body: run queued jobs until the thread is retired."""
+        while not self._retire():
+            item = self._queue.get()
+            if self._retire():
+                # Over the limit after a resume: leave the job to another thread
+                self._queue.task_done()
+                self._queue.put(item)
+                return
+            _priority, _seq, queued_at, job_id, func, args, kwargs, _on_drop = item
+            with self._lock:
+                self._running += 1
+                self._waits.append(time.monotonic() - queued_at)
+            started = time.monotonic()
+            metrics.JOB_WAIT.observe(started - queued_at, worker=self.name)
+            outcome = 'completed'
+            try:
+                func(*args, **kwargs)
+                with self._lock:
+                    self._completed += 1
+            except JobCancelled:
+                logger.info("Job %s cancelled in %s", job_id, self.name)
+                outcome = 'cancelled'
+                with self._lock:
+                    self._cancelled += 1
+            except Exception as err:  # pylint: disable=broad-except
+                logger.error("Job %s failed in %s: %s", job_id, self.name, err)
+                outcome = 'failed'
+                with self._lock:
+                    self._failed += 1
+                if self.on_error is not None and job_id is not None:
+                    try:
+                        self.on_error(job_id, err)
+                    except Exception as hook_err:  # pylint: disable=broad-except
+                        logger.error("Failure hook for job %s failed: %s", job_id, hook_err)
+            finally:
+                metrics.JOB_DURATION.observe(time.monotonic() - started, worker=self.name,
+                                             outcome=outcome)
+                with self._lock:
+                    self._running -= 1
+                self._queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return a snapshot of queue depth, running jobs and wait times."""
+        with self._lock:
+            waits = list(self._waits)
+            return {
+                "max_workers": self.max_workers,
+                "running": self._running,
+                "queued": self._queue.qsize(),
+                "completed": self._completed,
+                "failed": self._failed,
+                "cancelled": self._cancelled,
+                "paused": self._released,
+                "avg_wait_s": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                "max_wait_s": round(max(waits), 3) if waits else 0.0,
+                "timestamp": time.time(),
+            }
+
+    def _collect_metrics(self) -> None:
+        """Set the running and queued job gauges."""
+        metrics.JOBS_RUNNING.set(self._running, worker=self.name)
+        metrics.JOBS_QUEUED.set(self._queue.qsize(), worker=self.name)
+
+    def _publish_loop(self) -> None:
+        """Periodically write :meth:`stats` to the ``worker_stats`` hash."""
+        while True:
+            try:
+                self.client.hset(STATS_KEY, self.name, json.dumps(self.stats()))
+            except redis.RedisError as err:
+                logger.error("Could not publish stats for %s: %s", self.name, err)
+            time.sleep(self.stats_interval)
@@ -0,0 +1,295 @@
+"""GPU device leases shared by the enhance and transcode workers.
+
+Real-ESRGAN (Vulkan ``-g <index>``) and VAAPI encodes (``/dev/dri/renderD*``)
+used to share one hard-coded device without knowing about each other.
+:class:`GpuScheduler` hands out leases on the devices listed in
+``GPU_DEVICES``, weighted by the VRAM a job is expected to use (the
+``vram<N>`` hint of the ESRGAN profile for upscales, ``TRANSCODE_VRAM_GB``
+for encodes). A device accepts leases while their total weight fits its
+VRAM; an idle device always accepts one lease so oversized profiles cannot
+starve. Callers that get no lease before their deadline run the CPU path.
+
+Leases expire unless renewed, so a crashed worker cannot hold a device
+forever. :class:`RedisLeaseStore` shares them between containers;
+:class:`MemoryLeaseStore` is a single-process stand-in for tests and local
+runs. The asyncio runtime waits with :meth:`GpuScheduler.lease_async`, which
+polls with ``asyncio.sleep`` instead of holding a thread.
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import AsyncIterator, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import redis
+
+from riparr_common.encoding import VAAPI_DEVICE
+
+logger = logging.getLogger(__name__)
+
+
+class GpuDevice(NamedTuple):
+    """A schedulable device: Vulkan index, VAAPI render node and VRAM in GB."""
+
+    index: int
+    render_node: str
+    vram_gb: float
+
+    @property
+    def key(self) -> str:
+        """Identifier used for the device's lease set."""
+        return f"gpu{self.index}"
+
+
+def parse_devices(spec: str) -> List[GpuDevice]:
+    """Parse ``GPU_DEVICES`` (``index:render_node:vram_gb``, comma separated)."""
+    devices = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        index, render_node, vram_gb = item.split(':')
+        devices.append(GpuDevice(int(index), render_node, float(vram_gb)))
+    return devices
+
+
+class MemoryLeaseStore:
+    """In-process lease store with the same interface as :class:`RedisLeaseStore`."""
+
+    def __init__(self) -> None:
+        self._leases: Dict[str, Dict[str, Tuple[float, float]]] = {}
+        self._lock = threading.Lock()
+
+    def _live(self, device: str, now: float) -> Dict[str, Tuple[float, float]]:
+        """Drop expired leases of *device* and return the rest."""
+        leases = self._leases.setdefault(device, {})
+        for lease_id in [i for i, (_w, expires) in leases.items() if expires < now]:
+            del leases[lease_id]
+        return leases
+
+    def try_acquire(self, device: str, lease_id: str, weight: float, capacity: float,
+                    ttl: float) -> bool:
+        """Add a lease if *weight* still fits on *device*."""
+        now = time.time()
+        with self._lock:
+            leases = self._live(device, now)
+            used = sum(w for w, _expires in leases.values())
+            if used > 0 and used + weight > capacity:
+                return False
+            leases[lease_id] = (weight, now + ttl)
+            return True
+
+    def renew(self, device: str, lease_id: str, ttl: float) -> bool:
+        """Extend a lease; returns False if it already expired."""
+        now = time.time()
+        with self._lock:
+            leases = self._live(device, now)
+            if lease_id not in leases:
+                return False
+            leases[lease_id] = (leases[lease_id][0], now + ttl)
+            return True
+
+    def release(self, device: str, lease_id: str) -> None:
+        """Remove a lease."""
+        with self._lock:
+            self._leases.get(device, {}).pop(lease_id, None)
+
+    def usage(self, device: str) -> float:
+        """Return the summed weight of live leases on *device*."""
+        with self._lock:
+            return sum(w for w, _expires in self._live(device, time.time()).values())
+
+
+# Leases live in a hash per device: lease id -> "weight:expires"
+_ACQUIRE = """
+local used = 0
+local leases = redis.call('HGETALL', KEYS[1])
+local now = tonumber(ARGV[4])
+for i = 1, #leases, 2 do
+    local weight, expires = string.match(leases[i + 1], '([^:]+):([^:]+)')
+    if tonumber(expires) < now then
+        redis.call('HDEL', KEYS[1], leases[i])
+    else
+        used = used + tonumber(weight)
+    end
+end
+local weight = tonumber(ARGV[2])
+if used > 0 and used + weight > tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2] .. ':' .. tostring(now + tonumber(ARGV[5])))
+return 1
+"""
+
+_RENEW = """
+local lease = redis.call('HGET', KEYS[1], ARGV[1])
+if not lease then
+    return 0
+end
+local weight, expires = string.match(lease, '([^:]+):([^:]+)')
+if tonumber(expires) < tonumber(ARGV[2]) then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], weight .. ':' .. tostring(tonumber(ARGV[2]) + tonumber(ARGV[3])))
+return 1
+"""
+
+
+class RedisLeaseStore:
+    """Leases in ``gpu_leases:<device>`` hashes, updated atomically by Lua scripts.
+
+    Args:
+        client: Redis client created with ``decode_responses=True``.
+    """
+
+    PREFIX = 'gpu_leases:'
+
+    def __init__(self, client: redis.Redis) -> None:
+        self.client = client
+        self._acquire = client.register_script(_ACQUIRE)
+        self._renew = client.register_script(_RENEW)
+
+    def try_acquire(self, device: str, lease_id: str, weight: float, capacity: float,
+                    ttl: float) -> bool:
+        """Add a lease if *weight* still fits on *device*."""
+        args = [lease_id, weight, capacity, time.time(), ttl]
+        return bool(self._acquire(keys=[self.PREFIX + device], args=args))
+
+    def renew(self, device: str, lease_id: str, ttl: float) -> bool:
+        """Extend a lease; returns False if it already expired."""
+        return bool(self._renew(keys=[self.PREFIX + device], args=[lease_id, time.time(), ttl]))
+
+    def release(self, device: str, lease_id: str) -> None:
+        """Remove a lease."""
+        self.client.hdel(self.PREFIX + device, lease_id)
+
+    def usage(self, device: str) -> float:
+        """Return the summed weight of live leases on *device*."""
+        now = time.time()
+        used = 0.0
+        for lease in self.client.hvals(self.PREFIX + device):
+            weight, _, expires = lease.partition(':')
+            if float(expires) >= now:
+                used += float(weight)
+        return used
+
+
+class Lease(NamedTuple):
+    """A granted lease on *device*."""
+
+    device: GpuDevice
+    lease_id: str
+    weight: float
+
+
+class GpuScheduler:
+    """Hand out weighted device leases, waiting up to a deadline.
+
+    Args:
+        store: :class:`RedisLeaseStore` or :class:`MemoryLeaseStore`.
+        devices: Devices to schedule on; none means every caller gets the CPU.
+        lease_ttl: Seconds a lease lives without renewal.
+        poll_interval: Seconds between attempts while waiting for capacity.
+        wait_seconds: Default deadline before falling back to the CPU.
+    """
+
+    def __init__(self, store, devices: List[GpuDevice], lease_ttl: float = 60.0,
+                 poll_interval: float = 0.5, wait_seconds: float = 300.0) -> None:
+        self.store = store
+        self.devices = devices
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.wait_seconds = wait_seconds
+
+    @classmethod
+    def from_env(cls, client: redis.Redis) -> 'GpuScheduler':
+        """Build a Redis-backed scheduler from ``GPU_*`` env vars."""
+        return cls(
+            RedisLeaseStore(client),
+            parse_devices(os.getenv('GPU_DEVICES', f'0:{VAAPI_DEVICE}:8')),
+            lease_ttl=float(os.getenv('GPU_LEASE_TTL', '60')),
+            wait_seconds=float(os.getenv('GPU_WAIT_SECONDS', '300')),
+        )
+
+    def try_acquire(self, weight: float) -> Optional[Lease]:
+        """Lease the least loaded device *weight* fits on, without waiting."""
+        lease_id = uuid.uuid4().hex
+        loads = sorted(self.devices, key=lambda d: self.store.usage(d.key) / d.vram_gb)
+        for device in loads:
+            if self.store.try_acquire(device.key, lease_id, weight, device.vram_gb, self.lease_ttl):
+                return Lease(device, lease_id, weight)
+        return None
+
+    def acquire(self, weight: float, timeout: Optional[float] = None) -> Optional[Lease]:
+        """Wait up to *timeout* seconds for a lease; ``None`` means use the CPU."""
+        deadline = time.monotonic() + (self.wait_seconds if timeout is None else timeout)
+        while self.devices:
+            lease = self.try_acquire(weight)
+            if lease is not None or time.monotonic() >= deadline:
+                return lease
+            time.sleep(min(self.poll_interval, max(0.0, deadline - time.monotonic())))
+        return None
+
+    async def acquire_async(self, weight: float,
+                            timeout: Optional[float] = None) -> Optional[Lease]:
+        """Coroutine version of :meth:`acquire`.
+
+        Each attempt is one store round trip in a thread; the wait between
+        attempts is an ``asyncio.sleep``.
+        """
+        deadline = time.monotonic() + (self.wait_seconds if timeout is None else timeout)
+        while self.devices:
+            lease = await asyncio.to_thread(self.try_acquire, weight)
+            if lease is not None or time.monotonic() >= deadline:
+                return lease
+            await asyncio.sleep(min(self.poll_interval, max(0.0, deadline - time.monotonic())))
+        return None
+
+    def release(self, lease: Lease) -> None:
+        """Give *lease* back."""
+        self.store.release(lease.device.key, lease.lease_id)
+
+    def _keep_alive(self, lease: Lease, stop: threading.Event) -> None:
+        """Renew *lease* until *stop* is set."""
+        while not stop.wait(self.lease_ttl / 3):
+            try:
+                if not self.store.renew(lease.device.key, lease.lease_id, self.lease_ttl):
+                    logger.warning("Lease on %s expired before renewal", lease.device.key)
+                    return
+            except redis.RedisError as err:
+                logger.error("Could not renew lease on %s: %s", lease.device.key, err)
+
+    @contextlib.contextmanager
+    def lease(self, weight: float, timeout: Optional[float] = None) -> Iterator[Optional[Lease]]:
+        """Hold a renewed lease for the ``with`` block; yields ``None`` for the CPU path."""
+        lease = self.acquire(weight, timeout)
+        if lease is None:
+            logger.info("No GPU slot for weight %s, using the CPU path", weight)
+            yield None
+            return
+        stop = threading.Event()
+        threading.Thread(target=self._keep_alive, args=(lease, stop), daemon=True).start()
+        try:
+            yield lease
+        finally:
+            stop.set()
+            self.release(lease)
+
+    @contextlib.asynccontextmanager
+    async def lease_async(self, weight: float,
+                          timeout: Optional[float] = None) -> AsyncIterator[Optional[Lease]]:
+        """Coroutine version of :meth:`lease` for ``async with``."""
+        lease = await self.acquire_async(weight, timeout)
+        if lease is None:
+            logger.info("No GPU slot for weight %s, using the CPU path", weight)
+            yield None
+            return
+        stop = threading.Event()
+        threading.Thread(target=self._keep_alive, args=(lease, stop), daemon=True).start()
+        try:
+            yield lease
+        finally:
+            stop.set()
+            await asyncio.shield(asyncio.to_thread(self.release, lease))
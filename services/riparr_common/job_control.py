@@ -0,0 +1,237 @@
+"""Per-job pause, resume and cancel of running subprocesses.
+
+The orchestrator's ``pause_pipeline`` freezes whole containers, which stops
+every job of a worker together with its progress publishing and Redis
+heartbeats. Per-job commands are published on ``orchestrator_commands``
+instead::
+
+    {"action": "pause_job" | "resume_job" | "cancel_job", "job_id": "..."}
+
+Every worker replica reads that stream with a :class:`JobControl`. The
+replica running the job signals that job's makemkvcon, Real-ESRGAN and
+ffmpeg processes: SIGSTOP to pause, SIGCONT to resume, and SIGTERM to cancel.
+Processes are registered through :meth:`JobControl.popen` (or
+:meth:`JobControl.track`). A paused job gives its executor slot to the next
+queued job until it resumes. A cancelled job unwinds with
+:class:`JobCancelled`, which the executors count as cancelled rather than
+failed. The replica also publishes ``paused``, ``resumed`` or ``cancelled``
+on its stage stream. Jobs still queued on a replica are taken out of the
+queue when cancelled; the executor calls their ``on_drop`` callback, which
+acknowledges the stream entry.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+COMMANDS_STREAM = 'orchestrator_commands'
+ACTIONS = {'pause_job': 'pause', 'resume_job': 'resume', 'cancel_job': 'cancel'}
+
+
+class JobCancelled(Exception):
+    """Raised inside a job that was cancelled by an operator."""
+
+
+class _JobState:
+    """Processes and flags of one running job."""
+
+    def __init__(self) -> None:
+        self.processes: List[Any] = []
+        self.refs = 0
+        self.paused = False
+        self.cancelled = False
+
+
+def send_signal(process: Any, signum: int) -> None:
+    """Signal a ``subprocess.Popen`` or asyncio process unless it has been reaped."""
+    if process.returncode is not None:
+        return
+    try:
+        os.kill(process.pid, signum)
+    except OSError:
+        pass  # Exited in the meantime
+
+
+class JobControl:
+    """Apply per-job commands to the subprocesses of this worker's jobs.
+
+    Args:
+        client: Redis client created with ``decode_responses=True``.
+        stream: Stage stream the ``paused``/``resumed``/``cancelled`` events go to.
+        publisher: :class:`~riparr_common.publisher.EventPublisher` for those events.
+        executor: :class:`~riparr_common.executor.JobExecutor` (or asyncio
+            runner) whose slots paused jobs release and whose queued jobs
+            can be cancelled.
+    """
+
+    def __init__(self, client: redis.Redis, stream: str, publisher: Any = None,
+                 executor: Any = None) -> None:
+        self.client = client
+        self.stream = stream
+        self.publisher = publisher
+        self.executor = executor
+        self._jobs: Dict[str, _JobState] = {}
+        # Late events of a cancelled job must not start it again
+        self._recently_cancelled: Deque[str] = deque(maxlen=1000)
+        self._lock = threading.Lock()
+        self._listener: Optional[threading.Thread] = None
+
+    @contextlib.contextmanager
+    def job(self, job_id: str) -> Iterator[None]:
+        """Mark *job_id* as running here for the ``with`` block."""
+        with self._lock:
+            state = self._jobs.get(job_id)
+            if state is None:
+                state = self._jobs[job_id] = _JobState()
+                state.cancelled = job_id in self._recently_cancelled
+            state.refs += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                state.refs -= 1
+                done = state.refs == 0
+                if done:
+                    del self._jobs[job_id]
+            if done and state.paused and self.executor is not None:
+                self.executor.reclaim_slot()
+
+    def track(self, job_id: str, process: Any) -> None:
+        """Register a started *process* of *job_id*, applying a pending pause or cancel."""
+        with self._lock:
+            state = self._jobs.get(job_id)
+            if state is None:
+                return
+            state.processes = [p for p in state.processes if p.returncode is None]
+            state.processes.append(process)
+            paused, cancelled = state.paused, state.cancelled
+        if cancelled:
+            send_signal(process, signal.SIGTERM)
+        elif paused:
+            send_signal(process, signal.SIGSTOP)
+
+    def popen(self, job_id: str, cmd: List[str], **kwargs: Any) -> subprocess.Popen:
+        """Start *cmd* like ``subprocess.Popen`` as a process of *job_id*."""
+        self.check(job_id)
+        process = subprocess.Popen(cmd, **kwargs)  # pylint: disable=consider-using-with
+        self.track(job_id, process)
+        return process
+
+    def check(self, job_id: str) -> None:
+        """Raise :class:`JobCancelled` if *job_id* was cancelled."""
+        with self._lock:
+            state = self._jobs.get(job_id)
+            if state is not None and state.cancelled:
+                raise JobCancelled(f"Job {job_id} was cancelled")
+
+    def _signal(self, job_id: str, signums: List[int],
+                **flags: bool) -> Optional[Dict[str, bool]]:
+        """Set *flags* on a running job and send *signums* to its processes."""
+        with self._lock:
+            state = self._jobs.get(job_id)
+            if state is None:
+                return None
+            previous = {name: getattr(state, name) for name in flags}
+            for name, value in flags.items():
+                setattr(state, name, value)
+            processes = list(state.processes)
+        for process in processes:
+            for signum in signums:
+                send_signal(process, signum)
+        return previous
+
+    def pause(self, job_id: str) -> bool:
+        """Stop the processes of *job_id* and free its executor slot."""
+        previous = self._signal(job_id, [signal.SIGSTOP], paused=True)
+        if previous is None or previous['paused']:
+            return False
+        if self.executor is not None:
+            self.executor.release_slot()
+        self._publish('paused', job_id)
+        return True
+
+    def resume(self, job_id: str) -> bool:
+        """Continue the processes of a paused *job_id*."""
+        previous = self._signal(job_id, [signal.SIGCONT], paused=False)
+        if previous is None or not previous['paused']:
+            return False
+        if self.executor is not None:
+            self.executor.reclaim_slot()
+        self._publish('resumed', job_id)
+        return True
+
+    def cancel(self, job_id: str) -> bool:
+        """Terminate the processes of *job_id*, or drop it from the queue."""
+        with self._lock:
+            if job_id not in self._recently_cancelled:
+                self._recently_cancelled.append(job_id)
+        # SIGCONT lets a paused process act on the pending SIGTERM
+        previous = self._signal(job_id, [signal.SIGTERM, signal.SIGCONT], cancelled=True)
+        if previous is None:
+            if self.executor is None or not self.executor.cancel_queued(job_id):
+                return False
+        elif previous['cancelled']:
+            return False
+        self._publish('cancelled', job_id)
+        return True
+
+    def apply(self, command: Dict[str, Any]) -> bool:
+        """Apply one ``orchestrator_commands`` entry; returns True if it acted here."""
+        method = ACTIONS.get(command.get('action', ''))
+        job_id = command.get('job_id')
+        if method is None or not job_id:
+            return False
+        acted = getattr(self, method)(job_id)
+        if acted:
+            logger.info("Applied %s to job %s", command['action'], job_id)
+        return acted
+
+    def _publish(self, event: str, job_id: str) -> None:
+        """Publish the outcome of a command on the stage stream."""
+        if self.publisher is None:
+            return
+        try:
+            self.publisher.publish(self.stream, event, {"job_id": job_id})
+        except redis.RedisError as err:
+            logger.error("Could not publish %s for job %s: %s", event, job_id, err)
+
+    def listen(self, executor: Any = None, block_ms: int = 1000) -> None:
+        """Start a daemon thread applying new ``orchestrator_commands`` entries.
+
+        *executor* replaces the one given to the constructor.
+        """
+        if executor is not None:
+            self.executor = executor
+        if self._listener is not None:
+            return
+
+        def _loop() -> None:
+            last_id = '$'
+            while True:
+                try:
+                    response = self.client.xread({COMMANDS_STREAM: last_id}, block=block_ms)
+                except redis.RedisError as err:
+                    logger.error("Error reading %s: %s", COMMANDS_STREAM, err)
+                    time.sleep(1)
+                    continue
+                for _stream, entries in response or []:
+                    for msg_id, fields in entries:
+                        last_id = msg_id
+                        try:
+                            self.apply(json.loads(fields.get('data', '{}')))
+                        except (json.JSONDecodeError, AttributeError) as err:
+                            logger.error("Ignoring malformed command %s: %s", msg_id, err)
+
+        self._listener = threading.Thread(target=_loop, name='job-control', daemon=True)
+        self._listener.start()
@@ -0,0 +1,195 @@
+"""Compact, queryable state of every pipeline job.
+
+Job state used to exist only as a scatter of stream entries, so finding a
+job's status meant replaying every ``*_events`` stream from ``'0'``.
+:class:`JobStore` keeps one ``job:<job_id>`` hash per job plus sorted sets
+``jobs:active``, ``jobs:completed``, ``jobs:failed`` and ``jobs:cancelled``
+scored by the time the job entered that state (``jobs:all`` is scored by
+creation time). A paused job stays active with its ``paused`` field set.
+
+:class:`~riparr_common.publisher.EventPublisher` calls :meth:`JobStore.record`
+inside the same ``MULTI`` as the ``XADD`` of each event, so the index never
+disagrees with the streams. Listing a state is a ``ZREVRANGE`` plus one
+pipelined ``HGETALL`` per returned job, O(log n + m).
+
+Run ``python -m riparr_common.job_store`` for a small CLI::
+
+    python -m riparr_common.job_store list --state failed --limit 20
+    python -m riparr_common.job_store show <job_id>
+    python -m riparr_common.job_store counts
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+STAGES = ['rip', 'enhance', 'transcode', 'metadata', 'blackhole']
+STATES = ['active', 'completed', 'failed', 'cancelled']
+# States a job does not leave again; their hashes expire after the TTL
+FINISHED_STATES = ('completed', 'failed', 'cancelled')
+
+# Numeric hash fields converted back from strings on read
+NUMERIC_FIELDS = ('created_at', 'updated_at', 'progress', 'paused')
+
+
+def stage_of(stream: str) -> Optional[str]:
+    """Return the pipeline stage of an ``<stage>_events`` stream, else ``None``."""
+    stage = stream[:-len('_events')] if stream.endswith('_events') else None
+    return stage if stage in STAGES else None
+
+
+class JobStore:
+    """Job hashes indexed by state and time.
+
+    Args:
+        client: Redis client created with ``decode_responses=True``.
+        final_stage: Stage whose ``complete`` event completes a job.
+        ttl: Seconds finished jobs are kept.
+    """
+
+    PREFIX = 'job:'
+    INDEX = 'jobs:'
+
+    def __init__(self, client: redis.Redis, final_stage: str = 'blackhole',
+                 ttl: int = 30 * 24 * 3600) -> None:
+        self.client = client
+        self.final_stage = final_stage
+        self.ttl = ttl
+
+    @classmethod
+    def from_env(cls, client: redis.Redis) -> 'JobStore':
+        """Build a store configured through ``JOB_*`` env vars."""
+        return cls(
+            client,
+            final_stage=os.getenv('JOB_FINAL_STAGE', 'blackhole'),
+            ttl=int(os.getenv('JOB_STORE_TTL', str(30 * 24 * 3600))),
+        )
+
+    def state_after(self, stage: str, event: str) -> Optional[str]:
+        """Return the job state an event moves to, or ``None`` if it does not move it."""
+        if event in ('failed', 'cancelled'):
+            return event
+        if event == 'duplicate' or (event == 'complete' and stage == self.final_stage):
+            return 'completed'
+        if event in ('queued', 'start', 'complete'):
+            return 'active'
+        return None
+
+    def record(self, pipe: Any, stream: str, event: str, payload: Dict[str, Any],
+               now: Optional[float] = None) -> None:
+        """Queue the state update for one published event on *pipe*."""
+        stage = stage_of(stream)
+        job_id = payload.get('job_id')
+        if stage is None or not job_id:
+            return
+        now = time.time() if now is None else now
+        key = self.PREFIX + job_id
+        fields: Dict[str, Any] = {'job_id': job_id, 'stage': stage, 'event': event,
+                                  'updated_at': now}
+        if event == 'progress':
+            fields['progress'] = payload.get('percentage', 0)
+        elif event == 'queued':
+            fields['progress'] = 0
+        elif event == 'start':
+            fields.update({'progress': 0, f'{stage}_started_at': now})
+        elif event == 'complete':
+            fields.update({'progress': 100, f'{stage}_completed_at': now})
+        elif event == 'failed':
+            fields['error'] = str(payload.get('error', ''))
+        elif event in ('paused', 'resumed'):
+            fields['paused'] = int(event == 'paused')
+
+        pipe.hsetnx(key, 'created_at', now)
+        pipe.zadd(self.INDEX + 'all', {job_id: now}, nx=True)
+        state = self.state_after(stage, event)
+        if state is not None:
+            fields['state'] = state
+            for other in STATES:
+                if other != state:
+                    pipe.zrem(self.INDEX + other, job_id)
+            pipe.zadd(self.INDEX + state, {job_id: now})
+        pipe.hset(key, mapping=fields)
+        if state in FINISHED_STATES:
+            pipe.expire(key, self.ttl)
+            # Finished jobs age out of the indexes with their hashes
+            for index in (state, 'all'):
+                pipe.zremrangebyscore(self.INDEX + index, '-inf', now - self.ttl)
+        elif state == 'active':
+            pipe.persist(key)
+
+    @staticmethod
+    def _decode(fields: Dict[str, str]) -> Dict[str, Any]:
+        """Convert the numeric fields of a job hash."""
+        job: Dict[str, Any] = dict(fields)
+        for name, value in fields.items():
+            if name in NUMERIC_FIELDS or name.endswith(('_started_at', '_completed_at')):
+                try:
+                    job[name] = float(value) if '.' in value else int(value)
+                except ValueError:
+                    pass
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return one job, or ``None`` if it is unknown."""
+        fields = self.client.hgetall(self.PREFIX + job_id)
+        return self._decode(fields) if fields else None
+
+    def list(self, state: str = 'active', limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+        """Return jobs in *state*, most recent first."""
+        if state not in STATES + ['all']:
+            raise ValueError(f"Unknown job state: {state}")
+        job_ids = self.client.zrevrange(self.INDEX + state, offset, offset + limit - 1)
+        if not job_ids:
+            return []
+        pipe = self.client.pipeline(transaction=False)
+        for job_id in job_ids:
+            pipe.hgetall(self.PREFIX + job_id)
+        return [self._decode(fields) for fields in pipe.execute() if fields]
+
+    def counts(self) -> Dict[str, int]:
+        """Return the number of jobs per state."""
+        pipe = self.client.pipeline(transaction=False)
+        for state in STATES:
+            pipe.zcard(self.INDEX + state)
+        return dict(zip(STATES, pipe.execute()))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Query the Riparr job store.")
+    parser.add_argument('--redis-url', default=os.getenv('REDIS_URL', 'redis://localhost:6379'))
+    commands = parser.add_subparsers(dest='command', required=True)
+    list_parser = commands.add_parser('list', help="list jobs in a state")
+    list_parser.add_argument('--state', default='active', choices=STATES + ['all'])
+    list_parser.add_argument('--limit', type=int, default=50)
+    list_parser.add_argument('--offset', type=int, default=0)
+    show_parser = commands.add_parser('show', help="show one job")
+    show_parser.add_argument('job_id')
+    commands.add_parser('counts', help="count jobs per state")
+    args = parser.parse_args(argv)
+
+    store = JobStore(redis.from_url(args.redis_url, decode_responses=True))
+    if args.command == 'list':
+        for job in store.list(args.state, args.limit, args.offset):
+            updated = time.strftime('%Y-%m-%d %H:%M:%S',
+                                    time.localtime(job.get('updated_at', 0)))
+            print(f"{job['job_id']}  {job.get('state', '?'):<9} {job.get('stage', '?'):<9} "
+                  f"{job.get('event', '?'):<14} {job.get('progress', 0):>3}%  {updated}")
+    elif args.command == 'show':
+        job = store.get(args.job_id)
+        if job is None:
+            parser.exit(1, f"Unknown job {args.job_id}\n")
+        print(json.dumps(job, indent=2, sort_keys=True))
+    else:
+        print(json.dumps(store.counts()))
+
+
+if __name__ == '__main__':
+    main()
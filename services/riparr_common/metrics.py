@@ -0,0 +1,476 @@
+"""In-process metrics of a worker in the Prometheus text format.
+
+The workers only logged what they did, so finding the stage that limits the
+pipeline under load meant reading logs of every container. Each worker now
+keeps a :class:`Registry` of counters, gauges and histograms and serves it on
+``http://<worker>:$METRICS_PORT/metrics`` (``METRICS_PORT=0`` disables it).
+
+Recording a sample is a dict update under a lock, so metrics can be updated
+from job threads and progress callbacks. Values that are expensive or only
+meaningful at scrape time (stream lag, Redis round-trip time, subprocess CPU
+and memory from ``/proc``) are gathered by collectors run on each scrape.
+
+Metrics shared by all workers:
+
+- ``riparr_job_duration_seconds{worker,outcome}`` and
+  ``riparr_job_wait_seconds{worker}``: recorded by the executors.
+- ``riparr_jobs_running{worker}``, ``riparr_jobs_queued{worker}``.
+- ``riparr_stream_lag_entries{stream,group}``,
+  ``riparr_stream_lag_seconds{stream,group}`` and
+  ``riparr_stream_pending{stream,group}``: the consumer group's
+  last-delivered entry compared with the stream tip.
+- ``riparr_stage_bytes_total{stage,direction}``: media bytes read and written.
+- ``riparr_encode_fps{stage}``: average frames per second of each encoded file.
+- ``riparr_subprocess_cpu_seconds{command}``,
+  ``riparr_subprocess_rss_bytes{command}`` and
+  ``riparr_subprocesses{command}``: live child processes, summed per command.
+- ``riparr_redis_rtt_seconds``: time of a ``PING``.
+
+Worker-specific metrics (e.g. ``riparr_ollama_request_seconds``) are
+registered on :data:`REGISTRY` by the worker.
+"""
+
+import bisect
+import contextlib
+import logging
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+# Job and request durations range from milliseconds to a multi-hour upscale
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+                   300, 900, 1800, 3600, 7200, 14400, 28800)
+FPS_BUCKETS = (0.5, 1, 2, 5, 10, 15, 24, 30, 45, 60, 90, 120, 240, 480)
+
+LabelKey = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    """Format a sample value as Prometheus expects it."""
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    """Escape a label value."""
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    """Render a label set, ``{a="1",b="2"}`` or the empty string."""
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Metric:
+    """A named metric with a fixed set of label names.
+
+    Label values are passed as keyword arguments to the recording methods.
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelKey, Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelKey:
+        """Return the label values of a sample in label name order."""
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {sorted(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self) -> None:
+        """Drop every label set, e.g. before a collector sets fresh values."""
+        with self._lock:
+            self._values.clear()
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """Return ``(suffix, labels, value)`` for every sample."""
+        with self._lock:
+            return [('', _labels(self.labelnames, key), value)
+                    for key, value in sorted(self._values.items())]
+
+    def render(self) -> List[str]:
+        """Return the exposition lines of this metric."""
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for suffix, labels, value in self.samples():
+            lines.append(f'{self.name}{suffix}{labels} {_format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    """A value that only goes up."""
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        """Add *amount* (not negative) to the counter."""
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        """Return the current value."""
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """A value that can go up and down."""
+
+    kind = 'gauge'
+
+    def set(self, value: float, **labels: Any) -> None:
+        """Set the gauge to *value*."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        """Add *amount* to the gauge."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        """Return the current value."""
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Histogram(Metric):
+    """Observations counted into cumulative buckets, with their sum and count."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: Any) -> None:
+        """Record one observation."""
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket counts (the last one is +Inf), sum, count
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """Observe the run time of the ``with`` block."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def count(self, **labels: Any) -> int:
+        """Return the number of observations."""
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return entry[2] if entry else 0
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            entries = [(key, list(entry[0]), entry[1], entry[2])
+                       for key, entry in sorted(self._values.items())]
+        samples = []
+        names = self.labelnames + ('le',)
+        for key, counts, total, count in entries:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket
+                samples.append(('_bucket', _labels(names, key + (_format_value(bound),)),
+                                cumulative))
+            samples.append(('_sum', _labels(self.labelnames, key), total))
+            samples.append(('_count', _labels(self.labelnames, key), count))
+        return samples
+
+
+class Registry:
+    """The metrics of one process and the collectors run before each scrape."""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: Dict[str, Callable[[], None]] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls: type, name: str, *args: Any, **kwargs: Any) -> Any:
+        """Return the metric called *name*, creating it on first use."""
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"{name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """Return the counter *name*."""
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        """Return the gauge *name*."""
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """Return the histogram *name*."""
+        return self._register(Histogram, name, documentation, labelnames, buckets)
+
+    def add_collector(self, name: str, func: Callable[[], None]) -> None:
+        """Run *func* before every scrape; a collector of the same *name* is replaced."""
+        with self._lock:
+            self._collectors[name] = func
+
+    def collect(self) -> None:
+        """Run the collectors; a failing collector only loses its own samples."""
+        with self._lock:
+            collectors = list(self._collectors.items())
+        for name, func in collectors:
+            try:
+                func()
+            except Exception as err:  # pylint: disable=broad-except
+                logger.error("Metrics collector %s failed: %s", name, err)
+
+    def render(self) -> str:
+        """Run the collectors and return every metric in the text exposition format."""
+        self.collect()
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+JOB_DURATION = REGISTRY.histogram(
+    'riparr_job_duration_seconds', 'Run time of finished jobs.', ('worker', 'outcome'))
+JOB_WAIT = REGISTRY.histogram(
+    'riparr_job_wait_seconds', 'Time jobs spent queued before they started.', ('worker',))
+JOBS_RUNNING = REGISTRY.gauge('riparr_jobs_running', 'Jobs running now.', ('worker',))
+JOBS_QUEUED = REGISTRY.gauge('riparr_jobs_queued', 'Jobs waiting for a slot.', ('worker',))
+STAGE_BYTES = REGISTRY.counter(
+    'riparr_stage_bytes_total', 'Media bytes read and written by a stage.',
+    ('stage', 'direction'))
+ENCODE_FPS = REGISTRY.histogram(
+    'riparr_encode_fps', 'Average frames per second of each encoded file.', ('stage',),
+    buckets=FPS_BUCKETS)
+STREAM_LAG_ENTRIES = REGISTRY.gauge(
+    'riparr_stream_lag_entries', 'Entries added to a stream after the last one its group read.',
+    ('stream', 'group'))
+STREAM_LAG_SECONDS = REGISTRY.gauge(
+    'riparr_stream_lag_seconds', 'Age of the stream tip relative to the last entry its group read.',
+    ('stream', 'group'))
+STREAM_PENDING = REGISTRY.gauge(
+    'riparr_stream_pending', 'Entries delivered to a group and not yet acknowledged.',
+    ('stream', 'group'))
+SUBPROCESS_CPU = REGISTRY.gauge(
+    'riparr_subprocess_cpu_seconds', 'CPU time used by live child processes.', ('command',))
+SUBPROCESS_RSS = REGISTRY.gauge(
+    'riparr_subprocess_rss_bytes', 'Resident memory of live child processes.', ('command',))
+SUBPROCESSES = REGISTRY.gauge(
+    'riparr_subprocesses', 'Live child processes.', ('command',))
+PROCESS_CPU = REGISTRY.gauge(
+    'riparr_process_cpu_seconds', 'CPU time used by the worker process itself.')
+PROCESS_RSS = REGISTRY.gauge(
+    'riparr_process_rss_bytes', 'Resident memory of the worker process itself.')
+REDIS_RTT = REGISTRY.gauge('riparr_redis_rtt_seconds', 'Round-trip time of a Redis PING.')
+
+
+def count_bytes(stage: str, read: int = 0, written: int = 0) -> None:
+    """Add media bytes read and written by *stage*."""
+    if read:
+        STAGE_BYTES.inc(read, stage=stage, direction='read')
+    if written:
+        STAGE_BYTES.inc(written, stage=stage, direction='written')
+
+
+def file_size(path: str) -> int:
+    """Return the size of *path*, or 0 if it is gone."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def observe_fps(stage: str, frames: int, seconds: float) -> None:
+    """Record the average encode speed of one file."""
+    if frames > 0 and seconds > 0:
+        ENCODE_FPS.observe(frames / seconds, stage=stage)
+
+
+def stream_id_ms(entry_id: Optional[str]) -> Optional[int]:
+    """Return the millisecond time part of a stream entry id."""
+    if not entry_id:
+        return None
+    try:
+        return int(str(entry_id).split('-', 1)[0])
+    except ValueError:
+        return None
+
+
+def collect_stream_lag(client: redis.Redis, streams: Iterable[Tuple[str, str]]) -> None:
+    """Set the lag gauges of each ``(stream, group)`` from ``XINFO``."""
+    for stream, group in streams:
+        try:
+            tip = client.xinfo_stream(stream)
+            groups = {info['name']: info for info in client.xinfo_groups(stream)}
+        except redis.ResponseError:
+            continue  # Stream not created yet
+        info = groups.get(group)
+        if info is None:
+            continue
+        last_delivered = info.get('last-delivered-id')
+        lag = info.get('lag')
+        if lag is None:
+            # Pre-7.0 servers: count the entries after the last delivered one
+            lag = len(client.xrange(stream, f'({last_delivered}', '+', count=10000)) \
+                if last_delivered and tip.get('length') else 0
+        tip_ms = stream_id_ms(tip.get('last-generated-id'))
+        read_ms = stream_id_ms(last_delivered)
+        seconds = (tip_ms - read_ms) / 1000 if lag and tip_ms and read_ms is not None else 0
+        STREAM_LAG_ENTRIES.set(lag, stream=stream, group=group)
+        STREAM_LAG_SECONDS.set(max(0.0, seconds), stream=stream, group=group)
+        STREAM_PENDING.set(info.get('pending', 0), stream=stream, group=group)
+
+
+def read_proc_stat(pid: int) -> Optional[Tuple[str, int, float, int]]:
+    """Return ``(command, parent pid, CPU seconds, RSS bytes)`` of *pid* from ``/proc``."""
+    try:
+        with open(f'/proc/{pid}/stat', encoding='ascii', errors='replace') as handle:
+            stat = handle.read()
+    except OSError:
+        return None
+    command = stat[stat.find('(') + 1:stat.rfind(')')]
+    # Fields after the command: state, ppid, ... utime (12th), stime, ... rss (22nd)
+    fields = stat[stat.rfind(')') + 2:].split()
+    ticks = os.sysconf('SC_CLK_TCK')
+    return (command, int(fields[1]), (int(fields[11]) + int(fields[12])) / ticks,
+            int(fields[21]) * os.sysconf('SC_PAGE_SIZE'))
+
+
+def collect_processes(root: Optional[int] = None) -> None:
+    """Sample CPU time and RSS of the worker and its descendants from ``/proc``."""
+    root = os.getpid() if root is None else root
+    stats = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            stat = read_proc_stat(int(entry))
+            if stat is not None:
+                stats[int(entry)] = stat
+    children: Dict[int, List[int]] = {}
+    for pid, (_command, ppid, _cpu, _rss) in stats.items():
+        children.setdefault(ppid, []).append(pid)
+    totals: Dict[str, List[float]] = {}
+    todo = list(children.get(root, []))
+    while todo:
+        pid = todo.pop()
+        todo.extend(children.get(pid, []))
+        command, _ppid, cpu, rss = stats[pid]
+        total = totals.setdefault(command, [0, 0.0, 0])
+        total[0] += 1
+        total[1] += cpu
+        total[2] += rss
+    for gauge in (SUBPROCESSES, SUBPROCESS_CPU, SUBPROCESS_RSS):
+        gauge.clear()
+    for command, (count, cpu, rss) in totals.items():
+        SUBPROCESSES.set(count, command=command)
+        SUBPROCESS_CPU.set(round(cpu, 2), command=command)
+        SUBPROCESS_RSS.set(rss, command=command)
+    if root in stats:
+        PROCESS_CPU.set(round(stats[root][2], 2))
+        PROCESS_RSS.set(stats[root][3])
+
+
+def collect_redis_rtt(client: redis.Redis) -> None:
+    """Time one ``PING``."""
+    started = time.monotonic()
+    client.ping()
+    REDIS_RTT.set(round(time.monotonic() - started, 6))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Serve ``GET /metrics``."""
+
+    registry = REGISTRY
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:  # pylint: disable=redefined-builtin
+        pass  # Scrapes every few seconds would flood the worker log
+
+
+def serve(port: int, registry: Registry = REGISTRY, host: str = '') -> ThreadingHTTPServer:
+    """Serve *registry* on *port* from a daemon thread; port 0 picks a free one."""
+    handler = type('MetricsHandler', (_Handler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info("Serving metrics on port %d", server.server_address[1])
+    return server
+
+
+def start_from_env(client: Optional[redis.Redis] = None,
+                   streams: Iterable[Tuple[str, str]] = ()) -> Optional[ThreadingHTTPServer]:
+    """Register the shared collectors and serve metrics on ``METRICS_PORT``.
+
+    Args:
+        client: Redis client for the RTT and stream lag collectors.
+        streams: ``(stream, group)`` pairs the worker consumes.
+
+    Returns:
+        The server, or ``None`` when ``METRICS_PORT`` is 0 or the port is taken.
+    """
+    port = int(os.getenv('METRICS_PORT', '9100'))
+    if port == 0:
+        return None
+    if os.path.isdir('/proc'):
+        REGISTRY.add_collector('processes', collect_processes)
+    if client is not None:
+        REGISTRY.add_collector('redis_rtt', lambda: collect_redis_rtt(client))
+        streams = list(streams)
+        if streams:
+            REGISTRY.add_collector('stream_lag', lambda: collect_stream_lag(client, streams))
+    try:
+        return serve(port)
+    except OSError as err:
+        logger.error("Could not serve metrics on port %d: %s", port, err)
+        return None
@@ -0,0 +1,128 @@
+"""Shared ffprobe cache.
+
+A file used to be probed by ``enhance_worker.is_hdr_file``, again by
+``transcode_worker.get_audio_info`` and a third time for its duration. The
+:class:`ProbeCache` runs ffprobe once per file, keyed by path, size and
+mtime, and keeps the result in Redis with a sliding TTL. Stage events also
+carry the probe data (``probes``: path -> probe) so downstream workers can
+skip the lookup entirely.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import subprocess
+from typing import Any, Dict, List, Optional
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+Probe = Dict[str, Any]
+
+
+def run_ffprobe(file_path: str) -> Probe:
+    """Run ffprobe for streams and format of *file_path*."""
+    cmd = ['ffprobe', '-v', 'quiet', '-print_format', 'json',
+           '-show_streams', '-show_format', file_path]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=False)
+    data = json.loads(result.stdout or '{}')
+    return {'streams': data.get('streams', []), 'format': data.get('format', {})}
+
+
+def video_stream(probe: Probe) -> Dict[str, Any]:
+    """Return the first video stream of *probe* (empty dict if none)."""
+    return next((s for s in probe.get('streams', []) if s.get('codec_type') == 'video'), {})
+
+
+def audio_streams(probe: Probe) -> List[Dict[str, Any]]:
+    """Return the audio streams of *probe*."""
+    return [s for s in probe.get('streams', []) if s.get('codec_type') == 'audio']
+
+
+def duration(probe: Probe) -> Optional[float]:
+    """Return the container duration in seconds, or ``None`` if unknown."""
+    try:
+        return float(probe['format']['duration'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def estimate_frames(probe: Probe) -> int:
+    """Estimate the number of video frames from probe data."""
+    stream = video_stream(probe)
+    if str(stream.get('nb_frames', '')).isdigit():
+        return int(stream['nb_frames'])
+    num, _, den = stream.get('avg_frame_rate', '0/1').partition('/')
+    seconds = float(probe.get('format', {}).get('duration', 0) or 0)
+    if float(den or 1):
+        return int(seconds * float(num or 0) / float(den or 1))
+    return 0
+
+
+def is_hdr(probe: Probe) -> bool:
+    """Return True if the video stream uses BT.2020 / HDR signalling."""
+    for stream in probe.get('streams', []):
+        if stream.get('codec_type') == 'video':
+            color_primaries = stream.get('color_primaries', '')
+            if 'bt2020' in color_primaries.lower() or 'hdr' in str(stream).lower():
+                return True
+    return False
+
+
+class ProbeCache:
+    """ffprobe results cached in Redis under ``probe:<digest>`` keys.
+
+    Args:
+        client: Redis client created with ``decode_responses=True``.
+        ttl: Seconds an entry lives after its last use.
+    """
+
+    PREFIX = 'probe:'
+
+    def __init__(self, client: redis.Redis, ttl: int = 7 * 24 * 3600) -> None:
+        self.client = client
+        self.ttl = ttl
+
+    @classmethod
+    def from_env(cls, client: redis.Redis) -> 'ProbeCache':
+        """Build a cache with the TTL from ``PROBE_CACHE_TTL``."""
+        return cls(client, ttl=int(os.getenv('PROBE_CACHE_TTL', str(7 * 24 * 3600))))
+
+    def _key(self, file_path: str) -> str:
+        """Cache key for the current version of *file_path*."""
+        st = os.stat(file_path)
+        identity = f"{os.path.abspath(file_path)}|{st.st_size}|{st.st_mtime_ns}"
+        return self.PREFIX + hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+    def probe(self, file_path: str, probes: Optional[Dict[str, Probe]] = None) -> Probe:
+        """Return probe data for *file_path*.
+
+        Args:
+            file_path: Media file to probe.
+            probes: Probe data carried in the triggering event, checked first.
+        """
+        if probes and file_path in probes:
+            return probes[file_path]
+        try:
+            key = self._key(file_path)
+        except OSError:
+            return {'streams': [], 'format': {}}
+        try:
+            cached = self.client.getex(key, ex=self.ttl)
+            if cached:
+                return json.loads(cached)
+        except (redis.RedisError, json.JSONDecodeError) as err:
+            logger.error("Probe cache lookup failed for %s: %s", file_path, err)
+
+        try:
+            data = run_ffprobe(file_path)
+        except (OSError, json.JSONDecodeError) as err:
+            logger.error("Error probing %s: %s", file_path, err)
+            return {'streams': [], 'format': {}}
+        try:
+            self.client.set(key, json.dumps(data), ex=self.ttl)
+        except redis.RedisError as err:
+            logger.error("Probe cache store failed for %s: %s", file_path, err)
+        return data
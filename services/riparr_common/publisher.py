@@ -0,0 +1,188 @@
+"""Batched, pipelined publishing of pipeline events.
+
+Workers used to make one synchronous ``XADD`` round trip per event, and the
+rip worker did so for every ``PRGV:`` line MakeMKV printed. The
+:class:`EventPublisher` coalesces progress per job instead:
+
+* only the latest percentage of a job is kept until it is due,
+* an update is due once it moved up by ``min_delta`` points (or back down
+  at all, e.g. when a new pass starts) and at least ``min_interval``
+  seconds passed since the job's previous update,
+* due updates of all jobs are flushed together through one Redis pipeline,
+* any other event (``start``, ``complete``, ...) first flushes the job's
+  pending progress in the same pipeline, so per-job order is preserved.
+
+Non-progress events carry the trace context of the span they are published
+from (see :mod:`riparr_common.tracing`).
+
+With a :class:`~riparr_common.job_store.JobStore` attached, every event also
+updates the job's state in the same round trip; non-progress events do so in
+a ``MULTI`` transaction together with their ``XADD``.
+
+In the asyncio runtime :meth:`EventPublisher.publish_async` sends events
+through the ``redis.asyncio`` client set as ``async_client``, so publishing
+neither blocks the event loop nor takes a thread.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import redis
+
+from riparr_common import tracing
+from riparr_common.job_store import JobStore
+
+logger = logging.getLogger(__name__)
+
+JobKey = Tuple[str, str]  # (stream, job_id)
+
+
+class EventPublisher:
+    """Publish ``{'event': ..., 'data': json}`` entries with progress coalescing.
+
+    Args:
+        client: Redis client created with ``decode_responses=True``.
+        min_delta: Minimum percentage change between two progress events.
+        min_interval: Minimum seconds between two progress events of a job.
+        flush_interval: How often the background thread flushes due progress.
+        job_store: Job index updated with every event; ``None`` disables it.
+        async_client: ``redis.asyncio`` client used by :meth:`publish_async`.
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        min_delta: int = 1,
+        min_interval: float = 2.0,
+        flush_interval: float = 0.5,
+        job_store: Optional[JobStore] = None,
+        async_client: Optional['redis.asyncio.Redis'] = None,
+    ) -> None:
+        self.client = client
+        self.async_client = async_client
+        self.job_store = job_store
+        self.min_delta = min_delta
+        self.min_interval = min_interval
+        self.flush_interval = flush_interval
+        self._pending: Dict[JobKey, Dict[str, Any]] = {}
+        self._sent: Dict[JobKey, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls, client: redis.Redis) -> 'EventPublisher':
+        """Build a publisher configured through ``PROGRESS_*`` env vars."""
+        return cls(
+            client,
+            min_delta=int(os.getenv('PROGRESS_MIN_DELTA', '1')),
+            min_interval=float(os.getenv('PROGRESS_MIN_INTERVAL', '2')),
+            flush_interval=float(os.getenv('PROGRESS_FLUSH_INTERVAL', '0.5')),
+            job_store=(JobStore.from_env(client)
+                       if os.getenv('JOB_STORE', 'true').lower() == 'true' else None),
+        )
+
+    def progress(self, stream: str, job_id: str, percentage: int, **extra: Any) -> None:
+        """Record the latest progress of *job_id*; it is published when due."""
+        payload = {"job_id": job_id, "percentage": percentage, **extra}
+        with self._lock:
+            self._pending[(stream, job_id)] = payload
+        self._ensure_flusher()
+
+    def publish(self, stream: str, event: str, payload: Dict[str, Any]) -> None:
+        """Publish a non-progress *event* now, after the job's pending progress."""
+        payload = tracing.inject(payload)
+        key = (stream, payload.get('job_id'))
+        with self._lock:
+            pipe = self.client.pipeline(transaction=self.job_store is not None)
+            pending = self._pending.pop(key, None)
+            if pending is not None:
+                self._add(pipe, stream, 'progress', pending)
+            self._add(pipe, stream, event, payload)
+            pipe.execute()
+            self._sent.pop(key, None)
+
+    async def publish_async(self, stream: str, event: str, payload: Dict[str, Any]) -> None:
+        """Coroutine version of :meth:`publish` on ``async_client``.
+
+        Without an asyncio client the synchronous publish runs in a thread.
+        """
+        if self.async_client is None:
+            await asyncio.to_thread(self.publish, stream, event, payload)
+            return
+        payload = tracing.inject(payload)
+        key = (stream, payload.get('job_id'))
+        # Held only to take the pending progress; a flush in progress has
+        # sent its older updates of the job once the lock is free
+        with self._lock:
+            pending = self._pending.pop(key, None)
+            self._sent.pop(key, None)
+        pipe = self.async_client.pipeline(transaction=self.job_store is not None)
+        if pending is not None:
+            self._add(pipe, stream, 'progress', pending)
+        self._add(pipe, stream, event, payload)
+        await pipe.execute()
+
+    def _add(self, pipe: Any, stream: str, event: str, payload: Dict[str, Any]) -> None:
+        """Queue the ``XADD`` of one event and its job state update on *pipe*."""
+        pipe.xadd(stream, {'event': event, 'data': json.dumps(payload)})
+        if self.job_store is not None:
+            self.job_store.record(pipe, stream, event, payload)
+
+    def fail(self, stream: str, job_id: str, error: Any) -> None:
+        """Publish a ``failed`` event for *job_id*."""
+        self.publish(stream, 'failed', {"job_id": job_id, "error": str(error)})
+
+    async def fail_async(self, stream: str, job_id: str, error: Any) -> None:
+        """Coroutine version of :meth:`fail`."""
+        await self.publish_async(stream, 'failed', {"job_id": job_id, "error": str(error)})
+
+    def _due(self, key: JobKey, payload: Dict[str, Any], now: float) -> bool:
+        """Return True if *payload* should be published now."""
+        last = self._sent.get(key)
+        if last is None:
+            return True
+        last_pct, last_time = last
+        change = payload['percentage'] - last_pct
+        return ((change < 0 or change >= self.min_delta)
+                and now - last_time >= self.min_interval)
+
+    def flush(self) -> int:
+        """Publish all due progress updates in one pipeline; returns their count."""
+        with self._lock:
+            now = time.monotonic()
+            due = [(key, payload) for key, payload in self._pending.items()
+                   if self._due(key, payload, now)]
+            if not due:
+                return 0
+            pipe = self.client.pipeline(transaction=False)
+            for (stream, _job_id), payload in due:
+                self._add(pipe, stream, 'progress', payload)
+            pipe.execute()
+            for key, payload in due:
+                del self._pending[key]
+                self._sent[key] = (payload['percentage'], now)
+            return len(due)
+
+    def _ensure_flusher(self) -> None:
+        """Start the background flush thread on first use."""
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self) -> None:
+        """Flush due progress every ``flush_interval`` seconds."""
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except redis.RedisError as err:
+                logger.error("Progress flush failed: %s", err)
@@ -0,0 +1,126 @@
+"""Retention and trimming of the pipeline Redis streams.
+
+None of the services pass ``MAXLEN`` to ``XADD``, so every stream grew
+without bound. :class:`StreamTrimmer` applies a per-stream policy from
+``config.yaml`` (``maxlen`` entries and/or ``max_age_hours``) with
+approximate ``XTRIM MINID``. Each trim point is capped by consumer group
+progress, so entries that are pending in a group, or not yet delivered to
+it, are never removed.
+"""
+
+import logging
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+StreamId = Tuple[int, int]
+
+
+def parse_id(stream_id: str) -> StreamId:
+    """Split ``'<ms>-<seq>'`` into a comparable tuple."""
+    ms, _, seq = stream_id.partition('-')
+    return int(ms), int(seq or 0)
+
+
+def format_id(stream_id: StreamId) -> str:
+    """Inverse of :func:`parse_id`."""
+    return f'{stream_id[0]}-{stream_id[1]}'
+
+
+class StreamTrimmer:
+    """Trim streams according to *policies* without losing unacked entries.
+
+    Args:
+        client: Redis client created with ``decode_responses=True``.
+        policies: ``{stream: {'maxlen': int, 'max_age_hours': float}}``;
+            either key may be omitted.
+    """
+
+    def __init__(self, client: redis.Redis, policies: Dict[str, Dict[str, Any]]) -> None:
+        self.client = client
+        self.policies = policies
+
+    @classmethod
+    def from_config(cls, client: redis.Redis, config: Dict[str, Any]) -> 'StreamTrimmer':
+        """Build a trimmer from the ``streams.retention`` section of config.yaml."""
+        return cls(client, (config.get('streams') or {}).get('retention') or {})
+
+    def safe_min_id(self, stream: str) -> Optional[StreamId]:
+        """Return the lowest id some consumer group still needs, if any.
+
+        For every group this is its oldest pending entry or, when nothing is
+        pending, the entry right after its last-delivered id.
+        """
+        bound: Optional[StreamId] = None
+        for group in self.client.xinfo_groups(stream):
+            pending = self.client.xpending(stream, group['name'])
+            if pending['pending']:
+                needed = parse_id(pending['min'])
+            else:
+                ms, seq = parse_id(group['last-delivered-id'])
+                needed = (ms, seq + 1)
+            bound = needed if bound is None else min(bound, needed)
+        return bound
+
+    def policy_min_id(self, stream: str, policy: Dict[str, Any]) -> Optional[StreamId]:
+        """Return the id before which *policy* allows entries to be removed."""
+        candidates = []
+        maxlen = policy.get('maxlen')
+        if maxlen is not None:
+            excess = self.client.xlen(stream) - int(maxlen)
+            if excess > 0:
+                # First entry to keep; trimming runs often, so excess is small
+                entries = self.client.xrange(stream, count=excess + 1)
+                if len(entries) > excess:
+                    candidates.append(parse_id(entries[excess][0]))
+        max_age_hours = policy.get('max_age_hours')
+        if max_age_hours is not None:
+            cutoff_ms = int((time.time() - float(max_age_hours) * 3600) * 1000)
+            candidates.append((cutoff_ms, 0))
+        return max(candidates) if candidates else None
+
+    def trim(self, stream: str) -> int:
+        """Apply the policy of *stream*; returns the number of removed entries."""
+        policy = self.policies.get(stream) or {}
+        if not self.client.exists(stream):
+            return 0
+        target = self.policy_min_id(stream, policy)
+        if target is None:
+            return 0
+        safe = self.safe_min_id(stream)
+        if safe is not None and safe < target:
+            logger.info("Trim of %s held back by consumer groups at %s", stream, format_id(safe))
+            target = safe
+        return self.client.xtrim(stream, minid=format_id(target), approximate=True)
+
+    def trim_all(self) -> Dict[str, int]:
+        """Trim every configured stream."""
+        removed = {}
+        for stream in self.policies:
+            try:
+                removed[stream] = self.trim(stream)
+            except redis.ResponseError as err:
+                logger.error("Could not trim %s: %s", stream, err)
+        return removed
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Return length, memory and per-group backlog for each configured stream."""
+        stats: Dict[str, Dict[str, Any]] = {}
+        for stream in self.policies:
+            if not self.client.exists(stream):
+                continue
+            groups = {}
+            for group in self.client.xinfo_groups(stream):
+                groups[group['name']] = {
+                    'pending': group.get('pending', 0),
+                    'lag': group.get('lag'),
+                }
+            stats[stream] = {
+                'length': self.client.xlen(stream),
+                'memory_bytes': self.client.memory_usage(stream) or 0,
+                'groups': groups,
+            }
+        return stats
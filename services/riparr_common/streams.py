@@ -0,0 +1,289 @@
+"""Consumer-group based reading of the pipeline Redis streams.
+
+Every worker used to call ``XREAD`` from ``'0'`` on start-up, which replayed
+the whole upstream stream after each restart and made two replicas of the same
+worker process every event twice. :class:`StreamConsumer` wraps
+``XREADGROUP`` / ``XACK`` / ``XAUTOCLAIM`` so that:
+
+* each event is delivered to exactly one consumer of a group,
+* entries are only acknowledged once the job they started has finished,
+* entries left pending by a crashed consumer are re-delivered, either to the
+  same consumer name after a restart or to another replica once idle.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+# A decoded stream entry: (message id, payload dict)
+Message = Tuple[str, Dict[str, Any]]
+
+
+def default_consumer_name() -> str:
+    """Return the consumer name used when ``CONSUMER_NAME`` is not set.
+
+    The container hostname is stable across restarts of the same container, so
+    a restarted worker picks up the entries it left pending.
+    """
+    return os.getenv('CONSUMER_NAME') or socket.gethostname()
+
+
+def decode_message(fields: Dict[str, str]) -> Dict[str, Any]:
+    """Decode a raw stream entry into the payload dict workers operate on.
+
+    Services publish ``{'event': ..., 'data': json}`` while ``drive_events``
+    (and the tests) put ``event`` inside the JSON body. The outer ``event``
+    field is merged into the payload so handlers can rely on
+    ``data['event']`` for both shapes.
+    """
+    payload = json.loads(fields['data'])
+    if 'event' in fields:
+        payload.setdefault('event', fields['event'])
+    return payload
+
+
+class StreamConsumer:
+    """Read one Redis stream as a member of a consumer group.
+
+    Args:
+        client: Redis client created with ``decode_responses=True``.
+        stream: Stream to consume, e.g. ``rip_events``.
+        group: Consumer group name, normally the service name.
+        consumer: Consumer name; defaults to :func:`default_consumer_name`.
+        count: Maximum number of entries fetched per ``XREADGROUP`` call.
+        block_ms: How long a read blocks waiting for new entries.
+        claim_idle_ms: Idle time after which another consumer's pending
+            entry is considered abandoned and claimed.
+        start_id: Position a newly created group starts from.
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        stream: str,
+        group: str,
+        consumer: Optional[str] = None,
+        count: int = 10,
+        block_ms: int = 1000,
+        claim_idle_ms: int = 300_000,
+        start_id: str = '0',
+    ) -> None:
+        self.client = client
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer or default_consumer_name()
+        self.count = count
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.start_id = start_id
+        self._in_flight: Set[str] = set()
+        self._lock = threading.Lock()
+        # Position while replaying our own pending entries; None once done
+        self._pending_cursor: Optional[str] = '0'
+        # XAUTOCLAIM position; Redis returns '0-0' once the PEL was scanned
+        self._claim_cursor = '0-0'
+        self._next_claim = 0.0
+        self._heartbeat: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls, client: redis.Redis, stream: str, group: str) -> 'StreamConsumer':
+        """Build a consumer configured through the ``STREAM_*`` env vars."""
+        return cls(
+            client,
+            stream,
+            os.getenv('CONSUMER_GROUP', group),
+            count=int(os.getenv('STREAM_BATCH_COUNT', '10')),
+            block_ms=int(os.getenv('STREAM_BLOCK_MS', '1000')),
+            claim_idle_ms=int(os.getenv('STREAM_CLAIM_IDLE_MS', '300000')),
+            start_id=os.getenv('STREAM_GROUP_START_ID', '0'),
+        )
+
+    def ensure_group(self) -> None:
+        """Create the consumer group (and the stream) if it does not exist."""
+        try:
+            self.client.xgroup_create(self.stream, self.group, id=self.start_id, mkstream=True)
+            logger.info("Created consumer group %s on %s", self.group, self.stream)
+        except redis.ResponseError as err:
+            if 'BUSYGROUP' not in str(err):
+                raise
+
+    def _decode(self, entries: List[Tuple[str, Dict[str, str]]]) -> List[Message]:
+        """Decode entries, acknowledging any that cannot be parsed."""
+        messages: List[Message] = []
+        for msg_id, fields in entries:
+            if not fields:  # Entry was trimmed while pending
+                self.client.xack(self.stream, self.group, msg_id)
+                continue
+            try:
+                payload = decode_message(fields)
+            except (KeyError, TypeError, json.JSONDecodeError) as err:
+                logger.error("Dropping malformed entry %s on %s: %s", msg_id, self.stream, err)
+                self.client.xack(self.stream, self.group, msg_id)
+                continue
+            with self._lock:
+                self._in_flight.add(msg_id)
+            messages.append((msg_id, payload))
+        return messages
+
+    def _read_own_pending(self) -> List[Message]:
+        """Return entries delivered to this consumer name but never acked."""
+        response = self.client.xreadgroup(
+            self.group, self.consumer, {self.stream: self._pending_cursor}, count=self.count
+        )
+        entries = response[0][1] if response else []
+        self._pending_cursor = entries[-1][0] if entries else None
+        if entries:
+            logger.info("Recovered %d pending entries on %s", len(entries), self.stream)
+        return self._decode(entries)
+
+    def _claim_abandoned(self) -> List[Message]:
+        """Take over entries other consumers left idle for too long."""
+        now = time.monotonic()
+        if now < self._next_claim:
+            return []
+        response = self.client.xautoclaim(
+            self.stream, self.group, self.consumer,
+            min_idle_time=self.claim_idle_ms, start_id=self._claim_cursor, count=self.count
+        )
+        entries = self._advance_claim(response)
+        if entries:
+            logger.info("Claimed %d abandoned entries on %s", len(entries), self.stream)
+        return self._decode(entries)
+
+    def _advance_claim(self, response: Any) -> List[Tuple[str, Dict[str, str]]]:
+        """Store the cursor returned by ``XAUTOCLAIM`` and return its entries.
+
+        A pending list longer than ``count`` is scanned over several reads;
+        the next claim round is only scheduled once Redis wraps to ``0-0``.
+        """
+        self._claim_cursor = response[0] if response else '0-0'
+        if self._claim_cursor == '0-0':
+            self._next_claim = time.monotonic() + min(self.claim_idle_ms / 2000.0, 30.0)
+        return response[1] if response else []
+
+    def _reset_group(self, err: redis.ResponseError) -> bool:
+        """Return True if *err* means the group is gone and reading may restart.
+
+        A ``NOGROUP`` error follows a stream reset or ``FLUSHALL``; the read
+        positions are reset so the recreated group is consumed from the start.
+        """
+        if 'NOGROUP' not in str(err):
+            return False
+        logger.error("Consumer group %s on %s disappeared, recreating it", self.group, self.stream)
+        self._pending_cursor = '0'
+        self._claim_cursor = '0-0'
+        return True
+
+    def read(self) -> List[Message]:
+        """Fetch the next batch: own pending first, then abandoned, then new."""
+        if self._pending_cursor == '0':
+            self.ensure_group()
+        if self._pending_cursor is not None:
+            pending = self._read_own_pending()
+            if pending:
+                return pending
+        claimed = self._claim_abandoned()
+        if claimed:
+            return claimed
+        response = self.client.xreadgroup(
+            self.group, self.consumer, {self.stream: '>'},
+            count=self.count, block=self.block_ms
+        )
+        return self._decode(response[0][1] if response else [])
+
+    def ack(self, msg_id: str) -> None:
+        """Acknowledge *msg_id* once the work it triggered has finished."""
+        try:
+            self.client.xack(self.stream, self.group, msg_id)
+        finally:
+            self.release(msg_id)
+
+    def release(self, msg_id: str) -> None:
+        """Stop the heartbeat for *msg_id* without acknowledging it.
+
+        The entry stays pending and becomes claimable once idle, instead of
+        being kept alive forever by :meth:`touch`.
+        """
+        with self._lock:
+            self._in_flight.discard(msg_id)
+
+    def touch(self) -> None:
+        """Reset the idle time of in-flight entries so they are not claimed.
+
+        Jobs such as a Real-ESRGAN pass can run far longer than
+        ``claim_idle_ms``; re-claiming our own entries keeps other replicas
+        from stealing them while we are still working.
+        """
+        with self._lock:
+            ids = list(self._in_flight)
+        if ids:
+            self.client.xclaim(
+                self.stream, self.group, self.consumer,
+                min_idle_time=0, message_ids=ids, justid=True
+            )
+
+    def start_heartbeat(self) -> None:
+        """Start a daemon thread calling :meth:`touch` periodically."""
+        if self._heartbeat is not None:
+            return
+        interval = max(self.claim_idle_ms / 3000.0, 1.0)
+
+        def _beat() -> None:
+            while True:
+                time.sleep(interval)
+                try:
+                    self.touch()
+                except redis.RedisError as err:
+                    logger.error("Heartbeat failed on %s: %s", self.stream, err)
+
+        self._heartbeat = threading.Thread(target=_beat, daemon=True)
+        self._heartbeat.start()
+
+    def acking(self, msg_id: str, func: Callable[..., Any]) -> Callable[..., Any]:
+        """Wrap *func* so that *msg_id* is acknowledged when it returns.
+
+        Used by workers that hand events to background threads: the entry
+        stays pending (and is recovered after a crash) until the job ends.
+        """
+        def _wrapped(*args: Any, **kwargs: Any) -> Any:
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.ack(msg_id)
+        return _wrapped
+
+    def messages(self) -> Iterator[Message]:
+        """Yield messages forever, backing off on connection errors and recreating a lost group."""
+        self.start_heartbeat()
+        while True:
+            try:
+                batch = self.read()
+            except (redis.ConnectionError, redis.TimeoutError) as err:
+                logger.error("Error reading %s: %s", self.stream, err)
+                time.sleep(1)
+                continue
+            except redis.ResponseError as err:
+                if not self._reset_group(err):
+                    raise
+                continue
+            yield from batch
+
+    def run(self, handler: Callable[[Dict[str, Any]], None]) -> None:
+        """Process messages synchronously, acknowledging each after *handler*."""
+        for msg_id, payload in self.messages():
+            try:
+                handler(payload)
+            except Exception as err:  # pylint: disable=broad-except
+                # Leave the entry pending so it is retried after a restart
+                logger.error("Handler failed for %s on %s: %s", msg_id, self.stream, err)
+                self.release(msg_id)
+                continue
+            self.ack(msg_id)
@@ -0,0 +1,370 @@
+"""Per-job traces across the pipeline's event streams.
+
+A disc passes through six streams and as many services, so finding where a
+job's time went meant lining up timestamps from every container's log. Each
+event now carries its trace context in the ``data`` JSON::
+
+    "trace": {"trace_id": "...", "span_id": "...", "sent_at": 1712345678.9}
+
+A worker handles an event inside a span (:meth:`Tracer.span`, or the
+:meth:`Tracer.traced` wrapper) that continues the event's trace. The span
+records when the event was sent, when handling started and when it ended,
+which gives the stage's queue wait and processing time.
+:class:`~riparr_common.publisher.EventPublisher` adds the current span's
+context to every event it publishes, except progress events.
+
+Finished spans are exported to the ``traces`` Redis stream and to a per-job
+list ``trace:<job_id>`` (``TRACE_EXPORT=redis``, the default), appended to a
+JSON lines file (``TRACE_EXPORT=file``, path in ``TRACE_FILE``), or dropped
+(``off``). Render a job's waterfall with::
+
+    python -m riparr_common.tracing waterfall <job_id>
+    python -m riparr_common.tracing waterfall <job_id> --file /logs/traces.jsonl
+    python -m riparr_common.tracing spans <job_id>
+"""
+
+import argparse
+import asyncio
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence
+
+import redis
+
+from riparr_common.job_control import JobCancelled
+
+logger = logging.getLogger(__name__)
+
+TRACE_FIELD = 'trace'
+TRACE_STREAM = 'traces'
+
+_current: 'contextvars.ContextVar[Optional[Span]]' = contextvars.ContextVar(
+    'riparr_span', default=None)
+
+
+def new_id(length: int = 16) -> str:
+    """Return a random hex id (16 characters for spans, 32 for traces)."""
+    return uuid.uuid4().hex[:length]
+
+
+class Span:
+    """One stage's handling of one event.
+
+    Args:
+        name: Stage name, e.g. ``enhance``.
+        service: Worker that handled the event.
+        trace_id: Trace the span belongs to.
+        parent_id: Span that published the event, if known.
+        queued_at: When the event was published (epoch seconds), if known.
+        job_id: Pipeline job the event belongs to.
+        event: Type of the handled event.
+    """
+
+    def __init__(self, name: str, service: str, trace_id: str,
+                 parent_id: Optional[str] = None, queued_at: Optional[float] = None,
+                 job_id: Optional[str] = None, event: Optional[str] = None) -> None:
+        self.name = name
+        self.service = service
+        self.trace_id = trace_id
+        self.span_id = new_id()
+        self.parent_id = parent_id
+        self.queued_at = queued_at
+        self.job_id = job_id
+        self.event = event
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.status = 'ok'
+        self.attrs: Dict[str, Any] = {}
+
+    def set(self, **attrs: Any) -> None:
+        """Attach attributes; ``job_id`` sets the span's job."""
+        if 'job_id' in attrs:
+            self.job_id = attrs.pop('job_id')
+        self.attrs.update(attrs)
+
+    def context(self) -> Dict[str, Any]:
+        """Return the context carried by events this span publishes."""
+        return {'trace_id': self.trace_id, 'span_id': self.span_id, 'sent_at': time.time()}
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the exported form of the span."""
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'service': self.service,
+            'job_id': self.job_id,
+            'event': self.event,
+            'queued_at': self.queued_at,
+            'start': self.start,
+            'end': self.end,
+            'status': self.status,
+            'attrs': self.attrs,
+        }
+
+
+def current_span() -> Optional[Span]:
+    """Return the span of the event being handled, if any."""
+    return _current.get()
+
+
+def annotate(**attrs: Any) -> None:
+    """Attach attributes to the current span, if any."""
+    span = _current.get()
+    if span is not None:
+        span.set(**attrs)
+
+
+def inject(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Return *payload* carrying the current span's context.
+
+    A payload that already has a context, or one published outside a span,
+    is returned unchanged.
+    """
+    span = _current.get()
+    if span is None or TRACE_FIELD in payload:
+        return payload
+    return {**payload, TRACE_FIELD: span.context()}
+
+
+def extract(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the trace context of a received event (empty if it has none)."""
+    context = data.get(TRACE_FIELD)
+    return context if isinstance(context, dict) and context.get('trace_id') else {}
+
+
+class RedisExporter:
+    """Append spans to the ``traces`` stream and the job's ``trace:<job_id>`` list.
+
+    Args:
+        client: Redis client.
+        stream: Stream every span is added to.
+        ttl: Seconds a job's span list is kept after its last span.
+    """
+
+    PREFIX = 'trace:'
+
+    def __init__(self, client: redis.Redis, stream: str = TRACE_STREAM,
+                 ttl: int = 7 * 24 * 3600) -> None:
+        self.client = client
+        self.stream = stream
+        self.ttl = ttl
+
+    def export(self, span: Dict[str, Any]) -> None:
+        """Write one finished span in a single round trip."""
+        encoded = json.dumps(span)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.xadd(self.stream, {'data': encoded})
+        if span.get('job_id'):
+            key = self.PREFIX + span['job_id']
+            pipe.rpush(key, encoded)
+            pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def load(self, job_id: str) -> List[Dict[str, Any]]:
+        """Return the spans recorded for *job_id*."""
+        return [json.loads(item) for item in self.client.lrange(self.PREFIX + job_id, 0, -1)]
+
+
+class FileExporter:
+    """Append spans to a JSON lines file."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span: Dict[str, Any]) -> None:
+        """Append one finished span."""
+        line = json.dumps(span) + '\n'
+        with self._lock, open(self.path, 'a', encoding='utf-8') as handle:
+            handle.write(line)
+
+    def load(self, job_id: str) -> List[Dict[str, Any]]:
+        """Return the spans recorded for *job_id*."""
+        spans = []
+        with open(self.path, encoding='utf-8') as handle:
+            for line in handle:
+                try:
+                    span = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # A line cut short by a crash
+                if span.get('job_id') == job_id:
+                    spans.append(span)
+        return spans
+
+
+class Tracer:
+    """Record spans of one worker.
+
+    Args:
+        service: Worker name stored on every span.
+        exporter: :class:`RedisExporter` or :class:`FileExporter`; ``None``
+            keeps propagating context but records nothing.
+    """
+
+    def __init__(self, service: str, exporter: Any = None) -> None:
+        self.service = service
+        self.exporter = exporter
+
+    @classmethod
+    def from_env(cls, client: redis.Redis, service: str) -> 'Tracer':
+        """Build a tracer exporting as configured by ``TRACE_*`` env vars."""
+        mode = os.getenv('TRACE_EXPORT', 'redis').lower()
+        exporter: Any = None
+        if mode == 'redis':
+            exporter = RedisExporter(client, os.getenv('TRACE_STREAM', TRACE_STREAM),
+                                     ttl=int(os.getenv('TRACE_TTL', str(7 * 24 * 3600))))
+        elif mode == 'file':
+            exporter = FileExporter(os.getenv('TRACE_FILE', '/logs/traces.jsonl'))
+        return cls(service, exporter)
+
+    @contextlib.contextmanager
+    def span(self, name: str, data: Optional[Dict[str, Any]] = None,
+             export: bool = True) -> Iterator[Span]:
+        """Handle the event *data* inside a span continuing its trace.
+
+        With *export* False the caller exports the finished span itself.
+        """
+        data = data or {}
+        context = extract(data)
+        span = Span(name, self.service, context.get('trace_id') or new_id(32),
+                    parent_id=context.get('span_id'), queued_at=context.get('sent_at'),
+                    job_id=data.get('job_id'), event=data.get('event'))
+        token = _current.set(span)
+        try:
+            yield span
+        except JobCancelled:
+            span.status = 'cancelled'
+            raise
+        except BaseException:
+            span.status = 'error'
+            raise
+        finally:
+            span.end = time.time()
+            _current.reset(token)
+            if export:
+                self._export(span)
+
+    def _export(self, span: Span) -> None:
+        """Export *span*; a failing exporter never fails the job."""
+        if self.exporter is None:
+            return
+        try:
+            self.exporter.export(span.to_dict())
+        except (OSError, redis.RedisError) as err:
+            logger.error("Could not export span of job %s: %s", span.job_id, err)
+
+    def traced(self, name: str, func: Callable[..., Any],
+               events: Optional[Sequence[str]] = None) -> Callable[..., Any]:
+        """Wrap the handler ``func(data, ...)`` so that each call runs in a span.
+
+        With *events*, only those event types are traced.
+        """
+        @functools.wraps(func)
+        def _wrapped(data: Dict[str, Any], *args: Any, **kwargs: Any) -> Any:
+            if events is not None and data.get('event') not in events:
+                return func(data, *args, **kwargs)
+            with self.span(name, data):
+                return func(data, *args, **kwargs)
+        return _wrapped
+
+    def traced_async(self, name: str,
+                     func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        """Coroutine version of :meth:`traced`; spans are exported off the event loop."""
+        @functools.wraps(func)
+        async def _wrapped(data: Dict[str, Any], *args: Any, **kwargs: Any) -> Any:
+            span = None
+            try:
+                with self.span(name, data, export=False) as span:
+                    return await func(data, *args, **kwargs)
+            finally:
+                if span is not None:
+                    await asyncio.shield(asyncio.to_thread(self._export, span))
+        return _wrapped
+
+
+def format_duration(seconds: float) -> str:
+    """Format *seconds* as ``4.2s``, ``12m05s`` or ``2h03m``."""
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    minutes, secs = divmod(int(seconds), 60)
+    if minutes < 60:
+        return f"{minutes}m{secs:02d}s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m"
+
+
+def waterfall(spans: List[Dict[str, Any]], width: int = 50) -> str:
+    """Render *spans* as a waterfall of queue wait (``·``) and processing (``█``)."""
+    # Rows of (queued, start, end, span); a span without a send time starts unqueued
+    rows = sorted(((min(s.get('queued_at') or s['start'], s['start']), s['start'], s['end'], s)
+                   for s in spans if s.get('end')), key=lambda row: row[:2])
+    if not rows:
+        return "No spans recorded"
+    origin = rows[0][0]
+    total = max(row[2] for row in rows) - origin or 1e-9
+    trace_ids = sorted({row[3]['trace_id'] for row in rows})
+
+    def column(moment: float) -> int:
+        return min(width, round((moment - origin) / total * width))
+
+    lines = [f"Job {rows[0][3].get('job_id')}  trace {', '.join(trace_ids)}  "
+             f"{len(rows)} spans, {format_duration(total)} end to end",
+             f"{'stage':<10} {'event':<15} {'wait':>8} {'run':>8}  timeline"]
+    totals: Dict[str, List[float]] = {}
+    for queued, start, end, span in rows:
+        bar = [' '] * width
+        started = min(column(start), width - 1)
+        for i in range(column(queued), started):
+            bar[i] = '·'
+        # Every span gets at least one column, however short it ran
+        for i in range(started, max(column(end), started + 1)):
+            bar[i] = '█'
+        status = '' if span.get('status') == 'ok' else f" {span.get('status')}"
+        lines.append(f"{span['name']:<10} {str(span.get('event') or ''):<15} "
+                     f"{format_duration(start - queued):>8} {format_duration(end - start):>8}  "
+                     f"|{''.join(bar)}|{status}")
+        stage = totals.setdefault(span['name'], [0.0, 0.0])
+        stage[0] += start - queued
+        stage[1] += end - start
+    lines.append('')
+    lines.append(f"{'stage':<10} {'total wait':>12} {'total run':>12}")
+    for name, (wait, run) in totals.items():
+        lines.append(f"{name:<10} {format_duration(wait):>12} {format_duration(run):>12}")
+    return '\n'.join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Show the trace of a Riparr job.")
+    parser.add_argument('--redis-url', default=os.getenv('REDIS_URL', 'redis://localhost:6379'))
+    parser.add_argument('--file', help="read spans from this JSON lines file instead of Redis")
+    commands = parser.add_subparsers(dest='command', required=True)
+    for command, text in (('waterfall', "render queue wait and run time per stage"),
+                          ('spans', "print the recorded spans as JSON")):
+        commands.add_parser(command, help=text).add_argument('job_id')
+    args = parser.parse_args(argv)
+
+    if args.file:
+        exporter: Any = FileExporter(args.file)
+    else:
+        exporter = RedisExporter(redis.from_url(args.redis_url, decode_responses=True))
+    spans = exporter.load(args.job_id)
+    if not spans:
+        parser.exit(1, f"No spans recorded for job {args.job_id}\n")
+    if args.command == 'spans':
+        print(json.dumps(spans, indent=2, sort_keys=True))
+    else:
+        print(waterfall(spans))
+
+
+if __name__ == '__main__':
+    main()
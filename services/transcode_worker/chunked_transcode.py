@@ -0,0 +1,218 @@
+"""Segment-parallel transcoding for the Transcode Worker.
+
+A single ffmpeg process encoding a whole feature with ``libx265`` leaves most
+cores idle. The chunked mode instead:
+
+1. splits the video stream at keyframes with a stream copy (no re-encode),
+2. encodes the segments concurrently, one ffmpeg process per segment, with a
+   pool sized to the available cores,
+3. encodes the audio once from the original input, in parallel with the video,
+4. concatenates the encoded segments losslessly and muxes them with the audio
+   and subtitles of the source.
+
+Progress of all segment encoders is aggregated into a single percentage.
+A source with audio whose audio encode fails fails the whole transcode
+rather than producing a silent file.
+"""
+
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+Popen = Callable[..., subprocess.Popen]
+
+TIME_RE = re.compile(r'time=(\d+):(\d+):(\d+\.\d+)')
+
+
+def parse_time(line: str) -> Optional[float]:
+    """Return the ``time=`` position in seconds from an ffmpeg stats line."""
+    match = TIME_RE.search(line)
+    if not match:
+        return None
+    h, m, s = map(float, match.groups())
+    return h * 3600 + m * 60 + s
+
+
+def default_workers() -> int:
+    """Number of concurrent segment encoders when none is configured."""
+    return max(2, (os.cpu_count() or 2) // 2)
+
+
+def run_checked(popen: Popen, cmd: List[str], check: bool = False) -> int:
+    """Run *cmd* to completion through *popen*, like ``subprocess.run``."""
+    with popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as process:
+        _, stderr = process.communicate()
+    if check and process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stderr=stderr)
+    return process.returncode
+
+
+def has_audio_stream(input_file: str, popen: Popen = subprocess.Popen) -> bool:
+    """Return True if ffprobe finds an audio stream in *input_file*."""
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'a', '-show_entries', 'stream=index',
+           '-of', 'csv=p=0', input_file]
+    with popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True) as process:
+        stdout, stderr = process.communicate()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stderr=stderr)
+    return bool(stdout.strip())
+
+
+def split_at_keyframes(input_file: str, work_dir: str, segment_seconds: int,
+                       popen: Popen = subprocess.Popen) -> List[str]:
+    """Split the first video stream of *input_file* into keyframe-aligned segments."""
+    pattern = os.path.join(work_dir, 'seg_%05d.mkv')
+    cmd = [
+        'ffmpeg', '-v', 'error', '-y', '-i', input_file,
+        '-map', '0:v:0', '-c', 'copy',
+        '-f', 'segment', '-segment_time', str(segment_seconds),
+        '-segment_format', 'matroska', '-reset_timestamps', '1',
+        pattern
+    ]
+    run_checked(popen, cmd, check=True)
+    return sorted(
+        os.path.join(work_dir, f) for f in os.listdir(work_dir)
+        if f.startswith('seg_') and f.endswith('.mkv')
+    )
+
+
+def _run_ffmpeg(cmd: List[str], on_time: Optional[Callable[[float], None]] = None,
+                popen: Popen = subprocess.Popen) -> bool:
+    """Run ffmpeg, forwarding ``time=`` positions to *on_time*."""
+    with popen(
+        cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    ) as process:
+        for line in iter(process.stderr.readline, ''):
+            if on_time is not None:
+                position = parse_time(line)
+                if position is not None:
+                    on_time(position)
+        process.wait()
+    return process.returncode == 0
+
+
+def segment_video_args(video_args: List[str], threads: int) -> List[str]:
+    """Limit each segment encoder to its share of the cores."""
+    if 'libx265' in video_args:
+        return video_args + ['-x265-params', f'pools={threads}']
+    return video_args + ['-threads', str(threads)]
+
+
+def transcode_chunked(
+    input_file: str,
+    output_file: str,
+    video_args: List[str],
+    audio_args: List[str],
+    duration: Optional[float],
+    on_progress: Optional[Callable[[int], None]] = None,
+    workers: Optional[int] = None,
+    segment_seconds: int = 120,
+    popen: Popen = subprocess.Popen,
+    render_node: Optional[str] = None,
+    expect_audio: Optional[bool] = None,
+) -> bool:
+    """Transcode *input_file* by encoding keyframe-aligned segments in parallel.
+
+    Args:
+        input_file: Source media file.
+        output_file: Destination file; written only when every step succeeds.
+        video_args: Encoder arguments, e.g. ``['-c:v', 'libx265', '-crf', '28']``.
+        audio_args: Audio encoder arguments applied once to the whole input.
+        duration: Source duration in seconds, used for progress reporting.
+        on_progress: Called with the aggregated percentage as it increases.
+        workers: Concurrent segment encoders; defaults to :func:`default_workers`.
+        segment_seconds: Target segment length (segments end on keyframes).
+        popen: Starts every ffmpeg process, e.g. a job's
+            :meth:`JobControl.popen <riparr_common.job_control.JobControl.popen>`.
+        render_node: VAAPI device the segment encoders run on; *video_args*
+            must then upload the decoded frames (``format=nv12,hwupload``).
+        expect_audio: Whether the source has audio, e.g. from a cached probe;
+            ``None`` runs ffprobe.
+
+    Returns:
+        ``True`` if the output file was produced.
+    """
+    workers = workers or default_workers()
+    threads = max(1, (os.cpu_count() or workers) // workers)
+    work_dir = tempfile.mkdtemp(
+        prefix='.chunks_', dir=os.path.dirname(os.path.abspath(output_file))
+    )
+    positions: Dict[int, float] = {}
+    lock = threading.Lock()
+    reported = [-1]
+
+    def _on_time(index: int, position: float) -> None:
+        if not duration or on_progress is None:
+            return
+        with lock:
+            positions[index] = position
+            percentage = min(int(sum(positions.values()) / duration * 100), 99)
+            if percentage <= reported[0]:
+                return
+            reported[0] = percentage
+        on_progress(percentage)
+
+    try:
+        if expect_audio is None:
+            expect_audio = has_audio_stream(input_file, popen)
+        segments = split_at_keyframes(input_file, work_dir, segment_seconds, popen)
+        if not segments:
+            return False
+
+        audio_file = os.path.join(work_dir, 'audio.mka')
+        encoded = [os.path.join(work_dir, f'enc_{i:05d}.mkv') for i in range(len(segments))]
+        args = segment_video_args(video_args, threads)
+        device = ['-vaapi_device', render_node] if render_node else []
+
+        with ThreadPoolExecutor(max_workers=workers + 1) as pool:
+            audio_future = pool.submit(_run_ffmpeg, [
+                'ffmpeg', '-y', '-i', input_file, '-vn', '-sn', *audio_args, audio_file
+            ], None, popen)
+            # Each thread only supervises its own ffmpeg process
+            video_futures = [
+                pool.submit(
+                    _run_ffmpeg,
+                    ['ffmpeg', '-y', *device, '-i', segment, '-an', '-sn', *args, target],
+                    lambda position, index=i: _on_time(index, position),
+                    popen
+                )
+                for i, (segment, target) in enumerate(zip(segments, encoded))
+            ]
+            if not all(f.result() for f in video_futures):
+                return False
+            has_audio = audio_future.result() and os.path.exists(audio_file)
+            if expect_audio and not has_audio:
+                logger.error("Audio encode failed for %s", input_file)
+                return False
+
+        concat_list = os.path.join(work_dir, 'concat.txt')
+        with open(concat_list, 'w', encoding='utf-8') as fp:
+            for path in encoded:
+                fp.write(f"file '{path}'\n")
+
+        cmd = ['ffmpeg', '-v', 'error', '-y', '-f', 'concat', '-safe', '0', '-i', concat_list]
+        if has_audio:
+            cmd.extend(['-i', audio_file])
+        cmd.extend(['-i', input_file, '-map', '0:v'])
+        if has_audio:
+            cmd.extend(['-map', '1:a'])
+        cmd.extend(['-map', f'{2 if has_audio else 1}:s:0?', '-c', 'copy', output_file])
+        if run_checked(popen, cmd) != 0:
+            return False
+
+        if on_progress is not None:
+            on_progress(100)
+        return True
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.error("Chunked transcode failed for %s: %s", input_file, e)
+        return False
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
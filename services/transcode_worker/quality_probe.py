@@ -0,0 +1,254 @@
+"""Content-adaptive encoder quality for the Transcode Worker.
+
+``TRANSCODE_PROFILE`` maps every title to the same fixed quality, so easy
+content (animation, static shots) gets more bits and slower encodes than it
+needs. In adaptive mode the worker instead:
+
+1. cuts a few short samples spread over the title with a stream copy,
+2. encodes them at candidate quality values (``-crf`` for libx265,
+   ``-global_quality`` for VAAPI) and scores each encode against its sample
+   with ffmpeg's ``ssim`` or ``psnr`` filter,
+3. picks the cheapest candidate whose worst sample still meets the target,
+   with a binary search over the candidates (quality falls as they rise).
+
+The choice is cached in Redis per input fingerprint, encoder and search
+settings, so a re-encode of the same file skips the search.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import redis
+
+from riparr_common.checkpoints import input_fingerprint
+
+logger = logging.getLogger(__name__)
+
+Popen = Callable[..., subprocess.Popen]
+
+DEFAULT_TARGETS = {'ssim': 0.98, 'psnr': 40.0}
+
+SCORE_RE = {
+    'ssim': re.compile(r'SSIM .*All:(inf|[\d.]+)'),
+    'psnr': re.compile(r'PSNR .*average:(inf|[\d.]+)'),
+}
+
+
+def parse_score(metric: str, output: str) -> Optional[float]:
+    """Return the overall *metric* score from ffmpeg's stderr *output*."""
+    match = SCORE_RE[metric].search(output)
+    return float(match.group(1)) if match else None
+
+
+def sample_positions(duration: Optional[float], count: int, seconds: float) -> List[float]:
+    """Return start offsets of *count* samples spread evenly over *duration*."""
+    if not duration or duration <= seconds * count:
+        return [0.0]
+    step = duration / (count + 1)
+    return [round(min(max(step * (i + 1) - seconds / 2, 0.0), duration - seconds), 3)
+            for i in range(count)]
+
+
+def _run(popen: Popen, cmd: List[str]) -> str:
+    """Run ffmpeg *cmd* through *popen* and return its stderr."""
+    with popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True) as process:
+        _, stderr = process.communicate()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stderr=stderr)
+    return stderr
+
+
+def cut_samples(input_file: str, work_dir: str, positions: Sequence[float], seconds: float,
+                popen: Popen = subprocess.Popen) -> List[str]:
+    """Copy the first video stream of *input_file* at *positions* into sample files."""
+    samples = []
+    for i, position in enumerate(positions):
+        sample = os.path.join(work_dir, f'sample_{i:02d}.mkv')
+        _run(popen, [
+            'ffmpeg', '-v', 'error', '-y', '-ss', str(position), '-i', input_file,
+            '-t', str(seconds), '-map', '0:v:0', '-c', 'copy',
+            '-avoid_negative_ts', 'make_zero', sample
+        ])
+        if os.path.getsize(sample) > 0:
+            samples.append(sample)
+    return samples
+
+
+def encode_score(sample: str, video_args: List[str], metric: str, work_dir: str,
+                 input_args: Sequence[str] = (), popen: Popen = subprocess.Popen) -> float:
+    """Encode *sample* with *video_args* and return the encode's *metric* score.
+
+    Raises:
+        subprocess.CalledProcessError: If an ffmpeg run fails.
+        ValueError: If ffmpeg printed no score.
+    """
+    encoded = os.path.join(work_dir, 'encoded.mkv')
+    _run(popen, ['ffmpeg', '-v', 'error', '-y', *input_args, '-i', sample,
+                 '-an', '-sn', *video_args, encoded])
+    # Frames are paired by index: millisecond container timestamps of the
+    # sample and its encode can round apart and misalign the comparison
+    output = _run(popen, [
+        'ffmpeg', '-hide_banner', '-nostats', '-i', encoded, '-i', sample,
+        '-lavfi', f'[0:v]format=yuv420p,setpts=N[enc];[1:v]format=yuv420p,setpts=N[ref];'
+                  f'[enc][ref]{metric}',
+        '-f', 'null', '-'
+    ])
+    score = parse_score(metric, output)
+    if score is None:
+        raise ValueError(f"no {metric} score for {sample}")
+    return score
+
+
+def search_quality(candidates: Sequence[int], score: Callable[[int], float],
+                   target: float) -> Tuple[int, Dict[int, float]]:
+    """Return the highest candidate scoring at least *target*, and the scores measured.
+
+    Scores are assumed to fall as the candidate value rises, so only about
+    ``log2(len(candidates))`` candidates are scored. If none meets the target
+    the lowest (best quality) candidate is returned.
+    """
+    candidates = sorted(set(candidates))
+    scores: Dict[int, float] = {}
+    best = None
+    low, high = 0, len(candidates) - 1
+    while low <= high:
+        middle = (low + high) // 2
+        scores[candidates[middle]] = score(candidates[middle])
+        if scores[candidates[middle]] >= target:
+            best = candidates[middle]
+            low = middle + 1
+        else:
+            high = middle - 1
+    return (candidates[0] if best is None else best), scores
+
+
+class QualityProbe:
+    """Sample-encode search for the encoder quality of a file, cached in Redis.
+
+    Args:
+        client: Redis client created with ``decode_responses=True``.
+        metric: ``ssim`` or ``psnr``.
+        target: Score every sample must reach; defaults per metric.
+        candidates: Quality values to search (higher is smaller and faster).
+        samples: Number of samples cut from each file.
+        sample_seconds: Length of each sample.
+        ttl: Seconds a cached choice lives after its last use.
+    """
+
+    PREFIX = 'quality_probe:'
+
+    def __init__(self, client: redis.Redis, metric: str = 'ssim',
+                 target: Optional[float] = None,
+                 candidates: Sequence[int] = (20, 22, 24, 26, 28, 30, 32, 34),
+                 samples: int = 3, sample_seconds: float = 4,
+                 ttl: int = 90 * 24 * 3600) -> None:
+        if metric not in SCORE_RE:
+            raise ValueError(f"unknown quality metric {metric!r}")
+        self.client = client
+        self.metric = metric
+        self.target = DEFAULT_TARGETS[metric] if target is None else target
+        self.candidates = sorted(set(candidates))
+        self.samples = samples
+        self.sample_seconds = sample_seconds
+        self.ttl = ttl
+
+    @classmethod
+    def from_env(cls, client: redis.Redis) -> 'QualityProbe':
+        """Build a probe from the ``QUALITY_*`` environment variables."""
+        target = os.getenv('QUALITY_TARGET')
+        candidates = os.getenv('QUALITY_CANDIDATES', '20,22,24,26,28,30,32,34')
+        return cls(
+            client,
+            metric=os.getenv('QUALITY_METRIC', 'ssim').lower(),
+            target=float(target) if target else None,
+            candidates=[int(value) for value in candidates.split(',') if value.strip()],
+            samples=int(os.getenv('QUALITY_SAMPLES', '3')),
+            sample_seconds=float(os.getenv('QUALITY_SAMPLE_SECONDS', '4')),
+            ttl=int(os.getenv('QUALITY_CACHE_TTL', str(90 * 24 * 3600)))
+        )
+
+    def settings(self) -> Dict[str, Any]:
+        """Return the search settings that decide the chosen quality."""
+        return {'metric': self.metric, 'target': self.target, 'candidates': self.candidates,
+                'samples': self.samples, 'sample_seconds': self.sample_seconds}
+
+    def _key(self, fingerprint: str, encoder: str) -> str:
+        """Cache key for a file *fingerprint* encoded with *encoder*."""
+        identity = f"{fingerprint}|{encoder}|{json.dumps(self.settings(), sort_keys=True)}"
+        return self.PREFIX + hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+    def _cached(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached choice under *key*, if any."""
+        try:
+            cached = self.client.getex(key, ex=self.ttl)
+            return json.loads(cached) if cached else None
+        except (redis.RedisError, json.JSONDecodeError) as err:
+            logger.error("Quality cache lookup failed: %s", err)
+            return None
+
+    def choose(self, input_file: str, duration: Optional[float],
+               video_args: Callable[[int], List[str]], encoder: str,
+               input_args: Sequence[str] = (),
+               popen: Popen = subprocess.Popen) -> Optional[Dict[str, Any]]:
+        """Return the cheapest quality for *input_file* that meets the target.
+
+        Args:
+            input_file: Source media file.
+            duration: Source duration in seconds, used to place the samples.
+            video_args: Returns the encoder arguments for a quality value.
+            encoder: Encoder name, part of the cache key since quality scales
+                differ between encoders.
+            input_args: ffmpeg arguments placed before each sample input,
+                e.g. the VAAPI device.
+            popen: Starts every ffmpeg process, e.g. a job's
+                :meth:`JobControl.popen <riparr_common.job_control.JobControl.popen>`.
+
+        Returns:
+            ``{"quality", "score", "scores", "cached"}``, or ``None`` if the
+            search failed and the profile's quality should be used.
+        """
+        try:
+            key = self._key(input_fingerprint(input_file), encoder)
+        except OSError as err:
+            logger.error("Cannot fingerprint %s: %s", input_file, err)
+            return None
+        cached = self._cached(key)
+        if cached:
+            return {**cached, 'cached': True}
+
+        # Samples are a few seconds each, small enough for the temp directory
+        work_dir = tempfile.mkdtemp(prefix='quality_')
+        try:
+            samples = cut_samples(input_file, work_dir,
+                                  sample_positions(duration, self.samples, self.sample_seconds),
+                                  self.sample_seconds, popen)
+            if not samples:
+                return None
+
+            def _score(quality: int) -> float:
+                # The worst sample decides, so no part of the title falls short
+                return min(encode_score(sample, video_args(quality), self.metric, work_dir,
+                                        input_args, popen)
+                           for sample in samples)
+
+            quality, scores = search_quality(self.candidates, _score, self.target)
+        except (OSError, subprocess.CalledProcessError, ValueError) as err:
+            logger.error("Quality search failed for %s: %s", input_file, err)
+            return None
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        result = {'quality': quality, 'score': scores.get(quality),
+                  'scores': {str(value): score for value, score in scores.items()}}
+        try:
+            self.client.set(key, json.dumps(result), ex=self.ttl)
+        except redis.RedisError as err:
+            logger.error("Quality cache store failed: %s", err)
+        return {**result, 'cached': False}
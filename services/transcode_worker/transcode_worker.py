@@ -1,17 +1,35 @@
 """Transcode Worker service.
 
 Monitors enhance events and processes video transcoding using FFmpeg with VAAPI.
+With ``WORKER_RUNTIME=asyncio`` jobs run as tasks on one event loop. With
+``TRANSCODE_QUALITY=adaptive`` each file's quality is picked by sample encodes
+(see :mod:`quality_probe`).
 """
+import asyncio
+import contextlib
+import functools
 import json
 import os
 import sys
 import subprocess
-import threading
 import time
-import re
 
 import redis
 
+from chunked_transcode import parse_time, transcode_chunked
+from quality_probe import QualityProbe
+from riparr_common import aio
+from riparr_common.checkpoints import CheckpointStore, remove_partials
+from riparr_common.encoding import audio_encoder_args, video_encoder_args
+from riparr_common.executor import JobExecutor, size_priority
+from riparr_common.gpu_scheduler import GpuScheduler
+from riparr_common.job_control import JobControl
+from riparr_common import metrics
+from riparr_common.probe import ProbeCache, audio_streams, duration, estimate_frames
+from riparr_common.publisher import EventPublisher
+from riparr_common.streams import StreamConsumer
+from riparr_common.tracing import Tracer
+
 # Check if service is enabled
 enable = os.getenv('ENABLE_TRANSCODE', 'false').lower() == 'true'
 if not enable:
@@ -21,130 +39,221 @@ if not enable:
 # Redis connection
 redis_url = os.getenv('REDIS_URL', 'redis://redis:6379')
 r = redis.from_url(redis_url, decode_responses=True)
+probe_cache = ProbeCache.from_env(r)
+gpu_scheduler = GpuScheduler.from_env(r)
+publisher = EventPublisher.from_env(r)
+job_control = JobControl(r, 'transcode_events', publisher)
+checkpoints = CheckpointStore.from_env(r, 'transcode')
+tracer = Tracer.from_env(r, 'transcode-worker')
+quality_probe = QualityProbe.from_env(r)
 
 # Config
 vaapi_profile = os.getenv('VAAPI_PROFILE', 'hevc_vaapi')
 transcode_profile = os.getenv('TRANSCODE_PROFILE', 'high')  # high, medium, low
+# fixed (the profile's quality) or adaptive (searched per file with sample encodes)
+transcode_quality = os.getenv('TRANSCODE_QUALITY', 'fixed')
 enhanced_output_dir = os.getenv('ENHANCED_OUTPUT_DIR', '/data/enhanced')
 transcoded_output_dir = os.getenv('TRANSCODED_OUTPUT_DIR', '/data/transcoded')
 cpu_fallback = os.getenv('CPU_FALLBACK', 'false').lower() == 'true'
 audio_format = os.getenv('AUDIO_FORMAT', 'aac')  # aac or opus for stereo
+# single, chunked (segment-parallel) or auto (chunked on CPU fallback)
+transcode_mode = os.getenv('TRANSCODE_MODE', 'auto')
+chunk_seconds = int(os.getenv('CHUNK_SECONDS', '120'))
+chunk_workers = int(os.getenv('CHUNK_WORKERS', '0'))  # 0 = sized to the CPU count
+transcode_vram_gb = float(os.getenv('TRANSCODE_VRAM_GB', '1'))  # GPU lease weight
+# Partial outputs younger than this may belong to another replica
+partial_cleanup_age = float(os.getenv('PARTIAL_CLEANUP_AGE', '600'))
 
-# Profile mappings
-profile_settings = {
-    'high': {'global_quality': 28, 'qp': 22},
-    'medium': {'global_quality': 25, 'qp': 20},
-    'low': {'global_quality': 22, 'qp': 18}
-}
+def get_audio_info(file_path, probe=None):
+    """Get audio stream information from *probe* or the shared probe cache."""
+    return audio_streams(probe or probe_cache.probe(file_path))
 
-settings = profile_settings.get(transcode_profile, profile_settings['high'])
+def build_video_args(cpu=None, quality=None, upload=False):
+    """Return the video encoder arguments for the configured profile.
 
-def get_audio_info(file_path):
-    """Get audio stream information from a media file using ffprobe."""
-    try:
-        cmd = ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_streams', file_path]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=False)
-        data = json.loads(result.stdout)
-        audio_streams = [s for s in data.get('streams', []) if s.get('codec_type') == 'audio']
-        return audio_streams
-    except (OSError, json.JSONDecodeError) as e:
-        print(f"Error probing {file_path}: {e}")
-        return []
+    *quality* replaces the profile's quality value, see :func:`adaptive_quality`.
+    *upload* adds the upload of software-decoded frames for VAAPI.
+    """
+    return video_encoder_args(transcode_profile, cpu_fallback if cpu is None else cpu,
+                              vaapi_profile, upload=upload, quality=quality)
 
-def build_ffmpeg_cmd(input_file, output_file, audio_streams):
-    """Build FFmpeg command for transcoding with appropriate audio and video settings."""
-    cmd = ['ffmpeg', '-y']
-    if not cpu_fallback:
-        cmd.extend(['-hwaccel', 'vaapi', '-hwaccel_device', '/dev/dri/renderD128'])
-        cmd.extend(['-i', input_file])
-        cmd.extend([
-            '-c:v', vaapi_profile, '-global_quality', str(settings['global_quality']),
-            '-qp', str(settings['qp'])
-        ])
-    else:
-        cmd.extend(['-i', input_file])
-        cmd.extend(['-c:v', 'libx265', '-crf', str(settings['global_quality'])])  # Approximate CRF
-
-    # Audio mapping
-    audio_filters = []
-    for i, stream in enumerate(audio_streams):
-        channels = stream.get('channels', 2)
-        if channels > 2:
-            # Surround: EAC3
-            cmd.extend([f'-c:a:{i}', 'eac3'])
-            if channels > 6:
-                audio_filters.append(
-                    f'[0:a:{i}]pan=5.1|c0=c0|c1=c1|c2=c2|c3=c3|c4=c4|c5=c5[a{i}]'
-                )
-        else:
-            # Stereo: AAC or OPUS
-            codec = 'libopus' if audio_format == 'opus' else 'aac'
-            cmd.extend([f'-c:a:{i}', codec])
+def build_audio_args(audio_streams):
+    """Return audio encoder arguments for *audio_streams* (EAC3 surround, AAC/Opus stereo)."""
+    return audio_encoder_args(audio_streams, audio_format)
 
-    if audio_filters:
-        cmd.extend(['-filter_complex', ','.join(audio_filters)])
+def hwaccel_args(render_node):
+    """Return the ffmpeg input arguments decoding on *render_node*, if any."""
+    if render_node is None:
+        return []
+    return ['-hwaccel', 'vaapi', '-hwaccel_device', render_node]
 
+def build_ffmpeg_cmd(input_file, output_file, audio_streams, render_node=None, quality=None):
+    """Build FFmpeg command for transcoding with appropriate audio and video settings.
+
+    Encodes with VAAPI on *render_node*, or on the CPU when it is ``None``.
+    """
+    cmd = ['ffmpeg', '-y']
+    cmd.extend(hwaccel_args(render_node))
+    cmd.extend(['-i', input_file])
+    cmd.extend(build_video_args(render_node is None, quality))
+    cmd.extend(build_audio_args(audio_streams))
     cmd.append(output_file)
     return cmd
 
-def transcode_file(input_file, output_file, job_id):
-    """Transcode a media file using FFmpeg and report progress."""
+def use_chunked_mode(cpu=None):
+    """Return True when files should be encoded segment-parallel."""
+    if transcode_mode == 'chunked':
+        return True
+    return transcode_mode == 'auto' and (cpu_fallback if cpu is None else cpu)
+
+def gpu_lease():
+    """Lease a GPU slot for one encode, or yield ``None`` to encode on the CPU."""
+    if cpu_fallback:
+        return contextlib.nullcontext()
+    return gpu_scheduler.lease(transcode_vram_gb)
+
+def gpu_lease_async():
+    """Coroutine version of :func:`gpu_lease` for ``async with``."""
+    if cpu_fallback:
+        return contextlib.nullcontext()
+    return gpu_scheduler.lease_async(transcode_vram_gb)
+
+def adaptive_quality(input_file, job_id, probe, render_node):
+    """Return the sample-searched quality for *input_file*, or ``None`` for the profile's.
+
+    The samples are encoded with the encoder the file will use: VAAPI on
+    *render_node*, or libx265 when it is ``None``.
+    """
+    if transcode_quality != 'adaptive':
+        return None
+    cpu = render_node is None
+    result = quality_probe.choose(
+        input_file, duration(probe),
+        lambda quality: build_video_args(cpu, quality),
+        'libx265' if cpu else vaapi_profile,
+        input_args=hwaccel_args(render_node),
+        popen=functools.partial(job_control.popen, job_id)
+    )
+    if result is None:
+        print(f"Quality search failed for {input_file}, using the {transcode_profile} profile")
+        return None
+    print(f"Adaptive quality {result['quality']} for {input_file} "
+          f"({quality_probe.metric} {result['score']}, cached: {result['cached']})")
+    return result['quality']
+
+def publish_progress(job_id, progress):
+    """Publish a transcode.progress event."""
+    publisher.progress('transcode_events', job_id, progress)
+    print(f"Transcode progress: {progress}% for job {job_id}")
+
+def ffmpeg_progress(job_id, total):
+    """Return a callback publishing progress every 10% from ffmpeg stderr lines."""
+    last_progress = [0]
+
+    def _on_line(line):
+        current_time = parse_time(line) if total else None
+        if current_time is not None:
+            progress = int((current_time / total) * 100)
+            if progress >= last_progress[0] + 10:  # Update every 10%
+                publish_progress(job_id, progress)
+                last_progress[0] = progress
+
+    return _on_line
+
+def transcode_file_chunked(input_file, output_file, job_id, probe, render_node=None,
+                           quality=None):
+    """Transcode *input_file* segment-parallel, reporting progress every 10%.
+
+    Segments are encoded with VAAPI on *render_node*, or on the CPU when it
+    is ``None``.
+    """
+    last_progress = [0]
+
+    def _on_progress(progress):
+        if progress >= last_progress[0] + 10:
+            publish_progress(job_id, progress)
+            last_progress[0] = progress
+
+    return transcode_chunked(
+        input_file, output_file,
+        build_video_args(render_node is None, quality, upload=render_node is not None),
+        build_audio_args(audio_streams(probe)),
+        duration(probe), _on_progress,
+        workers=chunk_workers or None, segment_seconds=chunk_seconds,
+        popen=functools.partial(job_control.popen, job_id),
+        render_node=render_node,
+        expect_audio=bool(audio_streams(probe))
+    )
+
+def transcode_file(input_file, output_file, job_id, probe=None):
+    """Transcode a media file using FFmpeg and report progress.
+
+    *probe* is the ffprobe data carried in the enhance event, if any.
+    """
+    probe = probe or probe_cache.probe(input_file)
+    with gpu_lease() as lease:
+        # No GPU slot within GPU_WAIT_SECONDS: encode this file on the CPU
+        render_node = lease.device.render_node if lease else None
+        started = time.monotonic()
+        quality = adaptive_quality(input_file, job_id, probe, render_node)
+        if use_chunked_mode(render_node is None):
+            ok = transcode_file_chunked(input_file, output_file, job_id, probe, render_node,
+                                        quality)
+        else:
+            ok = transcode_file_single(input_file, output_file, job_id, probe, render_node,
+                                       quality)
+    if ok:
+        metrics.observe_fps('transcode', estimate_frames(probe), time.monotonic() - started)
+    return ok
+
+def transcode_file_single(input_file, output_file, job_id, probe, render_node, quality=None):
+    """Transcode *input_file* with one ffmpeg process."""
     try:
-        with subprocess.Popen(
-            build_ffmpeg_cmd(input_file, output_file, get_audio_info(input_file)),
+        with job_control.popen(
+            job_id,
+            build_ffmpeg_cmd(input_file, output_file, get_audio_info(input_file, probe),
+                             render_node, quality),
             stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
         ) as process:
-            duration = None
-            # Get duration first
-            try:
-                probe_data = json.loads(
-                    subprocess.run(
-                        [
-                            'ffprobe', '-v', 'quiet', '-print_format', 'json',
-                            '-show_format', input_file
-                        ],
-                        capture_output=True, text=True, check=False
-                    ).stdout
-                )
-                duration = float(probe_data['format']['duration'])
-            except OSError:
-                duration = None
-
-            last_progress = 0
+            on_line = ffmpeg_progress(job_id, duration(probe))
             for line in iter(process.stderr.readline, ''):
-                if duration and 'time=' in line:
-                    time_match = re.search(r'time=(\d+):(\d+):(\d+\.\d+)', line)
-                    if time_match:
-                        h, m, s = map(float, time_match.groups())
-                        current_time = h * 3600 + m * 60 + s
-                        progress = int((current_time / duration) * 100)
-                        if progress >= last_progress + 10:  # Update every 10%
-                            r.xadd(
-                                'transcode_events',
-                                {'event': 'progress', 'data': json.dumps({
-                                    "job_id": job_id,
-                                    "percentage": progress
-                                })}
-                            )
-                            print(f"Transcode progress: {progress}% for job {job_id}")
-                            last_progress = progress
+                on_line(line)
             process.communicate()
         return process.returncode == 0
     except (OSError, ValueError, KeyError, json.JSONDecodeError) as e:
         print(f"Error transcoding {input_file}: {e}")
         return False
 
-def process_enhance_complete(job_id, enhanced_files):
-    """Process enhanced files by transcoding them and publishing completion event."""
+def checkpoint_settings():
+    """Return the settings that shape a transcoded output file."""
+    settings = {"profile": transcode_profile, "vaapi_profile": vaapi_profile,
+                "audio_format": audio_format}
+    if transcode_quality == 'adaptive':
+        settings["quality"] = quality_probe.settings()
+    return settings
+
+def process_enhance_complete(job_id, enhanced_files, probes=None, reused_from=None):
+    """Process enhanced files by transcoding them and publishing completion event.
+
+    A job reusing the rip of job *reused_from* reuses that job's transcodes.
+    """
+    probes = probes or {}
     transcoded_files = []
     for enhanced_file in enhanced_files:
         rel_path = os.path.relpath(enhanced_file, enhanced_output_dir)
         output_file = os.path.join(transcoded_output_dir, rel_path)
         os.makedirs(os.path.dirname(output_file), exist_ok=True)
 
-        if transcode_file(enhanced_file, output_file, job_id):
+        # Files finished before a restart are not transcoded again
+        if checkpoints.produce(
+            reused_from or job_id, enhanced_file, output_file, checkpoint_settings(),
+            lambda temp_file, source=enhanced_file: transcode_file(
+                source, temp_file, job_id, probes.get(source))
+        ):
             transcoded_files.append(output_file)
         else:
+            # A cancelled job stops here instead of falling back to the original
+            job_control.check(job_id)
             transcoded_files.append(enhanced_file)  # Fallback
 
     # Publish complete
@@ -152,7 +261,9 @@ def process_enhance_complete(job_id, enhanced_files):
         "job_id": job_id,
         "transcoded_files": transcoded_files
     }
-    r.xadd('transcode_events', {'event': 'complete', 'data': json.dumps(complete_msg)})
+    if reused_from:
+        complete_msg["reused_from"] = reused_from
+    publisher.publish('transcode_events', 'complete', complete_msg)
     print(f"Published transcode.complete for job {job_id}")
 
 def process_enhance_event(data):
@@ -161,31 +272,141 @@ def process_enhance_event(data):
         job_id = data['job_id']
         enhanced_files = data['enhanced_files']
 
-        # Publish start
-        start_msg = {
-            "job_id": job_id,
-            "input_files": enhanced_files
-        }
-        r.xadd('transcode_events', {'event': 'start', 'data': json.dumps(start_msg)})
-        print(f"Published transcode.start for job {job_id}")
+        with job_control.job(job_id):
+            job_control.check(job_id)
+            # Publish start
+            start_msg = {
+                "job_id": job_id,
+                "input_files": enhanced_files
+            }
+            publisher.publish('transcode_events', 'start', start_msg)
+            print(f"Published transcode.start for job {job_id}")
+
+            process_enhance_complete(job_id, enhanced_files, data.get('probes'),
+                                     data.get('reused_from'))
+
+async def transcode_file_async(input_file, output_file, job_id, probe=None):
+    """Coroutine version of :func:`transcode_file` for the asyncio runtime."""
+    probe = probe or await asyncio.to_thread(probe_cache.probe, input_file)
+    async with gpu_lease_async() as lease:
+        render_node = lease.device.render_node if lease else None
+        started = time.monotonic()
+        # Sample encodes and segment supervision hold a thread for minutes
+        quality = await aio.run_blocking(adaptive_quality, input_file, job_id, probe,
+                                         render_node)
+        if use_chunked_mode(render_node is None):
+            ok = await aio.run_blocking(transcode_file_chunked, input_file, output_file,
+                                        job_id, probe, render_node, quality)
+        else:
+            try:
+                returncode = await aio.run_process(
+                    build_ffmpeg_cmd(input_file, output_file,
+                                     get_audio_info(input_file, probe), render_node, quality),
+                    ffmpeg_progress(job_id, duration(probe)),
+                    on_start=functools.partial(job_control.track, job_id)
+                )
+            except OSError as e:
+                print(f"Error transcoding {input_file}: {e}")
+                return False
+            ok = returncode == 0
+    if ok:
+        metrics.observe_fps('transcode', estimate_frames(probe), time.monotonic() - started)
+    return ok
+
+async def process_enhance_event_async(data):
+    """Coroutine version of :func:`process_enhance_event`."""
+    with job_control.job(data['job_id']):
+        job_control.check(data['job_id'])
+        await transcode_enhanced_async(data['job_id'], data['enhanced_files'],
+                                       data.get('probes') or {}, data.get('reused_from'))
+
+async def transcode_enhanced_async(job_id, enhanced_files, probes, reused_from=None):
+    """Transcode the files of an enhance event and publish start and complete."""
+    await publisher.publish_async('transcode_events', 'start', {
+        "job_id": job_id,
+        "input_files": enhanced_files
+    })
+    print(f"Published transcode.start for job {job_id}")
+
+    transcoded_files = []
+    for enhanced_file in enhanced_files:
+        rel_path = os.path.relpath(enhanced_file, enhanced_output_dir)
+        output_file = os.path.join(transcoded_output_dir, rel_path)
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+
+        if await checkpoints.produce_async(
+            reused_from or job_id, enhanced_file, output_file, checkpoint_settings(),
+            lambda temp_file, source=enhanced_file: transcode_file_async(
+                source, temp_file, job_id, probes.get(source))
+        ):
+            transcoded_files.append(output_file)
+        else:
+            job_control.check(job_id)
+            transcoded_files.append(enhanced_file)  # Fallback
+
+    complete_msg = {
+        "job_id": job_id,
+        "transcoded_files": transcoded_files
+    }
+    if reused_from:
+        complete_msg["reused_from"] = reused_from
+    await publisher.publish_async('transcode_events', 'complete', complete_msg)
+    print(f"Published transcode.complete for job {job_id}")
 
-        threading.Thread(target=process_enhance_complete, args=(job_id, enhanced_files)).start()
+async def main_async():
+    """Asyncio event loop: jobs are tasks, ffmpeg output is read without threads."""
+    client = aio.async_client(redis_url)
+    publisher.async_client = client
+    consumer = aio.AsyncStreamConsumer.from_env(client, 'enhance_events', 'transcode-worker')
+    runner = aio.AsyncJobRunner.from_env(
+        'transcode-worker', 'MAX_CONCURRENT_TRANSCODES', 2, client,
+        on_error=functools.partial(publisher.fail_async, 'transcode_events'))
+    async with runner:
+        job_control.listen(runner)
+        metrics.start_from_env(r, [(consumer.stream, consumer.group)])
+        async for msg_id, data in consumer.messages():
+            if data.get('event') == 'complete' and not data.get('fused'):
+                await runner.submit(
+                    consumer.acking(msg_id,
+                                    tracer.traced_async('transcode', process_enhance_event_async)),
+                    data,
+                    priority=size_priority(data.get('enhanced_files', [])),
+                    job_id=data.get('job_id'),
+                    on_drop=functools.partial(consumer.ack, msg_id)
+                )
+            else:
+                await consumer.ack(msg_id)
 
 def main():
     """Main event loop: listen for enhance events and process them."""
-    last_id = '0'
+    consumer = StreamConsumer.from_env(r, 'enhance_events', 'transcode-worker')
+    executor = JobExecutor.from_env('transcode-worker', 'MAX_CONCURRENT_TRANSCODES', 2, r,
+                                   on_error=functools.partial(publisher.fail, 'transcode_events'))
+    job_control.listen(executor)
+    metrics.start_from_env(r, [(consumer.stream, consumer.group)])
     while True:
         try:
-            messages = r.xread({'enhance_events': last_id}, block=1000)
-            for _, msgs in messages:
-                for msg_id, msg in msgs:
-                    last_id = msg_id
-                    data = json.loads(msg['data'])
-                    process_enhance_event(data)
+            for msg_id, data in consumer.messages():
+                # Fused enhance jobs were already encoded by the enhance worker
+                if data.get('event') == 'complete' and not data.get('fused'):
+                    executor.submit(
+                        consumer.acking(msg_id,
+                                        tracer.traced('transcode', process_enhance_event)),
+                        data,
+                        priority=size_priority(data.get('enhanced_files', [])),
+                        job_id=data.get('job_id'),
+                        on_drop=functools.partial(consumer.ack, msg_id)
+                    )
+                else:
+                    consumer.ack(msg_id)
         except OSError as e:
             print(f"Error reading stream: {e}")
             time.sleep(1)
 
 if __name__ == '__main__':
+    remove_partials(transcoded_output_dir, partial_cleanup_age)
     print("Transcode Worker started, waiting for enhance events...")
-    main()
+    if aio.worker_runtime() == 'asyncio':
+        aio.run(main_async)
+    else:
+        main()
@@ -44,6 +44,7 @@ document.addEventListener("DOMContentLoaded", () => {
         </div>
         <div class="job-controls">
           <button onclick="pauseJob('${id}')">Pause</button>
+          <button onclick="resumeJob('${id}')">Resume</button>
           <button onclick="cancelJob('${id}')">Cancel</button>
         </div>
       `;
@@ -85,6 +86,12 @@ document.addEventListener("DOMContentLoaded", () => {
       .catch((err) => console.error(err));
   };
 
+  window.resumeJob = (id) => {
+    fetch(`/api/jobs/${id}/resume`, { method: "POST" })
+      .then(() => appendLog(`Resumed job ${id}`))
+      .catch((err) => console.error(err));
+  };
+
   window.cancelJob = (id) => {
     fetch(`/api/jobs/${id}/cancel`, { method: "POST" })
       .then(() => appendLog(`Canceled job ${id}`))
@@ -84,27 +84,66 @@ redisClient.on("ready", () => {
   pollStreams(initialIds);
 });
 
-// REST endpoints for job control
-app.post("/api/jobs/:id/pause", async (req, res) => {
-  const jobId = req.params.id;
+// Job index written by the workers (services/riparr_common/job_store.py)
+const JOB_STATES = ["active", "completed", "failed", "cancelled", "all"];
+
+app.get("/api/jobs", async (req, res) => {
+  const state = req.query.state || "active";
+  const limit = Math.min(parseInt(req.query.limit, 10) || 50, 500);
+  const offset = parseInt(req.query.offset, 10) || 0;
+  if (!JOB_STATES.includes(state)) {
+    res.status(400).json({ error: `Unknown job state: ${state}` });
+    return;
+  }
   try {
-    await redisClient.xAdd("control", "*", { action: "pause", jobId });
-    res.json({ status: "paused", jobId });
+    const jobIds = await redisClient.zRange(
+      `jobs:${state}`,
+      offset,
+      offset + limit - 1,
+      { REV: true },
+    );
+    const jobs = await Promise.all(
+      jobIds.map((jobId) => redisClient.hGetAll(`job:${jobId}`)),
+    );
+    res.json({ state, jobs: jobs.filter((job) => Object.keys(job).length) });
   } catch (err) {
     res.status(500).json({ error: err.message });
   }
 });
 
-app.post("/api/jobs/:id/cancel", async (req, res) => {
-  const jobId = req.params.id;
+app.get("/api/jobs/:id", async (req, res) => {
   try {
-    await redisClient.xAdd("control", "*", { action: "cancel", jobId });
-    res.json({ status: "canceled", jobId });
+    const job = await redisClient.hGetAll(`job:${req.params.id}`);
+    if (!Object.keys(job).length) {
+      res.status(404).json({ error: "Unknown job" });
+      return;
+    }
+    res.json(job);
   } catch (err) {
     res.status(500).json({ error: err.message });
   }
 });
 
+// REST endpoints for job control, applied by the worker running the job
+// (services/riparr_common/job_control.py)
+function sendJobCommand(action, status) {
+  return async (req, res) => {
+    const jobId = req.params.id;
+    try {
+      await redisClient.xAdd("orchestrator_commands", "*", {
+        data: JSON.stringify({ action, job_id: jobId }),
+      });
+      res.json({ status, jobId });
+    } catch (err) {
+      res.status(500).json({ error: err.message });
+    }
+  };
+}
+
+app.post("/api/jobs/:id/pause", sendJobCommand("pause_job", "pausing"));
+app.post("/api/jobs/:id/resume", sendJobCommand("resume_job", "resuming"));
+app.post("/api/jobs/:id/cancel", sendJobCommand("cancel_job", "canceling"));
+
 app.post("/api/services/:service/toggle", async (req, res) => {
   const { service } = req.params;
   try {
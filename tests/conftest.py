@@ -1,10 +1,15 @@
 """Pytest configuration and fixtures for Riparr tests."""
 
+import os
 import subprocess
+import sys
 import pytest
 import redis
 import docker
 
+# Shared worker helpers live next to the services, as they do inside the images
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'services'))
+
 
 @pytest.fixture(scope="session")
 def redis_client():
@@ -0,0 +1,118 @@
+import asyncio
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+import pytest
+import redis
+
+from riparr_common import aio
+
+PROGRESS_SCRIPT = (
+    "import sys, time\n"
+    "for i in range(3):\n"
+    "    sys.stderr.write(f'frame={i} time=00:00:0{i}.00\\r'); sys.stderr.flush()\n"
+    "sys.stderr.write('done\\n')\n"
+    "time.sleep(float(sys.argv[1]))\n"
+)
+
+def test_split_lines():
+    """
+    Carriage returns end lines like newlines; the unterminated tail is kept.
+    """
+    lines, rest = aio.split_lines(b'frame=1\rframe=2\nPRGV:1,2,3\nPRG')
+    assert lines == ['frame=1', 'frame=2', 'PRGV:1,2,3']
+    assert rest == b'PRG'
+
+def test_run_process_reports_lines():
+    """
+    Progress lines are delivered as they are written and the exit code returned.
+    """
+    lines = []
+    code = asyncio.run(aio.run_process([sys.executable, '-c', PROGRESS_SCRIPT, '0'],
+                                       lines.append))
+    assert code == 0
+    assert lines == ['frame=0 time=00:00:00.00', 'frame=1 time=00:00:01.00',
+                     'frame=2 time=00:00:02.00', 'done']
+
+def test_run_blocking_uses_its_own_pool():
+    """
+    Long blocking calls run on the bounded pool, not the default executor,
+    and see the caller's context variables.
+    """
+    current = contextvars.ContextVar('current', default=None)
+
+    def work():
+        return threading.current_thread().name, current.get()
+
+    async def scenario():
+        current.set('job-1')
+        return await aio.run_blocking(work)
+
+    name, value = asyncio.run(scenario())
+    assert name.startswith('blocking') and value == 'job-1'
+
+def test_cancelled_job_terminates_its_process():
+    """
+    Cancelling a running job through the runner stops its subprocess at once,
+    while other jobs keep running.
+    """
+    async def scenario():
+        finished = []
+
+        async def job(name, seconds):
+            await aio.run_process([sys.executable, '-c', PROGRESS_SCRIPT, str(seconds)])
+            finished.append(name)
+
+        async with aio.AsyncJobRunner('test', max_workers=2, queue_size=4) as runner:
+            await runner.submit(job, 'slow', 30, job_id='slow')
+            await runner.submit(job, 'fast', 0.2, job_id='fast')
+            await asyncio.sleep(0.5)
+            started = time.monotonic()
+            assert runner.cancel('slow')
+            while runner.stats()['running']:
+                await asyncio.sleep(0.05)
+            return finished, time.monotonic() - started, runner.stats()
+
+    finished, elapsed, stats = asyncio.run(scenario())
+    assert finished == ['fast']
+    assert elapsed < 5
+    assert stats['cancelled'] == 1 and stats['completed'] == 1
+
+def test_async_consumer_acks_after_job():
+    """
+    The asyncio consumer delivers entries of its group and acks them once the
+    wrapped coroutine has finished.
+    """
+    sync_client = redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379'))
+    try:
+        sync_client.ping()
+    except redis.ConnectionError:
+        pytest.skip("Redis not available")
+    stream = f'test_aio_{uuid.uuid4().hex}'
+    sync_client.xadd(stream, {'event': 'insert', 'data': json.dumps({'drive_id': 'd1'})})
+
+    async def scenario():
+        client = aio.async_client(os.getenv('REDIS_URL', 'redis://localhost:6379'))
+        consumer = aio.AsyncStreamConsumer(client, stream, 'test-group', consumer='c1',
+                                           block_ms=100)
+        seen = []
+
+        async def handle(data):
+            seen.append(data)
+
+        async for msg_id, data in consumer.messages():
+            await consumer.acking(msg_id, handle)(data)
+            break
+        pending = await client.xpending(stream, 'test-group')
+        await client.delete(stream)
+        await client.aclose()
+        return seen, pending['pending']
+
+    seen, pending = asyncio.run(scenario())
+    assert seen == [{'event': 'insert', 'drive_id': 'd1'}]
+    assert pending == 0
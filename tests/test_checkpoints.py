@@ -0,0 +1,97 @@
+import os
+import uuid
+
+import pytest
+import redis
+
+from riparr_common.checkpoints import (CheckpointStore, input_fingerprint, partial_path,
+                                       remove_partials, settings_digest)
+
+def redis_client():
+    """
+    Return a Redis client, skipping the test if no server is reachable.
+    """
+    client = redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379'),
+                            decode_responses=True)
+    try:
+        client.ping()
+    except redis.ConnectionError:
+        pytest.skip("Redis not available")
+    return client
+
+def test_fingerprint_and_settings_digest(tmp_path):
+    """
+    The fingerprint follows the file content, the digest ignores key order.
+    """
+    media = tmp_path / 'title.mkv'
+    media.write_bytes(b'a' * 3000)
+    before = input_fingerprint(str(media), sample_bytes=1024)
+    media.write_bytes(b'a' * 2999 + b'b')
+    assert input_fingerprint(str(media), sample_bytes=1024) != before
+    assert settings_digest({'crf': '14', 'preset': 'fast'}) == \
+        settings_digest({'preset': 'fast', 'crf': '14'})
+    assert settings_digest({'crf': '14'}) != settings_digest({'crf': '16'})
+
+def test_remove_partials(tmp_path):
+    """
+    Stale partial files and scratch directories are removed, fresh ones and
+    finished outputs are kept.
+    """
+    show = tmp_path / 'Show'
+    show.mkdir()
+    finished = show / 't00.mkv'
+    finished.write_bytes(b'done')
+    stale = show / '.partial.t01.mkv'
+    stale.write_bytes(b'half')
+    scratch = show / '.frames_abc'
+    scratch.mkdir()
+    (scratch / 'frame_00000001.png').write_bytes(b'png')
+    fresh = show / '.partial.t02.mkv'
+    fresh.write_bytes(b'writing')
+    for path in (stale, scratch):
+        os.utime(path, (1000, 1000))
+
+    removed = remove_partials(str(tmp_path), min_age=600, now=os.stat(fresh).st_mtime)
+    assert sorted(removed) == sorted([str(stale), str(scratch)])
+    assert finished.exists() and fresh.exists()
+    assert partial_path(str(finished)) == str(show / '.partial.t00.mkv')
+
+def test_checkpoint_skips_finished_output(tmp_path):
+    """
+    A finished output is produced once; changed settings or a changed
+    output produce it again, and a failed run leaves no partial file.
+    """
+    store = CheckpointStore(redis_client(), 'enhance', ttl=60)
+    job_id = uuid.uuid4().hex
+    source = tmp_path / 'title.mkv'
+    source.write_bytes(b'source')
+    output = tmp_path / 'out' / 'title.mkv'
+    output.parent.mkdir()
+    calls = []
+
+    def encode(temp_file):
+        calls.append(temp_file)
+        with open(temp_file, 'wb') as handle:
+            handle.write(b'enhanced')
+        return True
+
+    settings = {'crf': '14'}
+    assert store.produce(job_id, str(source), str(output), settings, encode)
+    assert calls == [partial_path(str(output))] and output.read_bytes() == b'enhanced'
+    assert store.produce(job_id, str(source), str(output), settings, encode)
+    assert len(calls) == 1
+
+    assert store.produce(job_id, str(source), str(output), {'crf': '16'}, encode)
+    assert len(calls) == 2
+    output.write_bytes(b'truncated')
+    assert store.produce(job_id, str(source), str(output), {'crf': '16'}, encode)
+    assert len(calls) == 3
+
+    def crash(temp_file):
+        with open(temp_file, 'wb') as handle:
+            handle.write(b'half')
+        return False
+
+    assert not store.produce(uuid.uuid4().hex, str(source), str(output), settings, crash)
+    assert not os.path.exists(partial_path(str(output)))
+    assert output.read_bytes() == b'enhanced'
@@ -0,0 +1,124 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                'services', 'transcode_worker'))
+
+from chunked_transcode import parse_time, transcode_chunked  # noqa: E402
+from riparr_common.encoding import video_encoder_args  # noqa: E402
+
+class FakeProcess:
+    """
+    Stands in for an ffmpeg process, creating the files it would write.
+    ffprobe reports one audio stream; *fail* makes the process exit with 1
+    without writing anything.
+    """
+    def __init__(self, cmd, fail=False, **kwargs):
+        self.returncode = 1 if fail else 0
+        self.stdout = '1\n' if cmd[0] == 'ffprobe' else ''
+        target = cmd[-1]
+        if fail or cmd[0] == 'ffprobe':
+            pass
+        elif '-segment_time' in cmd:
+            for i in range(2):
+                open(target % i, 'wb').close()
+        else:
+            open(target, 'wb').close()
+        self.stderr = type('Stderr', (), {'readline': lambda self: ''})()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def communicate(self):
+        return self.stdout, ''
+
+    def wait(self):
+        return self.returncode
+
+def test_parse_time():
+    """
+    ffmpeg stats lines are converted to seconds.
+    """
+    line = 'frame= 120 fps= 30 q=28.0 size= 1024kB time=00:01:02.50 bitrate= 100kbits/s'
+    assert parse_time(line) == 62.5
+    assert parse_time('Press [q] to stop') is None
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg not available")
+def test_chunked_output_matches_source_duration(tmp_path):
+    """
+    Segments are concatenated back into one file with audio and full duration.
+    """
+    clip = str(tmp_path / 'clip.mkv')
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', 'testsrc=duration=12:size=320x240:rate=24',
+        '-f', 'lavfi', '-i', 'sine=duration=12',
+        '-c:v', 'libx264', '-g', '24', '-c:a', 'aac', '-shortest', clip
+    ], check=True)
+
+    progress = []
+    output = str(tmp_path / 'out.mkv')
+    assert transcode_chunked(clip, output, ['-c:v', 'libx264', '-crf', '30'], ['-c:a:0', 'aac'],
+                             12.0, progress.append, workers=3, segment_seconds=3)
+
+    probe = json.loads(subprocess.run(
+        ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams', output],
+        capture_output=True, text=True, check=True
+    ).stdout)
+    assert abs(float(probe['format']['duration']) - 12.0) < 0.5
+    assert {s['codec_type'] for s in probe['streams']} >= {'video', 'audio'}
+    assert progress == sorted(progress) and progress[-1] == 100
+
+def test_gpu_segments_run_on_the_render_node(tmp_path):
+    """
+    With a render node every segment encoder opens the VAAPI device and
+    uploads its frames, so the hevc_vaapi arguments have a device to run on.
+    """
+    commands = []
+
+    def popen(cmd, **kwargs):
+        commands.append(cmd)
+        return FakeProcess(cmd, **kwargs)
+
+    video_args = video_encoder_args('medium', False, upload=True)
+    assert transcode_chunked(str(tmp_path / 'in.mkv'), str(tmp_path / 'out.mkv'), video_args,
+                             ['-c:a:0', 'copy'], 60.0, workers=2, popen=popen,
+                             render_node='/dev/dri/renderD129')
+
+    segments = [cmd for cmd in commands if '-an' in cmd]
+    assert len(segments) == 2
+    for cmd in segments:
+        assert cmd[cmd.index('-vaapi_device') + 1] == '/dev/dri/renderD129'
+        assert cmd.index('-vaapi_device') < cmd.index('-i')
+        assert cmd[cmd.index('-vf') + 1] == 'format=nv12,hwupload'
+        assert cmd[cmd.index('-c:v') + 1] == 'hevc_vaapi'
+    assert not any('-vaapi_device' in cmd for cmd in commands if cmd not in segments)
+
+def test_failed_audio_encode_fails_the_transcode(tmp_path):
+    """
+    A source with audio whose audio encode fails is not muxed into a silent
+    file; a source without audio is transcoded without it.
+    """
+    commands = []
+
+    def popen(cmd, **kwargs):
+        commands.append(cmd)
+        return FakeProcess(cmd, fail='-vn' in cmd, **kwargs)
+
+    args = (str(tmp_path / 'in.mkv'), str(tmp_path / 'out.mkv'), ['-c:v', 'libx265'],
+            ['-c:a:0', 'aac'], 60.0)
+    assert not transcode_chunked(*args, workers=2, popen=popen)
+    assert commands[0][0] == 'ffprobe'
+    assert not any('concat' in cmd for cmd in commands)
+
+    assert transcode_chunked(*args, workers=2, popen=popen, expect_audio=False)
+    (mux,) = [cmd for cmd in commands if 'concat' in cmd]
+    assert '1:a' not in mux
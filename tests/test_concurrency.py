@@ -45,11 +45,12 @@ def monitor_redis_streams(redis_client, stream_name, timeout=60):
 
 def get_active_jobs_count(redis_client):
     """
-    Count active jobs from Redis streams.
+    Count running rip jobs from the executor stats the rip worker publishes.
     """
-    # This would check rip_events for active jobs
-    # Placeholder implementation
-    return 0
+    raw = redis_client.hget('worker_stats', 'rip-worker')
+    if not raw:
+        return 0
+    return json.loads(raw)['running']
 
 def test_concurrency_limits():
     """
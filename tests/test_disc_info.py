@@ -0,0 +1,132 @@
+import os
+import sys
+
+import pytest
+import redis
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                'services', 'rip_worker'))
+
+from disc_index import DiscIndex  # noqa: E402
+from disc_info import DiscTitle, duplicate_titles, fingerprint, parse_info  # noqa: E402
+from title_selection import SelectionRules, select_titles  # noqa: E402
+
+SCAN = [
+    'MSG:1005,0,1,"MakeMKV started","%1 started","MakeMKV"',
+    'CINFO:2,0,"Some Show: Season 1"',
+    'CINFO:32,0,"SOME_SHOW_S1D1"',
+    'TCOUNT:3',
+    'TINFO:0,2,0,"Some Show, Episode 1"',
+    'TINFO:0,8,0,"6"',
+    'TINFO:0,9,0,"0:44:03"',
+    'TINFO:0,11,0,"2147483648"',
+    'TINFO:0,16,0,"00800.mpls"',
+    'TINFO:0,26,0,"1,2,3"',
+    'TINFO:0,27,0,"title_t00.mkv"',
+    'TINFO:1,9,0,"0:44:03"',
+    'TINFO:1,11,0,"2147483648"',
+    'TINFO:1,26,0,"1,2,3"',
+    'TINFO:2,9,0,"1:28:06"',
+    'TINFO:2,11,0,"4294967296"',
+    'TINFO:2,26,0,"4,5"',
+]
+
+def test_parse_info_reads_disc_and_titles():
+    """
+    Robot-mode lines are parsed into the label and per-title attributes.
+    """
+    info = parse_info(SCAN)
+    assert info.label == 'SOME_SHOW_S1D1'
+    assert info.name == 'Some Show: Season 1'
+    assert [t.index for t in info.titles] == [0, 1, 2]
+    first = info.titles[0]
+    assert first.name == 'Some Show, Episode 1'
+    assert first.duration == 44 * 60 + 3
+    assert first.size == 2147483648
+    assert first.chapters == 6
+    assert first.segments == '1,2,3'
+    assert first.output_file == 'title_t00.mkv'
+
+def test_fingerprint_is_stable_and_content_sensitive():
+    """
+    Rescanning gives the same fingerprint; a different title list does not.
+    """
+    assert fingerprint(parse_info(SCAN)) == fingerprint(parse_info(list(SCAN)))
+    assert fingerprint(parse_info(SCAN)) != fingerprint(parse_info(SCAN[:-1]))
+
+def test_titles_playing_the_same_segments_are_duplicates():
+    """
+    A second playlist over the same segments maps to the first title.
+    """
+    assert duplicate_titles(parse_info(SCAN).titles) == {1: 0}
+
+def redis_client():
+    """
+    Return a Redis client, skipping the test if no server is reachable.
+    """
+    client = redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379'),
+                            decode_responses=True)
+    try:
+        client.ping()
+    except redis.ConnectionError:
+        pytest.skip("Redis not available")
+    return client
+
+def test_index_reuses_only_matching_existing_rips(tmp_path):
+    """
+    A recorded rip is reusable for the same titles while its files exist.
+    """
+    client = redis_client()
+    index = DiscIndex(client)
+    output = tmp_path / 'title_t00.mkv'
+    output.write_bytes(b'mkv')
+    index.record('test-disc', 'job-1', 'LABEL', [2, 0], [str(output)])
+    try:
+        assert index.reusable('test-disc', [0, 2])['job_id'] == 'job-1'
+        assert index.reusable('test-disc', [0]) is None
+        output.unlink()
+        assert index.reusable('test-disc', [0, 2]) is None
+    finally:
+        client.delete(DiscIndex.PREFIX + 'test-disc')
+
+def make_title(index, minutes, size_gb, segments=''):
+    """
+    Build a scanned title *minutes* long and *size_gb* large.
+    """
+    return DiscTitle(index, '', int(minutes * 60), int(size_gb * 2**30), 6, '', segments, '')
+
+def test_episode_disc_keeps_episodes_only():
+    """
+    Similar-length titles are episodes; play-all, trailers and repeats are dropped.
+    """
+    titles = [
+        make_title(0, 132, 6.0, '1,2,3'),  # play all
+        make_title(1, 44, 2.0, '1'),
+        make_title(2, 45, 2.1, '2'),
+        make_title(3, 43, 1.9, '3'),
+        make_title(4, 2, 0.1, '9'),        # trailer
+        make_title(5, 44, 2.0, '1'),       # same segments as title 1
+    ]
+    selected, decisions = select_titles(titles, SelectionRules())
+    assert [t.index for t in selected] == [1, 2, 3]
+    reasons = {d['title']: d['reason'] for d in decisions}
+    assert reasons[0] == 'spans several episodes'
+    assert reasons[4] == 'shorter than 600s'
+    assert reasons[5] == 'same segments as title 1'
+    assert all(d['selected'] == (d['title'] in (1, 2, 3)) for d in decisions)
+
+def test_movie_disc_keeps_main_feature_unless_extras_are_kept():
+    """
+    Without an episode cluster the longest title wins; near-identical cuts are dropped.
+    """
+    titles = [
+        make_title(0, 121, 30.0),
+        make_title(1, 121, 30.1),  # same duration, size within 1%
+        make_title(2, 25, 4.0),    # making-of
+    ]
+    selected, decisions = select_titles(titles, SelectionRules())
+    assert [t.index for t in selected] == [0]
+    assert decisions[1]['reason'] == 'same duration and size as title 0'
+
+    selected, _decisions = select_titles(titles, SelectionRules(keep_extras=True))
+    assert [t.index for t in selected] == [0, 2]
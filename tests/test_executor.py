@@ -0,0 +1,100 @@
+import threading
+import time
+
+from riparr_common.executor import JobExecutor, size_priority
+
+def test_running_jobs_never_exceed_limit():
+    """
+    No more than max_workers jobs run at once, even under a burst of 20.
+    """
+    executor = JobExecutor('test', max_workers=3, queue_size=20)
+    lock = threading.Lock()
+    active = [0]
+    peak = [0]
+    done = threading.Event()
+    finished = [0]
+
+    def job():
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+            finished[0] += 1
+            if finished[0] == 20:
+                done.set()
+
+    for i in range(20):
+        executor.submit(job, job_id=f'job_{i}')
+
+    assert done.wait(10), "Jobs did not finish"
+    assert peak[0] == 3
+    assert executor.stats()['completed'] == 20
+
+def test_lower_priority_runs_first():
+    """
+    Queued jobs start in priority order, FIFO within the same priority.
+    """
+    executor = JobExecutor('test', max_workers=1, queue_size=10)
+    gate = threading.Event()
+    order = []
+    done = threading.Event()
+
+    executor.submit(gate.wait)  # occupy the only worker
+    for name, priority in [('film', 30), ('episode_1', 5), ('episode_2', 5), ('trailer', 1)]:
+        executor.submit(order.append, name, priority=priority)
+    executor.submit(done.set, priority=100)
+    gate.set()
+
+    assert done.wait(5)
+    assert order == ['trailer', 'episode_1', 'episode_2', 'film']
+
+def test_submit_blocks_when_queue_full():
+    """
+    A full queue applies back-pressure to the submitting thread.
+    """
+    executor = JobExecutor('test', max_workers=1, queue_size=1)
+    gate = threading.Event()
+    executor.submit(gate.wait)
+    time.sleep(0.05)  # let the worker pick up the first job
+    executor.submit(gate.wait)
+
+    submitted = threading.Event()
+    threading.Thread(target=lambda: (executor.submit(gate.wait), submitted.set())).start()
+    assert not submitted.wait(0.2), "submit() should block while the queue is full"
+
+    gate.set()
+    assert submitted.wait(5)
+
+def test_failed_jobs_are_reported():
+    """
+    A job that raises is counted and handed to the on_error hook with its id.
+    """
+    failures = []
+    reported = threading.Event()
+
+    def on_error(job_id, err):
+        failures.append((job_id, str(err)))
+        reported.set()
+
+    def job():
+        raise RuntimeError("boom")
+
+    executor = JobExecutor('test', max_workers=1, queue_size=1, on_error=on_error)
+    executor.submit(job, job_id='job_1')
+    assert reported.wait(5)
+    assert failures == [('job_1', 'boom')]
+    assert executor.stats()['failed'] == 1
+
+def test_size_priority(tmp_path):
+    """
+    Priority is the total size of the existing input files.
+    """
+    small = tmp_path / 'small.mkv'
+    small.write_bytes(b'x' * 10)
+    large = tmp_path / 'large.mkv'
+    large.write_bytes(b'x' * 1000)
+
+    assert size_priority([str(small)]) < size_priority([str(large)])
+    assert size_priority([str(small), str(tmp_path / 'missing.mkv')]) == 10
@@ -0,0 +1,122 @@
+import glob
+import io
+import os
+import struct
+import subprocess
+import sys
+import zlib
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                'services', 'enhance_worker'))
+
+from frame_pipeline import (FrameDeduper, dhash, iter_frame_batches, read_png,  # noqa: E402
+                            run_frame_pipeline, upscale_tuning)
+
+def make_png(value):
+    """
+    Build a valid 1x1 grayscale PNG whose pixel is *value*.
+    """
+    def chunk(kind, body):
+        return (struct.pack('>I', len(body)) + kind + body
+                + struct.pack('>I', zlib.crc32(kind + body)))
+    header = struct.pack('>IIBBBBB', 1, 1, 8, 0, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header)
+            + chunk(b'IDAT', zlib.compress(bytes([0, value]))) + chunk(b'IEND', b''))
+
+def test_read_png_splits_concatenated_stream():
+    """
+    Frames written back to back by image2pipe are read one at a time.
+    """
+    frames = [make_png(i) for i in range(3)]
+    stream = io.BytesIO(b''.join(frames))
+    assert [read_png(stream) for _ in range(3)] == frames
+    assert read_png(stream) is None
+
+def test_batches_are_bounded():
+    """
+    Batches never exceed the configured size and keep frame order.
+    """
+    frames = [make_png(i) for i in range(10)]
+    batches = list(iter_frame_batches(io.BytesIO(b''.join(frames)), 4))
+    assert [len(b) for b in batches] == [4, 4, 2]
+    assert [f for b in batches for f in b] == frames
+
+def test_non_png_stream_is_rejected():
+    """
+    A decoder writing something other than PNG is reported as an error.
+    """
+    with pytest.raises(ValueError):
+        read_png(io.BytesIO(b'not a png stream'))
+
+
+def test_upscale_tuning_follows_vram_and_cores():
+    """
+    Tiles grow with VRAM and halve for 4x models; the CPU build gets one
+    processing thread per remaining core.
+    """
+    assert upscale_tuning(4, 4, cpu_count=8) == ['-t', '200', '-j', '4:1:4']
+    assert upscale_tuning(4, 2, cpu_count=8) == ['-t', '400', '-j', '4:1:4']
+    assert upscale_tuning(12, 4, cpu_count=8) == ['-t', '512', '-j', '4:2:4']
+    assert upscale_tuning(0.5, 4, cpu_count=8) == ['-t', '64', '-j', '4:1:4']
+    assert upscale_tuning(4, 4, cpu=True, cpu_count=8) == ['-t', '200', '-j', '4:4:4']
+    assert upscale_tuning(4, 4, cpu=True, cpu_count=1) == ['-t', '200', '-j', '1:1:1']
+
+
+def test_dhash_compares_neighbouring_pixels():
+    """
+    Each bit of the hash says whether a pixel is brighter than its right neighbour.
+    """
+    assert dhash(bytes([3, 2, 1, 1, 2, 3]), 2) == 0b1100
+    assert dhash(bytes(6), 2) == 0
+
+
+def test_deduper_reuses_last_unique_frame_across_batches():
+    """
+    Runs of matching hashes are upscaled once; a run continuing into the next
+    batch reuses the previous batch's output.
+    """
+    deduper = FrameDeduper(threshold=1)
+    unique, sources = deduper.plan([0b0000, 0b0001, 0b1111, 0b1111])
+    assert unique == [0, 2]
+    assert deduper.assemble(sources, [b'a', b'c']) == [b'a', b'a', b'c', b'c']
+
+    unique, sources = deduper.plan([0b1110, None, 0b0000])
+    assert unique == [1, 2]
+    assert deduper.assemble(sources, [b'e', b'f']) == [b'c', b'e', b'f']
+
+def test_next_batch_is_staged_while_upscaling(tmp_path):
+    """
+    Decoding runs ahead of a slow upscaler and frames reach the encoder in order.
+    """
+    frames = [make_png(i) for i in range(12)]
+    source = tmp_path / 'frames.bin'
+    source.write_bytes(b''.join(frames))
+    output = tmp_path / 'encoded.bin'
+    staged = []
+
+    def upscale_cmd(in_dir, out_dir):
+        return [sys.executable, '-c', 'import shutil, sys, time; time.sleep(0.3); '
+                'shutil.rmtree(sys.argv[2]); shutil.copytree(sys.argv[1], sys.argv[2])',
+                in_dir, out_dir]
+
+    def popen(cmd, **kwargs):
+        if cmd[0] == 'ffmpeg':  # The decoder replays the prepared PNG stream
+            cmd = [sys.executable, '-c',
+                   'import sys; sys.stdout.buffer.write(open(sys.argv[1], "rb").read())',
+                   str(source)]
+        elif cmd[0] == 'encoder':
+            cmd = [sys.executable, '-c',
+                   'import sys; open(sys.argv[1], "wb").write(sys.stdin.buffer.read())',
+                   str(output)]
+        else:
+            staged.append(len(glob.glob(str(tmp_path / '.frames_*' / '*' / 'in'))))
+        return subprocess.Popen(cmd, **kwargs)
+
+    stats = {}
+    assert run_frame_pipeline('title.mkv', ['encoder'], upscale_cmd, 4,
+                              scratch_dir=str(tmp_path), stats=stats, popen=popen)
+    assert output.read_bytes() == b''.join(frames)
+    assert stats == {'frames': 12, 'upscaled': 12}
+    assert max(staged) >= 2
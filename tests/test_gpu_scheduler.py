@@ -0,0 +1,120 @@
+import asyncio
+import threading
+import time
+
+import pytest
+import redis
+
+from riparr_common.gpu_scheduler import (
+    GpuDevice, GpuScheduler, MemoryLeaseStore, RedisLeaseStore, parse_devices
+)
+
+DEVICES = [GpuDevice(0, '/dev/dri/renderD128', 8), GpuDevice(1, '/dev/dri/renderD129', 4)]
+
+def test_parse_devices():
+    """
+    GPU_DEVICES lists index, render node and VRAM per device.
+    """
+    assert parse_devices('0:/dev/dri/renderD128:8, 1:/dev/dri/renderD129:4') == DEVICES
+    assert parse_devices('') == []
+
+def test_leases_are_weighted_by_vram():
+    """
+    Leases spread over devices by load and stop once the VRAM budget is used.
+    """
+    scheduler = GpuScheduler(MemoryLeaseStore(), DEVICES)
+    first = scheduler.try_acquire(4)
+    second = scheduler.try_acquire(4)
+    third = scheduler.try_acquire(4)
+    assert {first.device.index, second.device.index} == {0, 1}
+    assert third.device.index == 0
+    assert scheduler.try_acquire(1) is None
+
+    scheduler.release(second)
+    assert scheduler.try_acquire(2) is not None
+
+def test_cpu_fallback_after_deadline():
+    """
+    Without a free slot before the deadline the caller gets the CPU path.
+    """
+    scheduler = GpuScheduler(MemoryLeaseStore(), DEVICES[1:], poll_interval=0.01)
+    with scheduler.lease(4) as held:
+        assert held is not None
+        started = time.monotonic()
+        with scheduler.lease(4, timeout=0.1) as fallback:
+            assert fallback is None
+        assert time.monotonic() - started >= 0.1
+    assert GpuScheduler(MemoryLeaseStore(), []).acquire(1) is None
+
+def test_waiting_job_gets_released_slot():
+    """
+    A waiting job takes over the device as soon as the current lease ends.
+    """
+    scheduler = GpuScheduler(MemoryLeaseStore(), DEVICES[1:], poll_interval=0.01)
+    held = scheduler.acquire(4)
+    threading.Timer(0.05, scheduler.release, args=(held,)).start()
+    assert scheduler.acquire(4, timeout=2) is not None
+
+def test_async_lease_waits_on_the_event_loop():
+    """
+    An async waiter polls with asyncio.sleep, so other tasks keep running,
+    and gets the device once the holder's lease is released.
+    """
+    scheduler = GpuScheduler(MemoryLeaseStore(), DEVICES[1:], poll_interval=0.01)
+    ticks = []
+
+    async def holder():
+        async with scheduler.lease_async(4) as lease:
+            assert lease is not None
+            await asyncio.sleep(0.1)
+
+    async def waiter():
+        await asyncio.sleep(0.01)
+        async with scheduler.lease_async(4, timeout=2) as lease:
+            return lease
+
+    async def ticker():
+        for _ in range(5):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        return await asyncio.gather(holder(), waiter(), ticker())
+
+    _, lease, _ = asyncio.run(scenario())
+    assert lease is not None and len(ticks) == 5
+    assert scheduler.store.usage('gpu1') == 0
+
+def test_oversized_and_expired_leases():
+    """
+    An idle device accepts an oversized lease; an unrenewed lease expires.
+    """
+    store = MemoryLeaseStore()
+    scheduler = GpuScheduler(store, DEVICES[1:], lease_ttl=0.05)
+    assert scheduler.try_acquire(12) is not None
+    assert scheduler.try_acquire(1) is None
+    time.sleep(0.1)
+    assert store.usage('gpu1') == 0
+    assert scheduler.try_acquire(1) is not None
+
+def test_redis_lease_store():
+    """
+    The Redis store applies the same capacity rules across clients.
+    """
+    client = redis.from_url('redis://localhost:6379', decode_responses=True)
+    try:
+        client.ping()
+    except redis.ConnectionError:
+        pytest.skip("Redis not available")
+    client.delete('gpu_leases:gpu1')
+
+    scheduler = GpuScheduler(RedisLeaseStore(client), DEVICES[1:])
+    other = GpuScheduler(RedisLeaseStore(client), DEVICES[1:])
+    lease = scheduler.try_acquire(3)
+    assert lease is not None
+    assert other.try_acquire(2) is None
+    assert other.try_acquire(1) is not None
+    assert scheduler.store.renew('gpu1', lease.lease_id, 60)
+    scheduler.release(lease)
+    assert other.store.usage('gpu1') == 1
+    client.delete('gpu_leases:gpu1')
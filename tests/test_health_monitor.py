@@ -0,0 +1,78 @@
+import os
+import sys
+
+from docker.errors import NotFound
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                'services', 'orchestrator'))
+
+from health_monitor import HealthMonitor  # noqa: E402
+
+
+class FakeContainer:
+    """Container handle whose state is read from the fake daemon on reload."""
+
+    def __init__(self, daemon, name):
+        self.daemon = daemon
+        self.name = name
+        self.attrs = {'State': {}}
+        self.status = None
+        self.reload()
+
+    def reload(self):
+        self.daemon.calls += 1
+        if self.name not in self.daemon.states:
+            raise NotFound(self.name)
+        self.status = self.daemon.states[self.name]
+        self.attrs = {'State': {'Status': self.status}}
+
+
+class FakeDocker:
+    """Just enough of ``docker.DockerClient`` for the monitor."""
+
+    def __init__(self, states):
+        self.states = states
+        self.calls = 0
+        self.containers = self
+
+    def get(self, name):
+        return FakeContainer(self, name)
+
+
+def test_health_published_only_on_change():
+    """
+    Polls that find nothing new neither notify nor look containers up again.
+    """
+    daemon = FakeDocker({'rip-worker': 'running', 'blackhole': 'running'})
+    published = []
+    monitor = HealthMonitor(daemon, ['rip-worker', 'blackhole'], published.append)
+
+    assert monitor.poll()
+    assert not monitor.poll()
+    assert published == [{'rip-worker': 'running', 'blackhole': 'running'}]
+    assert daemon.calls == 4  # one lookup plus one reload per container
+
+    daemon.states['blackhole'] = 'paused'
+    monitor.handle_event({'Action': 'pause', 'Actor': {'Attributes': {'name': 'blackhole'}}})
+    assert published[-1]['blackhole'] == 'paused'
+    assert daemon.calls == 5
+
+
+def test_health_events_and_missing_containers():
+    """
+    Health status events apply without an API call; removed containers are not_found.
+    """
+    daemon = FakeDocker({'rip-worker': 'running'})
+    published = []
+    monitor = HealthMonitor(daemon, ['rip-worker', 'metadata-worker'], published.append)
+    monitor.poll()
+    assert monitor.snapshot() == {'rip-worker': 'running', 'metadata-worker': 'not_found'}
+
+    calls = daemon.calls
+    monitor.handle_event({'Action': 'health_status: unhealthy',
+                          'Actor': {'Attributes': {'name': 'rip-worker'}}})
+    monitor.handle_event({'Action': 'exec_start: true',
+                          'Actor': {'Attributes': {'name': 'rip-worker'}}})
+    assert daemon.calls == calls
+    assert monitor.snapshot()['rip-worker'] == 'unhealthy'
+    assert len(published) == 2
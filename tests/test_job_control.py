@@ -0,0 +1,222 @@
+import asyncio
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+import pytest
+import redis
+
+from riparr_common import aio
+from riparr_common.executor import JobExecutor
+from riparr_common.job_control import JobCancelled, JobControl
+from riparr_common.streams import StreamConsumer
+
+SLEEP = [sys.executable, '-c', 'import time; time.sleep(30)']
+
+class FakePublisher:
+    """Collects published events."""
+
+    def __init__(self):
+        self.events = []
+
+    def publish(self, stream, event, payload):
+        self.events.append((stream, event, payload['job_id']))
+
+def redis_client():
+    """
+    Return a Redis client, skipping the test if no server is reachable.
+    """
+    client = redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379'),
+                            decode_responses=True)
+    try:
+        client.ping()
+    except redis.ConnectionError:
+        pytest.skip("Redis not available")
+    return client
+
+def process_state(pid):
+    """
+    Return the single-letter state of *pid* from /proc.
+    """
+    with open(f'/proc/{pid}/stat', encoding='ascii') as handle:
+        return handle.read().rsplit(')', 1)[1].split()[0]
+
+def wait_for_state(pid, states, timeout=5):
+    """
+    Wait until *pid* is in one of *states*; returns the last state seen.
+    """
+    deadline = time.monotonic() + timeout
+    state = process_state(pid)
+    while state not in states and time.monotonic() < deadline:
+        time.sleep(0.02)
+        state = process_state(pid)
+    return state
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="reads /proc")
+def test_pause_resume_and_cancel_signal_the_job_process():
+    """
+    Pause stops the job's process, resume continues it and cancel terminates
+    it; later processes of the cancelled job are refused.
+    """
+    publisher = FakePublisher()
+    control = JobControl(None, 'enhance_events', publisher)
+    with control.job('job-1'):
+        process = control.popen('job-1', SLEEP)
+        try:
+            assert control.apply({'action': 'pause_job', 'job_id': 'job-1'})
+            assert wait_for_state(process.pid, 'T') == 'T'
+            assert not control.pause('job-1')  # already paused
+            assert control.apply({'action': 'resume_job', 'job_id': 'job-1'})
+            assert wait_for_state(process.pid, 'SR') in 'SR'
+
+            assert control.pause('job-1')
+            assert control.apply({'action': 'cancel_job', 'job_id': 'job-1'})
+            assert process.wait(5) == -15
+            with pytest.raises(JobCancelled):
+                control.popen('job-1', SLEEP)
+        finally:
+            process.kill()
+            process.wait()
+    assert [event for _stream, event, _job in publisher.events] == \
+        ['paused', 'resumed', 'paused', 'cancelled']
+    assert not control.apply({'action': 'pause_job', 'job_id': 'other-job'})
+
+def test_cancelled_job_is_refused_when_it_arrives_late():
+    """
+    A job cancelled before it reaches this replica is cancelled on arrival.
+    """
+    control = JobControl(None, 'transcode_events')
+    assert not control.cancel('job-2')
+    with control.job('job-2'):
+        with pytest.raises(JobCancelled):
+            control.check('job-2')
+    with control.job('job-3'):
+        control.check('job-3')
+
+def test_paused_job_releases_its_executor_slot():
+    """
+    While the only running job is paused a queued job runs; a cancelled
+    queued job never runs and is counted as cancelled.
+    """
+    executor = JobExecutor('test', max_workers=1, queue_size=10)
+    control = JobControl(None, 'rip_events', executor=executor)
+    running = threading.Event()
+    resumed = threading.Event()
+    ran = []
+    done = threading.Event()
+
+    def paused_job():
+        with control.job('long'):
+            running.set()
+            assert resumed.wait(5)
+            control.check('long')
+
+    executor.submit(paused_job, job_id='long')
+    assert running.wait(5)
+    executor.submit(ran.append, 'dropped', job_id='queued')
+    executor.submit(ran.append, 'short', job_id='short')
+    executor.submit(done.set, job_id='marker')
+    assert control.cancel('queued')
+    assert not done.wait(0.2)  # the only slot is taken
+
+    assert control.pause('long')
+    assert done.wait(5)
+    assert ran == ['short']
+    assert executor.stats()['paused'] == 1
+
+    control.cancel('long')
+    resumed.set()
+    deadline = time.monotonic() + 5
+    while executor.stats()['cancelled'] < 2 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    stats = executor.stats()
+    assert stats['cancelled'] == 2 and stats['paused'] == 0 and stats['failed'] == 0
+
+def test_dropped_job_runs_its_drop_callback_and_frees_its_id():
+    """
+    A cancelled queued job leaves the queue at once and runs its drop
+    callback; a later job with the same id runs normally, and a job that
+    already started is not dropped.
+    """
+    executor = JobExecutor('test', max_workers=1, queue_size=10)
+    release = threading.Event()
+    started = threading.Event()
+    ran, dropped = [], []
+
+    def blocker():
+        started.set()
+        assert release.wait(5)
+
+    executor.submit(blocker, job_id='blocker')
+    assert started.wait(5)
+    executor.submit(ran.append, 'first', job_id='drive-1', on_drop=lambda: dropped.append(1))
+    assert executor.cancel_queued('drive-1')
+    assert dropped == [1] and executor.stats()['queued'] == 0
+    assert not executor.cancel_queued('blocker')  # running, not queued
+
+    done = threading.Event()
+    executor.submit(ran.append, 'second', job_id='drive-1')
+    executor.submit(done.set)
+    release.set()
+    assert done.wait(5)
+    assert ran == ['second']
+
+def test_dropped_job_acks_its_stream_entry():
+    """
+    The stream entry of a job cancelled while queued is acknowledged, so it
+    is neither redelivered nor kept pending.
+    """
+    client = redis_client()
+    stream = f'test_drop_{uuid.uuid4().hex}'
+    client.xadd(stream, {'event': 'insert', 'data': json.dumps({'drive_id': 'd1'})})
+    consumer = StreamConsumer(client, stream, 'workers', consumer='c1', block_ms=100)
+    executor = JobExecutor('test', max_workers=1, queue_size=10)
+    control = JobControl(None, 'rip_events', executor=executor)
+    release = threading.Event()
+    try:
+        executor.submit(release.wait, 5, job_id='blocker')
+        (msg_id, data), = consumer.read()
+        executor.submit(consumer.acking(msg_id, lambda data: None), data, job_id='job-1',
+                        on_drop=functools.partial(consumer.ack, msg_id))
+        assert control.cancel('job-1')
+        assert client.xpending(stream, 'workers')['pending'] == 0
+        assert not consumer._in_flight  # pylint: disable=protected-access
+    finally:
+        release.set()
+        client.delete(stream)
+
+def test_async_runner_drops_cancelled_queued_job():
+    """
+    Cancelling a job queued on the asyncio runner from another thread awaits
+    its drop callback and keeps later jobs with the same id.
+    """
+    async def scenario():
+        dropped, ran = [], []
+        release = asyncio.Event()
+
+        async def ack():
+            dropped.append('ack')
+
+        async with aio.AsyncJobRunner('test', max_workers=1, queue_size=5) as runner:
+            control = JobControl(None, 'rip_events', executor=runner)
+            await runner.submit(release.wait, job_id='blocker')
+            await runner.submit(asyncio.sleep, 0, job_id='job-1', on_drop=ack)
+            await asyncio.sleep(0.05)
+            assert await asyncio.to_thread(control.cancel, 'job-1')
+
+            async def record():
+                ran.append('job-1')
+
+            await runner.submit(record, job_id='job-1')
+            release.set()
+            while runner.stats()['running'] or runner.stats()['queued']:
+                await asyncio.sleep(0.02)
+            return dropped, ran, runner.stats()
+
+    dropped, ran, stats = asyncio.run(scenario())
+    assert dropped == ['ack'] and ran == ['job-1']
+    assert stats['cancelled'] == 1 and stats['completed'] == 2
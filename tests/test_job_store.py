@@ -0,0 +1,80 @@
+import os
+
+import pytest
+import redis
+
+from riparr_common.job_store import JobStore, stage_of
+
+def redis_client():
+    """
+    Return a Redis client, skipping the test if no server is reachable.
+    """
+    client = redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379'),
+                            decode_responses=True)
+    try:
+        client.ping()
+    except redis.ConnectionError:
+        pytest.skip("Redis not available")
+    return client
+
+def test_stage_of_known_streams_only():
+    """
+    Only the pipeline stage streams carry job state.
+    """
+    assert stage_of('enhance_events') == 'enhance'
+    assert stage_of('orchestrator_events') is None
+    assert stage_of('drive_events') is None
+
+def test_state_transitions():
+    """
+    Queueing, starts and intermediate completions keep a job active; the
+    final stage completes it, a failure fails it and a cancel cancels it from
+    any stage.
+    """
+    store = JobStore(client=None, final_stage='blackhole')
+    assert store.state_after('rip', 'queued') == 'active'
+    assert store.state_after('rip', 'start') == 'active'
+    assert store.state_after('rip', 'progress') is None
+    assert store.state_after('metadata', 'complete') == 'active'
+    assert store.state_after('blackhole', 'complete') == 'completed'
+    assert store.state_after('rip', 'duplicate') == 'completed'
+    assert store.state_after('transcode', 'failed') == 'failed'
+    assert store.state_after('enhance', 'cancelled') == 'cancelled'
+    assert store.state_after('enhance', 'paused') is None
+
+def test_jobs_move_between_state_indexes():
+    """
+    Recorded events move a job between the state sorted sets atomically.
+    """
+    client = redis_client()
+    store = JobStore(client, final_stage='enhance', ttl=60)
+    prefix = 'test-job-store-'
+
+    def record(stream, event, job, **payload):
+        pipe = client.pipeline()
+        store.record(pipe, stream, event, {'job_id': prefix + job, **payload})
+        pipe.execute()
+
+    try:
+        record('rip_events', 'start', 'a')
+        record('rip_events', 'progress', 'a', percentage=40)
+        record('rip_events', 'start', 'b')
+        record('rip_events', 'failed', 'b', error='MakeMKV failed')
+        job = store.get(prefix + 'a')
+        assert job['state'] == 'active'
+        assert job['stage'] == 'rip'
+        assert job['progress'] == 40
+        assert store.get(prefix + 'b')['error'] == 'MakeMKV failed'
+        assert prefix + 'a' in [j['job_id'] for j in store.list('active')]
+        assert prefix + 'b' in [j['job_id'] for j in store.list('failed')]
+
+        record('enhance_events', 'complete', 'a')
+        assert store.get(prefix + 'a')['state'] == 'completed'
+        assert prefix + 'a' not in [j['job_id'] for j in store.list('active')]
+        assert prefix + 'a' in [j['job_id'] for j in store.list('completed')]
+        assert client.ttl(JobStore.PREFIX + prefix + 'a') > 0
+    finally:
+        for job in ('a', 'b'):
+            client.delete(JobStore.PREFIX + prefix + job)
+            for index in ('active', 'completed', 'failed', 'cancelled', 'all'):
+                client.zrem(JobStore.INDEX + index, prefix + job)
@@ -0,0 +1,125 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+
+import pytest
+import redis
+
+from riparr_common import metrics
+from riparr_common.executor import JobExecutor
+
+def redis_client():
+    """
+    Return a Redis client, skipping the test if no server is reachable.
+    """
+    client = redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379'),
+                            decode_responses=True)
+    try:
+        client.ping()
+    except redis.ConnectionError:
+        pytest.skip("Redis not available")
+    return client
+
+def test_text_exposition():
+    """
+    Counters, gauges and histograms render in the Prometheus text format with
+    cumulative buckets.
+    """
+    registry = metrics.Registry()
+    jobs = registry.counter('test_jobs_total', 'Jobs.', ('stage',))
+    jobs.inc(stage='rip')
+    jobs.inc(2, stage='rip')
+    registry.gauge('test_depth', 'Depth.').set(1.5)
+    latency = registry.histogram('test_seconds', 'Latency.', ('stage',), buckets=(1, 10))
+    for value in (0.5, 5, 50):
+        latency.observe(value, stage='enhance')
+    with pytest.raises(ValueError):
+        jobs.inc(stage='rip', extra='x')
+
+    text = registry.render()
+    assert '# TYPE test_jobs_total counter\ntest_jobs_total{stage="rip"} 3\n' in text
+    assert 'test_depth 1.5\n' in text
+    assert 'test_seconds_bucket{stage="enhance",le="1"} 1\n' in text
+    assert 'test_seconds_bucket{stage="enhance",le="10"} 2\n' in text
+    assert 'test_seconds_bucket{stage="enhance",le="+Inf"} 3\n' in text
+    assert 'test_seconds_sum{stage="enhance"} 55.5\n' in text
+    assert 'test_seconds_count{stage="enhance"} 3\n' in text
+
+def test_metrics_endpoint_and_collectors():
+    """
+    The HTTP endpoint runs the collectors on each scrape and 404s other paths.
+    """
+    registry = metrics.Registry()
+    scrapes = registry.counter('test_scrapes_total', 'Scrapes.')
+    registry.add_collector('scrapes', scrapes.inc)
+    registry.add_collector('broken', lambda: 1 / 0)
+    server = metrics.serve(0, registry, host='127.0.0.1')
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+    try:
+        for expected in (1, 2):
+            with urllib.request.urlopen(url + '/metrics', timeout=5) as response:
+                assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+                assert f'test_scrapes_total {expected}\n' in response.read().decode()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(url + '/other', timeout=5)
+    finally:
+        server.shutdown()
+
+@pytest.mark.skipif(not os.path.isdir('/proc'), reason="needs /proc")
+def test_subprocesses_are_sampled_from_proc():
+    """
+    Live child processes are counted with their CPU time and resident memory.
+    """
+    with subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)']) as child:
+        try:
+            metrics.collect_processes()
+            command = metrics.read_proc_stat(child.pid)[0]
+            assert metrics.SUBPROCESSES.value(command=command) >= 1
+            assert metrics.SUBPROCESS_RSS.value(command=command) > 0
+            assert metrics.PROCESS_RSS.value() > 0
+        finally:
+            child.kill()
+
+def test_executor_records_job_durations():
+    """
+    Job run and wait times are observed per worker and outcome.
+    """
+    name = f'test-{uuid.uuid4().hex}'
+    executor = JobExecutor(name, max_workers=1, queue_size=5)
+    done = threading.Event()
+
+    def fail():
+        raise RuntimeError("boom")
+
+    executor.submit(fail)
+    executor.submit(done.set)
+    assert done.wait(5)
+    while executor.stats()['running']:
+        time.sleep(0.01)
+    assert metrics.JOB_DURATION.count(worker=name, outcome='failed') == 1
+    assert metrics.JOB_DURATION.count(worker=name, outcome='completed') == 1
+    assert metrics.JOB_WAIT.count(worker=name) == 2
+
+def test_stream_lag():
+    """
+    Lag counts the entries after the group's last delivered one and the age
+    difference between it and the stream tip.
+    """
+    client = redis_client()
+    stream = f'test_metrics_{uuid.uuid4().hex}'
+    try:
+        client.xadd(stream, {'data': '{}'}, id='1000-0')
+        client.xgroup_create(stream, 'workers', id='0')
+        client.xreadgroup('workers', 'c1', {stream: '>'}, count=1)
+        client.xadd(stream, {'data': '{}'}, id='4000-0')
+        client.xadd(stream, {'data': '{}'}, id='6000-0')
+        metrics.collect_stream_lag(client, [(stream, 'workers')])
+        assert metrics.STREAM_LAG_ENTRIES.value(stream=stream, group='workers') == 2
+        assert metrics.STREAM_LAG_SECONDS.value(stream=stream, group='workers') == 5
+        assert metrics.STREAM_PENDING.value(stream=stream, group='workers') == 1
+    finally:
+        client.delete(stream)
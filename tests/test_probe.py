@@ -0,0 +1,58 @@
+import pytest
+import redis
+
+from riparr_common import probe as probe_module
+from riparr_common.probe import ProbeCache, audio_streams, duration, is_hdr
+
+SAMPLE = {
+    'streams': [
+        {'index': 0, 'codec_type': 'video', 'color_primaries': 'bt2020'},
+        {'index': 1, 'codec_type': 'audio', 'channels': 6},
+        {'index': 2, 'codec_type': 'audio', 'channels': 2},
+    ],
+    'format': {'duration': '5400.5'},
+}
+
+def test_probe_helpers():
+    """
+    Stream and format helpers read the cached ffprobe structure.
+    """
+    assert is_hdr(SAMPLE)
+    assert not is_hdr({'streams': [{'codec_type': 'video', 'color_primaries': 'bt709'}]})
+    assert [s['channels'] for s in audio_streams(SAMPLE)] == [6, 2]
+    assert duration(SAMPLE) == 5400.5
+    assert duration({'format': {}}) is None
+
+def test_event_probes_skip_lookup(tmp_path, monkeypatch):
+    """
+    Probe data carried in an event is used without touching ffprobe or Redis.
+    """
+    monkeypatch.setattr(probe_module, 'run_ffprobe', lambda path: pytest.fail("re-probed"))
+    cache = ProbeCache(client=None)
+    path = str(tmp_path / 'title.mkv')
+    assert cache.probe(path, {path: SAMPLE}) is SAMPLE
+
+def test_file_is_probed_once(tmp_path, monkeypatch):
+    """
+    Repeated lookups of an unchanged file hit the cache; a rewrite re-probes.
+    """
+    client = redis.from_url('redis://localhost:6379', decode_responses=True)
+    try:
+        client.ping()
+    except redis.ConnectionError:
+        pytest.skip("Redis not available")
+
+    calls = []
+    monkeypatch.setattr(probe_module, 'run_ffprobe',
+                        lambda path: calls.append(path) or SAMPLE)
+    media = tmp_path / 'title.mkv'
+    media.write_bytes(b'x' * 100)
+
+    cache = ProbeCache(client, ttl=60)
+    assert cache.probe(str(media)) == SAMPLE
+    assert cache.probe(str(media)) == SAMPLE
+    assert len(calls) == 1
+
+    media.write_bytes(b'x' * 200)
+    cache.probe(str(media))
+    assert len(calls) == 2
@@ -0,0 +1,105 @@
+import asyncio
+import json
+
+from riparr_common.publisher import EventPublisher
+
+
+class RecordingClient:
+    """Collects the entries written through pipelines, one list per round trip."""
+
+    def __init__(self):
+        self.round_trips = []
+
+    def pipeline(self, transaction=True):
+        client = self
+
+        class Pipeline:
+            def __init__(self):
+                self.entries = []
+
+            def xadd(self, stream, fields):
+                self.entries.append((stream, fields['event'], json.loads(fields['data'])))
+
+            def execute(self):
+                client.round_trips.append(self.entries)
+
+        return Pipeline()
+
+
+class AsyncRecordingClient(RecordingClient):
+    """:class:`RecordingClient` whose pipelines execute as coroutines, like ``redis.asyncio``."""
+
+    def pipeline(self, transaction=True):
+        pipe = super().pipeline(transaction)
+        execute = pipe.execute
+
+        async def _execute():
+            execute()
+
+        pipe.execute = _execute
+        return pipe
+
+
+def test_progress_is_coalesced_per_job():
+    """
+    Many progress lines for one job collapse into the latest due update.
+    """
+    client = RecordingClient()
+    publisher = EventPublisher(client, min_delta=5, min_interval=0, flush_interval=3600)
+    for pct in range(0, 13):
+        publisher.progress('rip_events', 'job-1', pct)
+    publisher.progress('rip_events', 'job-2', 40)
+    assert publisher.flush() == 2
+    assert len(client.round_trips) == 1
+    assert {(e[2]['job_id'], e[2]['percentage']) for e in client.round_trips[0]} == {
+        ('job-1', 12), ('job-2', 40)}
+
+    publisher.progress('rip_events', 'job-1', 14)
+    assert publisher.flush() == 0  # below min_delta, kept pending
+
+
+def test_progress_going_back_is_due():
+    """
+    A drop in percentage, e.g. a restarted pass, is published however small.
+    """
+    client = RecordingClient()
+    publisher = EventPublisher(client, min_delta=5, min_interval=0, flush_interval=3600)
+    publisher.progress('enhance_events', 'job-1', 60)
+    assert publisher.flush() == 1
+    publisher.progress('enhance_events', 'job-1', 58)
+    assert publisher.flush() == 1
+    assert client.round_trips[-1][0][2]['percentage'] == 58
+
+def test_terminal_event_flushes_pending_progress_first():
+    """
+    A complete event is preceded by the job's pending progress in the same round trip.
+    """
+    client = RecordingClient()
+    publisher = EventPublisher(client, min_delta=5, min_interval=3600, flush_interval=3600)
+    publisher.progress('rip_events', 'job-1', 10)
+    publisher.flush()
+    publisher.progress('rip_events', 'job-1', 100)
+    assert publisher.flush() == 0  # held back by min_interval
+
+    publisher.publish('rip_events', 'complete', {'job_id': 'job-1', 'output_files': []})
+    assert [(e[1], e[2].get('percentage')) for e in client.round_trips[-1]] == [
+        ('progress', 100), ('complete', None)]
+
+
+def test_async_publish_uses_the_async_client():
+    """
+    publish_async sends through the asyncio client, after the job's pending
+    progress, and leaves the synchronous client unused.
+    """
+    client = RecordingClient()
+    async_client = AsyncRecordingClient()
+    publisher = EventPublisher(client, min_delta=5, min_interval=3600, flush_interval=3600,
+                               async_client=async_client)
+    publisher.progress('transcode_events', 'job-1', 60)
+    asyncio.run(publisher.publish_async('transcode_events', 'complete', {'job_id': 'job-1'}))
+    asyncio.run(publisher.fail_async('transcode_events', 'job-2', ValueError('boom')))
+
+    assert client.round_trips == []
+    assert [[(e[1], e[2]['job_id']) for e in trip] for trip in async_client.round_trips] == [
+        [('progress', 'job-1'), ('complete', 'job-1')], [('failed', 'job-2')]]
+    assert async_client.round_trips[1][0][2]['error'] == 'boom'
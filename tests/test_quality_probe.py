@@ -0,0 +1,110 @@
+import os
+import shutil
+import subprocess
+import sys
+import uuid
+
+import pytest
+import redis
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                'services', 'transcode_worker'))
+
+import quality_probe  # noqa: E402
+from quality_probe import QualityProbe, encode_score, parse_score, sample_positions, \
+    search_quality  # noqa: E402
+
+def redis_client():
+    """
+    Return a Redis client, skipping the test if no server is reachable.
+    """
+    client = redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379'),
+                            decode_responses=True)
+    try:
+        client.ping()
+    except redis.ConnectionError:
+        pytest.skip("Redis not available")
+    return client
+
+def test_scores_and_sample_positions():
+    """
+    Overall SSIM and PSNR scores are read from ffmpeg's summary lines, and
+    samples are spread over the title.
+    """
+    ssim = '[Parsed_ssim_4 @ 0x1] SSIM Y:0.991 (20.5) U:0.995 (23.1) V:0.994 (22.6) All:0.992 (21.2)'
+    psnr = '[Parsed_psnr_4 @ 0x1] PSNR y:41.2 u:44.0 v:43.8 average:42.05 min:39.1 max:45.3'
+    assert parse_score('ssim', ssim) == 0.992
+    assert parse_score('psnr', psnr) == 42.05
+    assert parse_score('psnr', 'PSNR y:inf u:inf v:inf average:inf min:inf max:inf') == float('inf')
+    assert parse_score('ssim', psnr) is None
+
+    assert sample_positions(100.0, 3, 4) == [23.0, 48.0, 73.0]
+    assert sample_positions(10.0, 3, 4) == [0.0]
+    assert sample_positions(None, 3, 4) == [0.0]
+
+def test_search_picks_the_cheapest_quality_meeting_the_target():
+    """
+    The binary search returns the highest candidate that meets the target,
+    scoring only a few candidates; the best candidate is the fallback.
+    """
+    scored = []
+
+    def score(quality):
+        scored.append(quality)
+        return 1 - quality / 1000
+
+    assert search_quality([20, 22, 24, 26, 28, 30, 32, 34], score, 0.973)[0] == 26
+    assert len(scored) == 3
+    quality, scores = search_quality([30, 20, 25], score, 0.99)
+    assert quality == 20 and set(scores) == {20, 25}
+
+def test_choice_is_cached_per_file_and_encoder(tmp_path, monkeypatch):
+    """
+    A second search for the same file and encoder is answered from Redis;
+    another encoder or changed content searches again.
+    """
+    client = redis_client()
+    source = tmp_path / 'title.mkv'
+    source.write_bytes(b'video')
+    searches = []
+
+    def fake_cut(input_file, work_dir, positions, seconds, popen=None):
+        searches.append(input_file)
+        return ['sample']
+
+    monkeypatch.setattr(quality_probe, 'cut_samples', fake_cut)
+    monkeypatch.setattr(quality_probe, 'encode_score',
+                        lambda sample, video_args, *args: 1 - video_args[-1] / 1000)
+    probe = QualityProbe(client, candidates=(20, 24, 28), target=0.975)
+    probe.PREFIX = f'test_quality_{uuid.uuid4().hex}:'
+    try:
+        first = probe.choose(str(source), 60.0, lambda quality: [quality], 'libx265')
+        assert first['quality'] == 24 and not first['cached']
+        second = probe.choose(str(source), 60.0, lambda quality: [quality], 'libx265')
+        assert second == {**first, 'cached': True}
+        probe.choose(str(source), 60.0, lambda quality: [quality], 'hevc_vaapi')
+        source.write_bytes(b'other video')
+        probe.choose(str(source), 60.0, lambda quality: [quality], 'libx265')
+        assert len(searches) == 3
+    finally:
+        for key in client.scan_iter(probe.PREFIX + '*'):
+            client.delete(key)
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg not available")
+def test_sample_encodes_rank_quality(tmp_path):
+    """
+    A lossless encode scores perfectly, and a higher CRF scores lower.
+    """
+    clip = str(tmp_path / 'clip.mkv')
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', 'testsrc2=duration=6:size=320x240:rate=24',
+        '-vf', 'noise=alls=20:allf=t', '-c:v', 'libx264', '-crf', '10', '-g', '24', clip
+    ], check=True)
+    (sample,) = quality_probe.cut_samples(clip, str(tmp_path), [2.0], 2)
+
+    assert encode_score(sample, ['-c:v', 'libx264', '-qp', '0'], 'psnr', str(tmp_path)) \
+        == float('inf')
+    scores = [encode_score(sample, ['-c:v', 'libx264', '-crf', str(crf)], 'ssim', str(tmp_path))
+              for crf in (18, 34)]
+    assert 0 < scores[1] < scores[0] < 1
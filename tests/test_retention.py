@@ -0,0 +1,67 @@
+import json
+
+import pytest
+import redis
+
+from riparr_common.retention import StreamTrimmer, format_id, parse_id
+
+STREAM = 'test_retention_events'
+
+
+@pytest.fixture
+def r():
+    """Redis client with a clean test stream."""
+    client = redis.from_url('redis://localhost:6379', decode_responses=True)
+    try:
+        client.ping()
+    except redis.ConnectionError:
+        pytest.skip("Redis not available")
+    client.delete(STREAM)
+    yield client
+    client.delete(STREAM)
+
+def fill(client, count):
+    return [client.xadd(STREAM, {'data': json.dumps({'n': i})}) for i in range(count)]
+
+def test_id_round_trip():
+    """
+    Stream ids compare numerically, not as strings.
+    """
+    assert parse_id('1700000000000-10') > parse_id('1700000000000-9')
+    assert format_id(parse_id('5-3')) == '5-3'
+
+def test_maxlen_without_groups(r):
+    """
+    Streams nobody consumes through a group are trimmed to their maxlen.
+    """
+    fill(r, 500)
+    StreamTrimmer(r, {STREAM: {'maxlen': 100}}).trim(STREAM)
+    # Approximate trimming may keep a little more, never less
+    assert 100 <= r.xlen(STREAM) < 500
+
+def test_pending_entries_are_kept(r):
+    """
+    Entries a consumer group has not acknowledged survive trimming.
+    """
+    ids = fill(r, 300)
+    r.xgroup_create(STREAM, 'workers', id='0')
+    delivered = r.xreadgroup('workers', 'a', {STREAM: '>'}, count=200)[0][1]
+    for msg_id, _fields in delivered[:150]:
+        r.xack(STREAM, 'workers', msg_id)
+
+    StreamTrimmer(r, {STREAM: {'maxlen': 10}}).trim(STREAM)
+
+    remaining = [msg_id for msg_id, _ in r.xrange(STREAM)]
+    assert ids[150] in remaining, "Oldest pending entry was trimmed"
+    assert r.xpending(STREAM, 'workers')['pending'] == 50
+
+def test_stats_report_length_and_groups(r):
+    """
+    Stats expose stream length, memory and group backlog.
+    """
+    fill(r, 5)
+    r.xgroup_create(STREAM, 'workers', id='0')
+    stats = StreamTrimmer(r, {STREAM: {}}).stats()[STREAM]
+    assert stats['length'] == 5
+    assert stats['memory_bytes'] > 0
+    assert 'workers' in stats['groups']
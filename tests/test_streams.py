@@ -0,0 +1,130 @@
+import json
+
+import pytest
+import redis
+
+from riparr_common.streams import StreamConsumer
+
+STREAM = 'test_consumer_events'
+
+
+@pytest.fixture
+def r():
+    """Redis client with a clean test stream."""
+    client = redis.from_url('redis://localhost:6379', decode_responses=True)
+    try:
+        client.ping()
+    except redis.ConnectionError:
+        pytest.skip("Redis not available")
+    client.delete(STREAM)
+    yield client
+    client.delete(STREAM)
+
+def publish(client, count):
+    for i in range(count):
+        client.xadd(STREAM, {'event': 'complete', 'data': json.dumps({'job_id': f'job_{i}'})})
+
+def test_replicas_split_work(r):
+    """
+    Two consumers of the same group never receive the same entry.
+    """
+    publish(r, 10)
+    first = StreamConsumer(r, STREAM, 'workers', consumer='a', count=3, block_ms=100)
+    second = StreamConsumer(r, STREAM, 'workers', consumer='b', count=3, block_ms=100)
+
+    seen = []
+    for _ in range(4):
+        for consumer in (first, second):
+            for msg_id, payload in consumer.read():
+                seen.append(payload['job_id'])
+                consumer.ack(msg_id)
+
+    assert sorted(seen) == sorted(f'job_{i}' for i in range(10))
+    assert r.xpending(STREAM, 'workers')['pending'] == 0
+
+def test_outer_event_field_is_merged(r):
+    """
+    The stream-level ``event`` field is visible in the decoded payload.
+    """
+    publish(r, 1)
+    consumer = StreamConsumer(r, STREAM, 'workers', consumer='a', block_ms=100)
+    [(_msg_id, payload)] = consumer.read()
+    assert payload == {'job_id': 'job_0', 'event': 'complete'}
+
+def test_restart_recovers_pending(r):
+    """
+    Entries read but not acknowledged are redelivered after a restart.
+    """
+    publish(r, 5)
+    crashed = StreamConsumer(r, STREAM, 'workers', consumer='a', count=5, block_ms=100)
+    assert len(crashed.read()) == 5  # never acked
+
+    restarted = StreamConsumer(r, STREAM, 'workers', consumer='a', count=2, block_ms=100)
+    recovered = []
+    for _ in range(4):
+        for msg_id, payload in restarted.read():
+            recovered.append(payload['job_id'])
+            restarted.ack(msg_id)
+
+    assert recovered == [f'job_{i}' for i in range(5)]
+
+def test_abandoned_entries_are_claimed(r):
+    """
+    Another replica takes over entries a dead consumer left idle.
+    """
+    publish(r, 2)
+    dead = StreamConsumer(r, STREAM, 'workers', consumer='dead', count=2, block_ms=100)
+    assert len(dead.read()) == 2
+
+    survivor = StreamConsumer(r, STREAM, 'workers', consumer='alive', block_ms=100,
+                              claim_idle_ms=0)
+    claimed = [payload['job_id'] for _msg_id, payload in survivor.read()]
+    assert claimed == ['job_0', 'job_1']
+
+def test_claiming_resumes_from_the_returned_cursor(r):
+    """
+    A pending list longer than ``count`` is claimed batch by batch.
+    """
+    publish(r, 5)
+    dead = StreamConsumer(r, STREAM, 'workers', consumer='dead', count=5, block_ms=100)
+    assert len(dead.read()) == 5
+
+    survivor = StreamConsumer(r, STREAM, 'workers', consumer='alive', count=2, block_ms=100,
+                              claim_idle_ms=0)
+    batches = [[payload['job_id'] for _msg_id, payload in survivor.read()] for _ in range(3)]
+    assert batches == [['job_0', 'job_1'], ['job_2', 'job_3'], ['job_4']]
+
+def test_lost_group_is_recreated(r):
+    """
+    Reading continues on a fresh group after the stream was deleted.
+    """
+    publish(r, 1)
+    consumer = StreamConsumer(r, STREAM, 'workers', consumer='a', block_ms=100)
+    [(msg_id, _payload)] = consumer.read()
+    consumer.ack(msg_id)
+
+    r.delete(STREAM)
+    r.xadd(STREAM, {'event': 'complete', 'data': json.dumps({'job_id': 'after_reset'})})
+    _msg_id, payload = next(consumer.messages())
+    assert payload['job_id'] == 'after_reset'
+
+class Stop(BaseException):
+    """Ends :meth:`StreamConsumer.run` from inside a handler."""
+
+def test_failed_handler_stops_heartbeat(r):
+    """
+    An entry whose handler raised stays pending but is no longer kept alive.
+    """
+    publish(r, 2)
+    consumer = StreamConsumer(r, STREAM, 'workers', consumer='a', count=1, block_ms=100)
+
+    def handler(payload):
+        if payload['job_id'] == 'job_1':
+            raise Stop()
+        raise ValueError("boom")
+
+    with pytest.raises(Stop):
+        consumer.run(handler)
+    failed = r.xpending_range(STREAM, 'workers', '-', '+', 10)[0]['message_id']
+    assert failed not in consumer._in_flight
+    assert r.xpending(STREAM, 'workers')['pending'] == 2
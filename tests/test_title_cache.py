@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+import redis
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                'services', 'metadata_worker'))
+
+from title_cache import TitleCache, source_key  # noqa: E402
+
+def test_source_key_ignores_case_and_punctuation():
+    """
+    Disc title spellings of the same film share a cache key.
+    """
+    assert source_key('THE_MATRIX') == source_key('The Matrix') == 'the matrix'
+    assert source_key('Alien: Covenant (2017)') == 'alien covenant 2017'
+
+def test_cache_round_trip_and_eviction():
+    """
+    Cached titles are returned per model; the least recently used entry is evicted.
+    """
+    client = redis.from_url('redis://localhost:6379', decode_responses=True)
+    try:
+        client.ping()
+    except redis.ConnectionError:
+        pytest.skip("Redis not available")
+    client.delete(TitleCache.INDEX)
+
+    cache = TitleCache(client, ttl=60, max_entries=2)
+    cache.set_many({'THE_MATRIX': {'normalized_title': 'The Matrix (1999)'}}, 'llama2')
+    assert cache.get_many(['The Matrix', 'Heat'], 'llama2') == {
+        'The Matrix': {'normalized_title': 'The Matrix (1999)'}}
+    assert cache.get_many(['The Matrix'], 'mistral') == {}
+
+    cache.set_many({'Heat': {'normalized_title': 'Heat (1995)'}}, 'llama2')
+    cache.get_many(['The Matrix'], 'llama2')  # Heat is now least recently used
+    cache.set_many({'Ronin': {'normalized_title': 'Ronin (1998)'}}, 'llama2')
+    assert set(cache.get_many(['The Matrix', 'Heat', 'Ronin'], 'llama2')) == {
+        'The Matrix', 'Ronin'}
@@ -0,0 +1,125 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+import redis
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                'services', 'enhance_worker'))
+
+from title_join import TitleJoin  # noqa: E402
+
+def redis_client():
+    """
+    Return a Redis client, skipping the test if no server is reachable.
+    """
+    client = redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379'),
+                            decode_responses=True)
+    try:
+        client.ping()
+    except redis.ConnectionError:
+        pytest.skip("Redis not available")
+    return client
+
+def test_title_is_processed_once_across_events():
+    """
+    A title running for its title_complete event is waited for, not redone,
+    by the job's rip.complete; later calls reuse the stored result.
+    """
+    client = redis_client()
+    join = TitleJoin(client, poll_interval=0.05)
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        calls.append('slow')
+        started.set()
+        release.wait(5)
+        return {'output': '/enhanced/t00.mkv'}
+
+    try:
+        assert join.begin('test-join')
+        assert not join.begin('test-join')
+        title = threading.Thread(target=join.run, args=('test-join', '/rips/t00.mkv', slow))
+        title.start()
+        started.wait(5)
+        threading.Timer(0.2, release.set).start()
+        result = join.run('test-join', '/rips/t00.mkv', lambda: calls.append('again'))
+        title.join()
+        assert result == {'output': '/enhanced/t00.mkv'}
+        assert calls == ['slow']
+        assert join.results('test-join') == {'/rips/t00.mkv': result}
+
+        join.finish('test-join')
+        assert join.finished('test-join')
+        assert join.results('test-join') == {}
+    finally:
+        client.delete('enhance_titles:test-join', 'enhance_titles:test-join:started',
+                      'enhance_titles:test-join:done')
+
+def test_failed_title_is_retried_by_the_waiter():
+    """
+    When the running call fails, a waiting caller runs the title itself.
+    """
+    client = redis_client()
+    join = TitleJoin(client, poll_interval=0.05)
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("upscaler crashed")
+
+    def run_failing():
+        with pytest.raises(RuntimeError):
+            join.run('test-join-retry', '/rips/t00.mkv', failing)
+
+    try:
+        title = threading.Thread(target=run_failing)
+        title.start()
+        started.wait(5)
+        threading.Timer(0.2, release.set).start()
+        assert join.run('test-join-retry', '/rips/t00.mkv',
+                        lambda: {'output': '/rips/t00.mkv'}) == {'output': '/rips/t00.mkv'}
+        title.join()
+    finally:
+        client.delete('enhance_titles:test-join-retry')
+
+def test_replicas_share_a_title_and_take_over_an_expired_claim():
+    """
+    A second replica waits for the title the first one runs; a claim whose
+    owner stopped renewing it expires and the title is run again.
+    """
+    client = redis_client()
+    first = TitleJoin(client, poll_interval=0.05)
+    second = TitleJoin(client, poll_interval=0.05)
+    calls = []
+    started = threading.Event()
+
+    def slow():
+        calls.append('first')
+        started.set()
+        time.sleep(0.3)
+        return {'output': '/enhanced/t00.mkv'}
+
+    try:
+        title = threading.Thread(target=first.run, args=('test-join-replicas', '/rips/t00.mkv',
+                                                         slow))
+        title.start()
+        started.wait(5)
+        assert second.run('test-join-replicas', '/rips/t00.mkv',
+                          lambda: calls.append('second')) == {'output': '/enhanced/t00.mkv'}
+        title.join()
+        assert calls == ['first']
+
+        # A claim left behind by a replica that died mid-title
+        client.set('enhance_titles:test-join-replicas:claim:/rips/t01.mkv', 'dead', ex=1)
+        assert second.run('test-join-replicas', '/rips/t01.mkv',
+                          lambda: {'output': '/enhanced/t01.mkv'}) == {
+            'output': '/enhanced/t01.mkv'}
+    finally:
+        client.delete('enhance_titles:test-join-replicas')
@@ -0,0 +1,113 @@
+import asyncio
+import json
+
+import pytest
+
+from riparr_common import tracing
+from riparr_common.job_control import JobCancelled
+from riparr_common.publisher import EventPublisher
+from riparr_common.tracing import FileExporter, Tracer
+
+class RecordingClient:
+    """Collects the payloads written through pipelines."""
+
+    def __init__(self):
+        self.events = []
+
+    def pipeline(self, transaction=True):
+        client = self
+
+        class Pipeline:
+            def xadd(self, stream, fields):
+                client.events.append((stream, fields['event'], json.loads(fields['data'])))
+
+            def execute(self):
+                pass
+
+        return Pipeline()
+
+def test_context_follows_the_job_through_the_stages(tmp_path):
+    """
+    Events published inside a span carry its context; the next stage's span
+    continues the trace with the publishing span as parent.
+    """
+    exporter = FileExporter(str(tmp_path / 'traces.jsonl'))
+    client = RecordingClient()
+    publisher = EventPublisher(client, flush_interval=3600)
+    rip = Tracer('rip-worker', exporter)
+    enhance = Tracer('enhance-worker', exporter)
+
+    def rip_handler(data):
+        tracing.annotate(job_id='job-1')
+        publisher.publish('rip_events', 'complete', {'job_id': 'job-1', 'output_files': []})
+
+    insert = {'event': 'insert', 'drive_id': 'd1',
+              'trace': {'trace_id': 'a' * 32, 'sent_at': 1.0}}
+    rip.traced('rip', rip_handler)(insert)
+    publisher.publish('rip_events', 'start', {'job_id': 'job-2'})  # outside any span
+
+    (_, _, complete), (_, _, untraced) = client.events
+    assert 'trace' not in untraced
+    assert complete['trace']['trace_id'] == 'a' * 32
+    enhance.traced('enhance', lambda data: None)({'event': 'complete', **complete})
+
+    rip_span, enhance_span = exporter.load('job-1')
+    assert rip_span['name'] == 'rip' and rip_span['queued_at'] == 1.0
+    assert rip_span['parent_id'] is None and rip_span['job_id'] == 'job-1'
+    assert enhance_span['trace_id'] == 'a' * 32
+    assert enhance_span['parent_id'] == rip_span['span_id']
+    assert enhance_span['queued_at'] == complete['trace']['sent_at']
+    assert enhance_span['start'] <= enhance_span['end']
+
+def test_span_status_and_event_filter(tmp_path):
+    """
+    Failed and cancelled handlers are recorded as such; events outside the
+    filter run without a span.
+    """
+    exporter = FileExporter(str(tmp_path / 'traces.jsonl'))
+    tracer = Tracer('transcode-worker', exporter)
+
+    def fail(data):
+        raise (JobCancelled if data['job_id'] == 'job-c' else RuntimeError)("stop")
+
+    for job_id in ('job-c', 'job-f'):
+        with pytest.raises(Exception):
+            tracer.traced('transcode', fail)({'event': 'complete', 'job_id': job_id})
+    tracer.traced('transcode', lambda data: None, events=('complete',))(
+        {'event': 'progress', 'job_id': 'job-p'})
+
+    assert [s['status'] for s in exporter.load('job-c')] == ['cancelled']
+    assert [s['status'] for s in exporter.load('job-f')] == ['error']
+    assert exporter.load('job-p') == []
+
+def test_async_spans_are_exported(tmp_path):
+    """
+    Coroutine handlers get their own span, visible to threads they start.
+    """
+    exporter = FileExporter(str(tmp_path / 'traces.jsonl'))
+    tracer = Tracer('rip-worker', exporter)
+
+    async def handler(data):
+        await asyncio.to_thread(tracing.annotate, job_id='job-a', titles=3)
+
+    asyncio.run(tracer.traced_async('rip', handler)({'event': 'insert'}))
+    (span,) = exporter.load('job-a')
+    assert span['attrs'] == {'titles': 3} and span['status'] == 'ok'
+
+def test_waterfall_shows_wait_and_run_per_stage():
+    """
+    Each span becomes a row of queue wait and run time on a shared timeline,
+    followed by per-stage totals.
+    """
+    spans = [
+        {'trace_id': 't', 'name': 'rip', 'event': 'insert', 'job_id': 'job-1',
+         'queued_at': 0.0, 'start': 0.0, 'end': 60.0, 'status': 'ok'},
+        {'trace_id': 't', 'name': 'enhance', 'event': 'complete', 'job_id': 'job-1',
+         'queued_at': 60.0, 'start': 80.0, 'end': 100.0, 'status': 'ok'},
+    ]
+    lines = tracing.waterfall(spans, width=10).splitlines()
+    assert lines[0] == "Job job-1  trace t  2 spans, 1m40s end to end"
+    assert lines[2].startswith('rip        insert')
+    assert lines[2].endswith('|██████    |')
+    assert '20.0s' in lines[3] and lines[3].endswith('|      ··██|')
+    assert lines[-1].split() == ['enhance', '20.0s', '20.0s']
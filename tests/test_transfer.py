@@ -0,0 +1,131 @@
+import errno
+import os
+import sys
+
+import pytest
+import redis
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                'services', 'blackhole_integration'))
+
+import transfer as transfer_module  # noqa: E402
+from transfer import TransferEngine, temp_path  # noqa: E402
+from transfer_journal import TransferJournal  # noqa: E402
+
+def redis_client():
+    """
+    Redis client for journaled transfers; skips the test without a server.
+    """
+    client = redis.from_url('redis://localhost:6379', decode_responses=True)
+    try:
+        client.ping()
+    except redis.ConnectionError:
+        pytest.skip("Redis not available")
+    return client
+
+def make_file(path, size):
+    """
+    Write *size* bytes of non-repeating data to *path*.
+    """
+    data = os.urandom(size)
+    path.write_bytes(data)
+    return data
+
+def test_same_device_move_is_a_rename(tmp_path):
+    """
+    A move within one filesystem keeps the inode and removes the source.
+    """
+    source = tmp_path / 'title.mkv'
+    make_file(source, 1024)
+    inode = source.stat().st_ino
+    (tmp_path / 'plex').mkdir()
+    target = str(tmp_path / 'plex' / 'Title (2000).mkv')
+
+    result = TransferEngine().transfer(str(source), target)
+    assert result['method'] == 'rename'
+    assert os.stat(target).st_ino == inode
+    assert not source.exists()
+
+def test_keep_source_links_instead_of_moving(tmp_path):
+    """
+    With the source kept, a same-device transfer hardlinks it.
+    """
+    source = tmp_path / 'title.mkv'
+    make_file(source, 1024)
+    target = str(tmp_path / 'linked.mkv')
+
+    result = TransferEngine().transfer(str(source), target, keep_source=True)
+    assert result['method'] == 'hardlink'
+    assert source.exists() and os.stat(target).st_ino == source.stat().st_ino
+
+def test_chunked_copy_across_devices(tmp_path, monkeypatch):
+    """
+    Cross-device copies go through a temp file in chunks and match the source.
+    """
+    monkeypatch.setattr(transfer_module, 'same_device', lambda source, target: False)
+    pairs = []
+    for i in range(3):
+        source = tmp_path / f'title_t0{i}.mkv'
+        pairs.append((str(source), str(tmp_path / f'out_{i}.mkv'), make_file(source, 300_000 + i)))
+
+    engine = TransferEngine(mode='copy', workers=3, chunk_size=64 * 1024)
+    results = engine.transfer_all([(source, target) for source, target, _data in pairs])
+    for (source, target, data), result in zip(pairs, results):
+        assert result['method'] == 'copy' and result['bytes'] == len(data)
+        with open(target, 'rb') as fp:
+            assert fp.read() == data
+        assert not os.path.exists(source)
+        assert not os.path.exists(temp_path(target))
+
+def test_replayed_transfer_with_missing_source(tmp_path):
+    """
+    A source that is gone after a journaled delivery counts as already delivered.
+    """
+    source = tmp_path / 'title.mkv'
+    make_file(source, 2048)
+    target = str(tmp_path / 'Title (2000).mkv')
+    engine = TransferEngine(journal=TransferJournal(redis_client(), ttl=60))
+    engine.transfer(str(source), target)
+
+    result = engine.transfer(str(source), target)
+    assert result['method'] == 'already_transferred' and result['bytes'] == 2048
+
+def test_unjournaled_target_is_not_a_delivery(tmp_path):
+    """
+    A missing source fails even if some file already sits at the target.
+    """
+    target = tmp_path / 'Title (2000).mkv'
+    make_file(target, 2048)
+    with pytest.raises(FileNotFoundError):
+        TransferEngine().transfer(str(tmp_path / 'gone.mkv'), str(target))
+
+def test_interrupted_copy_resumes_from_journal(tmp_path, monkeypatch):
+    """
+    A copy that failed midway resumes at the journaled offset and verifies the whole file.
+    """
+    client = redis_client()
+    monkeypatch.setattr(transfer_module, 'same_device', lambda source, target: False)
+    source = tmp_path / 'title.mkv'
+    data = make_file(source, 10 * 1024 + 100)
+    target = str(tmp_path / 'out.mkv')
+    journal = TransferJournal(client, ttl=60)
+    engine = TransferEngine(mode='copy', chunk_size=1024, journal=journal, verify='stream')
+
+    real_pwrite = os.pwrite
+    def failing_pwrite(fd, chunk, offset):
+        if offset >= 4096:
+            raise OSError(errno.EIO, "disk went away")
+        return real_pwrite(fd, chunk, offset)
+    monkeypatch.setattr(transfer_module.os, 'pwrite', failing_pwrite)
+    with pytest.raises(OSError):
+        engine.transfer(str(source), target)
+    assert journal.load(str(source), target)['offset'] == 4096
+    assert source.exists()
+
+    monkeypatch.setattr(transfer_module.os, 'pwrite', real_pwrite)
+    result = engine.transfer(str(source), target)
+    assert result['resumed_from'] == 4096
+    assert result['checksum'] == engine.file_checksum(target)
+    with open(target, 'rb') as fp:
+        assert fp.read() == data
+    assert not source.exists()